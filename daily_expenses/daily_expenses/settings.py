@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'expenses.middleware.ProfilingMiddleware',
+    'expenses.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +52,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Request profiling (expenses.middleware.ProfilingMiddleware). Off unless
+# EXPENSES_PROFILING is True; results are served at /metrics/.
+
+EXPENSES_PROFILING = False
+EXPENSES_PROFILING_SAMPLE_RATE = 0.0
+EXPENSES_PROFILING_KEEP_SLOWEST = 10
+
 ROOT_URLCONF = 'daily_expenses.urls'
 
 TEMPLATES = [
@@ -82,9 +91,89 @@ DATABASES = {
         'PASSWORD': 'Dot1.one',
         'HOST': 'localhost',
         'PORT': '3306',
+        # Keep connections open between requests, checking them before reuse.
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Read replica for the read-only expense views. Add its connection to
+# DATABASES (with the same CONN_MAX_AGE/CONN_HEALTH_CHECKS) and set
+# EXPENSES_READ_REPLICA to its alias. For EXPENSES_REPLICA_LAG seconds
+# after a write, the writing client and readers of the changed users stay
+# on the primary. settings_replica.py runs this on two local SQLite files.
+
+DATABASE_ROUTERS = ['expenses.routers.ReplicaRouter']
+EXPENSES_READ_REPLICA = None
+EXPENSES_REPLICA_LAG = 5
+
+
+# Cache used for the read endpoints in expenses.views. Point
+# EXPENSES_CACHE_ALIAS at another configured cache (e.g. Redis or
+# Memcached) to share entries between worker processes.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'daily-expenses',
     }
 }
 
+EXPENSES_CACHE_ALIAS = 'default'
+EXPENSES_CACHE_TIMEOUT = 300
+
+
+# POST /add/ and /add/batch/ accept an Idempotency-Key header. Stored
+# responses are replayed for EXPENSES_IDEMPOTENCY_TTL seconds; purge older
+# keys with "python manage.py purge_idempotency_keys". A duplicate waits up
+# to EXPENSES_IDEMPOTENCY_WAIT seconds for the original request, and a
+# key left in progress for EXPENSES_IDEMPOTENCY_LOCK_TIMEOUT seconds is
+# given to the next retry.
+
+EXPENSES_IDEMPOTENCY_TTL = 86400
+EXPENSES_IDEMPOTENCY_WAIT = 5
+EXPENSES_IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+
+# Per-worker user directory (expenses.directory): an LRU cache of user
+# details and a Bloom filter over emails that pre-screens duplicate signups.
+
+EXPENSES_USER_CACHE_SIZE = 10000
+EXPENSES_USER_CACHE_TIMEOUT = 60
+EXPENSES_EMAIL_FILTER_CAPACITY = 100000
+EXPENSES_EMAIL_FILTER_ERROR_RATE = 0.01
+
+
+# "python manage.py archive_expenses" moves expense rows older than this
+# many days into the ArchivedExpense table. Listings and balance sheets
+# read only the live table unless called with ?include_archived=1.
+
+EXPENSES_ARCHIVE_AFTER_DAYS = 365
+
+
+# Event name search (GET /events/?q= and /user/<id>/search/?q=) uses the
+# database's full-text index: FTS5 on SQLite, FULLTEXT on MySQL. Other
+# databases fall back to an in-process prefix index. Set to 'fts5',
+# 'fulltext' or 'memory' to choose one; after switching away from an
+# index run "python manage.py rebuild_search_index" before switching back.
+# Keep EXPENSES_FULLTEXT_MIN_TOKEN_SIZE equal to MySQL's
+# innodb_ft_min_token_size: shorter words are searched without the index.
+
+EXPENSES_SEARCH_BACKEND = None
+EXPENSES_FULLTEXT_MIN_TOKEN_SIZE = 3
+
+
+# Queued balance-sheet exports (POST /export/<user_id>/) are written here
+# by "python manage.py run_export_worker". A job still RUNNING after
+# EXPENSES_EXPORT_JOB_TIMEOUT seconds is handed to another worker.
+
+EXPENSES_EXPORT_DIR = BASE_DIR / 'exports'
+EXPENSES_EXPORT_JOB_TIMEOUT = 600
+# Processes that render one queued export in parallel; 1 streams it from
+# the worker itself.
+EXPENSES_EXPORT_WORKERS = 1
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -104,6 +193,34 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing and login for expenses.User. The first hasher creates
+# new hashes; raising EXPENSES_PASSWORD_ITERATIONS rehashes stored
+# passwords on the next successful login.
+
+PASSWORD_HASHERS = [
+    'expenses.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+EXPENSES_PASSWORD_ITERATIONS = 720000
+# Threads that hash the passwords of one batch signup in parallel.
+EXPENSES_PASSWORD_HASH_WORKERS = 4
+
+# Login attempts allowed per (count, seconds) sliding window, per user id
+# (failed attempts only) and per client IP, and the lifetime of issued
+# tokens in seconds.
+EXPENSES_LOGIN_USER_RATE = (10, 60)
+EXPENSES_LOGIN_IP_RATE = (30, 60)
+# Reverse proxies in front of the app that append to X-Forwarded-For. With
+# the default 0 the per-IP budget uses REMOTE_ADDR, which behind a proxy
+# puts every client in one bucket.
+EXPENSES_TRUSTED_PROXY_COUNT = 0
+EXPENSES_TOKEN_MAX_AGE = 86400
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
 
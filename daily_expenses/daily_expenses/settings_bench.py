@@ -0,0 +1,36 @@
+"""
+Settings for running the benchmark commands against a local SQLite
+database instead of the MySQL server configured in settings.py.
+
+    python manage.py migrate --settings=daily_expenses.settings_bench
+    python manage.py benchmark_asgi --settings=daily_expenses.settings_bench
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+ALLOWED_HOSTS = ['testserver', 'localhost']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'bench.sqlite3',
+        'OPTIONS': {
+            'timeout': 30,
+        },
+    }
+}
+
+# Measure the views themselves, not the response cache.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'daily-expenses',
+    },
+    'bench': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+
+EXPENSES_CACHE_ALIAS = 'bench'
@@ -0,0 +1,34 @@
+"""
+Lean settings for the API worker processes. The API only serves JSON and
+files, so the admin, sessions, messages, static files and templates are
+left out. This keeps their modules from being imported at startup and cuts
+the cold-start time and memory of every worker.
+
+    DJANGO_SETTINGS_MODULE=daily_expenses.settings_production  # in the WSGI/ASGI server environment
+    python manage.py benchmark_startup --settings=daily_expenses.settings_bench
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DEBUG = False
+
+# Add the host names the API is served under.
+ALLOWED_HOSTS = ['localhost', '127.0.0.1']
+
+INSTALLED_APPS = [
+    'expenses',
+]
+
+MIDDLEWARE = [
+    'expenses.middleware.ProfilingMiddleware',
+    'expenses.middleware.ReplicaRoutingMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+TEMPLATES = []
+
+# Django's own password validators are never called by the API.
+AUTH_PASSWORD_VALIDATORS = []
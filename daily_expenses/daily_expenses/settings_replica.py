@@ -0,0 +1,30 @@
+"""
+Settings with two local SQLite databases standing in for a primary and
+a read replica, to try out expenses.routers.ReplicaRouter.
+
+    python manage.py migrate --settings=daily_expenses.settings_replica
+    python manage.py migrate --database=replica --settings=daily_expenses.settings_replica
+    python manage.py test --settings=daily_expenses.settings_replica
+
+Nothing copies rows from the primary to the replica, so reads that reach
+the replica only see what was migrated or loaded into it.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'primary.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+EXPENSES_READ_REPLICA = 'replica'
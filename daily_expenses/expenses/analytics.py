@@ -0,0 +1,176 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.db import connections, router, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncDay, TruncMonth, TruncWeek
+from django.utils.timezone import localtime
+from .models import Expense, ExpenseRollup
+from .queries import parse_boundary
+from .archive import expense_models, include_archived
+from .balances import exact_sum
+
+PERIODS = {
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+ROLLUP_KEY = ('user_id', 'bucket', 'split_method')
+
+
+def apply_rollups(expenses):
+    """
+    Add newly written Expense rows to the daily ExpenseRollup rows. Must run
+    inside the writing transaction. Missing rows are created first, then
+    every touched row is incremented in place with one executemany, so no
+    rollup has to be read or locked and the cost stays at two queries
+    however many buckets the rows touch.
+    """
+    deltas = defaultdict(lambda: [Decimal(0), 0])
+    for expense in expenses:
+        delta = deltas[(expense.user_id, localtime(expense.created_at).date(), expense.split_method)]
+        delta[0] += Decimal(expense.amount)
+        delta[1] += 1
+    if not deltas:
+        return
+
+    ExpenseRollup.objects.bulk_create([
+        ExpenseRollup(user_id=user_id, bucket=bucket, split_method=split_method)
+        for user_id, bucket, split_method in deltas
+    ], ignore_conflicts=True)
+
+    connection = connections[router.db_for_write(ExpenseRollup)]
+    quote, ops = connection.ops.quote_name, connection.ops
+    sql = (
+        f'UPDATE {quote(ExpenseRollup._meta.db_table)} '
+        f'SET {quote("amount")} = {quote("amount")} + %s, {quote("count")} = {quote("count")} + %s '
+        f'WHERE {quote("user_id")} = %s AND {quote("bucket")} = %s AND {quote("split_method")} = %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            (ops.adapt_decimalfield_value(amount), count, user_id, ops.adapt_datefield_value(bucket), split_method)
+            for (user_id, bucket, split_method), (amount, count) in deltas.items()
+        ])
+
+
+def computed_rollups():
+    # Rollups cover the whole history, archived rows included.
+    rollups = defaultdict(lambda: (Decimal(0), 0))
+    for model in expense_models(True):
+        totals = (model.objects.annotate(bucket=TruncDate('created_at'))
+                  .values(*ROLLUP_KEY).annotate(amount=Sum('amount'), count=Count('id')).order_by())
+        for row in totals:
+            key = tuple(row[field] for field in ROLLUP_KEY)
+            amount, count = rollups[key]
+            rollups[key] = (amount + exact_sum(row['amount']), count + row['count'])
+    return dict(rollups)
+
+
+def rebuild_rollups():
+    rollups = [
+        ExpenseRollup(user_id=user_id, bucket=bucket, split_method=split_method, amount=amount, count=count)
+        for (user_id, bucket, split_method), (amount, count) in computed_rollups().items()
+    ]
+    with transaction.atomic():
+        ExpenseRollup.objects.all().delete()
+        ExpenseRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+def verify_rollups():
+    """
+    Compare the stored rollups with ones recomputed from the raw Expense
+    rows and return the ``(user_id, bucket, split_method)`` keys that
+    disagree.
+    """
+    expected = computed_rollups()
+    stored = {
+        tuple(row[:3]): tuple(row[3:])
+        for row in ExpenseRollup.objects.filter(count__gt=0).values_list(*ROLLUP_KEY, 'amount', 'count')
+    }
+    return sorted(key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key))
+
+
+def parse_period(value):
+    period = value or 'day'
+    if period not in PERIODS:
+        raise ValueError('Invalid period')
+    return period
+
+
+def filter_range(queryset, params, field, as_date=False):
+    # ``as_date`` compares against a DateField such as ExpenseRollup.bucket,
+    # which only has day resolution.
+    if params.get('from'):
+        start, _ = parse_boundary(params['from'])
+        queryset = queryset.filter(**{f'{field}__gte': localtime(start).date() if as_date else start})
+    if params.get('to'):
+        end, whole_day = parse_boundary(params['to'])
+        if as_date:
+            queryset = queryset.filter(**{f'{field}__lte': localtime(end).date()})
+        elif whole_day:
+            queryset = queryset.filter(**{f'{field}__lt': end + timedelta(days=1)})
+        else:
+            queryset = queryset.filter(**{f'{field}__lte': end})
+    if params.get('split_method'):
+        if params['split_method'] not in dict(Expense.SPLIT_METHOD_CHOICES):
+            raise ValueError('Invalid split method')
+        queryset = queryset.filter(split_method=params['split_method'])
+    return queryset
+
+
+def money(value):
+    return str(exact_sum(value))
+
+
+def period_label(value):
+    return value.date().isoformat() if hasattr(value, 'date') else value.isoformat()
+
+
+def user_spend(user_id, params):
+    """
+    Spend of one user per day, week or month (``params['period']``), read
+    from the daily rollups with one aggregate query. Each bucket carries
+    its total plus a per split method breakdown.
+    """
+    period = parse_period(params.get('period'))
+    rollups = filter_range(ExpenseRollup.objects.filter(user_id=user_id), params, 'bucket', as_date=True)
+    rows = (rollups.annotate(period=PERIODS[period]('bucket')).values('period', 'split_method')
+            .annotate(amount=Sum('amount'), count=Sum('count')).order_by('period', 'split_method'))
+
+    buckets = {}
+    for row in rows:
+        bucket = buckets.setdefault(row['period'], {
+            'period': period_label(row['period']), 'amount': Decimal(0), 'count': 0, 'split_methods': {},
+        })
+        bucket['amount'] += Decimal(row['amount'])
+        bucket['count'] += row['count']
+        bucket['split_methods'][row['split_method']] = {'amount': money(row['amount']), 'count': row['count']}
+    return [dict(bucket, amount=money(bucket['amount'])) for bucket in buckets.values()]
+
+
+def user_event_spend(user_id, params):
+    """
+    Spend of one user per Event and day, week or month, aggregated on the
+    database from the user's Expense rows, and from the archived ones too
+    with ``params['include_archived']``. Events that share a name are kept
+    apart; rows are ordered by period and then event id.
+    """
+    period = parse_period(params.get('period'))
+    totals = defaultdict(lambda: [None, Decimal(0), 0])
+    for model in expense_models(include_archived(params)):
+        expenses = filter_range(model.objects.filter(user_id=user_id), params, 'created_at')
+        rows = (expenses.annotate(period=PERIODS[period]('created_at')).values('period', 'event_id', 'event__name')
+                .annotate(amount=Sum('amount'), count=Count('id')).order_by())
+        for row in rows:
+            total = totals[(row['period'], row['event_id'])]
+            total[0] = row['event__name']
+            total[1] += exact_sum(row['amount'])
+            total[2] += row['count']
+    return [{
+        'period': period_label(localtime(period_start)),
+        'event_id': event_id,
+        'Event': name,
+        'amount': money(amount),
+        'count': count,
+    } for (period_start, event_id), (name, amount, count) in sorted(totals.items())]
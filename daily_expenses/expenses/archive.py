@@ -0,0 +1,63 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import ArchivedExpense, Expense
+from .cache import invalidate_users
+
+ARCHIVE_BATCH_SIZE = 5000
+ARCHIVE_FIELDS = ('id', 'event_id', 'user_id', 'payer_id', 'amount', 'split_method', 'created_at')
+
+
+def include_archived(params):
+    return params.get('include_archived', '').lower() in ('1', 'true', 'yes')
+
+
+def expense_models(with_archived):
+    # The tables a read covers: the live one, plus the archive on request.
+    return (Expense, ArchivedExpense) if with_archived else (Expense,)
+
+
+def archive_cutoff(days=None):
+    days = getattr(settings, 'EXPENSES_ARCHIVE_AFTER_DAYS', 365) if days is None else days
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Move the oldest ``batch_size`` Expense rows created before ``cutoff``
+    into ArchivedExpense in one short transaction and return how many were
+    moved. Balances and rollups cover both tables, so they are untouched.
+    """
+    with transaction.atomic():
+        rows = list(Expense.objects.filter(created_at__lt=cutoff).order_by('created_at', 'id')
+                    .values_list(*ARCHIVE_FIELDS)[:batch_size])
+        if not rows:
+            return 0
+        now = timezone.now()
+        ArchivedExpense.objects.bulk_create([
+            ArchivedExpense(archived_at=now, **dict(zip(ARCHIVE_FIELDS, row))) for row in rows
+        ])
+        Expense.objects.filter(id__in=[row[0] for row in rows]).delete()
+        user_ids = {row[2] for row in rows}
+        transaction.on_commit(lambda: invalidate_users(user_ids))
+    return len(rows)
+
+
+def archive_expenses(cutoff, batch_size=ARCHIVE_BATCH_SIZE, pause=0.0, max_batches=None):
+    """
+    Archive every Expense row created before ``cutoff`` batch by batch,
+    yielding the running total after each batch. ``pause`` seconds between
+    batches leave room for other writers while the live table stays online.
+    """
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(cutoff, batch_size)
+        if not moved:
+            break
+        archived += moved
+        batches += 1
+        yield archived
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,73 @@
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+import json
+from .models import User
+from .queries import astream_expenses_grouped_by_user, auser_expense_page
+from .ingest import ExpenseValidationError, aadd_expense_events
+from .directory import directory
+from .routers import replica_reads
+from .cache import cached_response
+from .idempotency import idempotent
+from .archive import include_archived
+from .serializers import JSON_CONTENT_TYPE, astream_json_array, json_response
+from django.views.decorators.csrf import csrf_exempt
+
+@replica_reads()
+@cached_response()
+async def user_details(request, user_id):
+    if request.method == "GET":
+        user = await directory.aget(user_id)
+        if user is None:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        return JsonResponse(user)
+
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@csrf_exempt
+@idempotent
+async def add_expenses(request):
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON input'}, status=400)
+
+        try:
+            expenses = await aadd_expense_events([data])
+        except ExpenseValidationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return JsonResponse({'message': 'Expenses added successfully', 'event_id': expenses[0].event_id})
+
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@replica_reads()
+@csrf_exempt
+@cached_response()
+async def user_expenses(request, user_id):
+    try:
+        user = await User.objects.aget(id=user_id)
+        split_data, next_cursor = await auser_expense_page(user, request.GET)
+
+        if not split_data and not request.GET:
+            return JsonResponse({'error': 'No expenses found for this user'}, status=404)
+
+        response = json_response(split_data)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
+
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=404)
+
+@replica_reads(per_user=False)
+@csrf_exempt
+@cached_response(per_user=False)
+async def overall_expenses(request):
+    total_expenses = astream_expenses_grouped_by_user(include_archived(request.GET))
+
+    if request.GET.get('stream'):
+        return StreamingHttpResponse(astream_json_array(total_expenses), content_type=JSON_CONTENT_TYPE)
+    return HttpResponse(b''.join([chunk async for chunk in astream_json_array(total_expenses)]),
+                        content_type=JSON_CONTENT_TYPE)
@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.core import signing
+from django.utils.crypto import constant_time_compare
+from .models import User
+from .ratelimit import SlidingWindowLimiter
+
+TOKEN_SALT = 'expenses.auth.token'
+# User.password's default, left on users created before passwords were
+# required. Like an empty value, it never matches any password.
+UNSET_PASSWORDS = ('', 'NUll')
+
+user_limiter = SlidingWindowLimiter(*getattr(settings, 'EXPENSES_LOGIN_USER_RATE', (5, 60)))
+ip_limiter = SlidingWindowLimiter(*getattr(settings, 'EXPENSES_LOGIN_IP_RATE', (30, 60)))
+
+
+def client_ip(request):
+    """
+    The address login attempts are counted against. Behind reverse proxies
+    REMOTE_ADDR is the proxy, so set EXPENSES_TRUSTED_PROXY_COUNT to the
+    number of proxies in front of the app: the client is then taken from
+    X-Forwarded-For that many entries from the right, the part the client
+    cannot forge.
+    """
+    proxies = getattr(settings, 'EXPENSES_TRUSTED_PROXY_COUNT', 0)
+    if proxies:
+        forwarded = [part.strip() for part in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def login_retry_after(user_id, client_ip):
+    # Both budgets are charged before the database or the hasher is touched.
+    return max(user_limiter.hit(f'user:{user_id}'), ip_limiter.hit(f'ip:{client_ip}'))
+
+
+def login_succeeded(user_id):
+    # Only failed attempts count against a user's budget, so their own
+    # logins never use it up.
+    user_limiter.refund(f'user:{user_id}')
+
+
+def is_hashed(encoded):
+    try:
+        identify_hasher(encoded)
+    except ValueError:
+        return False
+    return True
+
+
+def verify_password(user, raw_password):
+    """
+    Check ``raw_password`` against the stored hash, rehashing it when the
+    work factor changed. Passwords stored in plain text before hashing was
+    introduced are accepted once and replaced by a hash. Users without a
+    password cannot log in.
+    """
+    def rehash(raw):
+        User.objects.filter(id=user.id).update(password=make_password(raw))
+
+    if user.password in UNSET_PASSWORDS:
+        return False
+    if is_hashed(user.password):
+        return check_password(raw_password, user.password, setter=rehash)
+    if constant_time_compare(raw_password, user.password):
+        rehash(raw_password)
+        return True
+    return False
+
+
+def issue_token(user_id):
+    return signing.dumps({'id': user_id}, salt=TOKEN_SALT)
+
+
+def token_user_id(request):
+    """
+    Return the user id from a valid ``Authorization: Bearer <token>``
+    header, or None. Verifying the signature needs no database access.
+    """
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme != 'Bearer' or not token:
+        return None
+    try:
+        payload = signing.loads(token, salt=TOKEN_SALT, max_age=getattr(settings, 'EXPENSES_TOKEN_MAX_AGE', 86400))
+    except signing.BadSignature:
+        return None
+    return payload.get('id')
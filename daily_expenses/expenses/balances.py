@@ -0,0 +1,129 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from .models import User, UserBalance
+from .archive import expense_models
+from .splits import from_cents, to_cents
+
+AMOUNT_FIELDS = {
+    'EQUAL': ('equal_amount', 'equal_count'),
+    'EXACT': ('exact_amount', 'exact_count'),
+    'PERCENTAGE': ('percentage_amount', 'percentage_count'),
+}
+BALANCE_FIELDS = ['total_amount', 'expense_count', 'net_balance'] + [
+    field for pair in AMOUNT_FIELDS.values() for field in pair
+]
+
+
+def add_to_balance(balance, split_method, amount, count):
+    amount_field, count_field = AMOUNT_FIELDS[split_method]
+    balance.total_amount += amount
+    balance.expense_count += count
+    setattr(balance, amount_field, getattr(balance, amount_field) + amount)
+    setattr(balance, count_field, getattr(balance, count_field) + count)
+
+
+def apply_expenses(expenses):
+    """
+    Fold newly written Expense rows into the UserBalance rows of their users
+    and payers. Must run inside the transaction that wrote the expenses; it
+    takes three queries however many users the rows touch.
+    """
+    deltas = defaultdict(lambda: defaultdict(lambda: [Decimal(0), 0]))
+    net = defaultdict(Decimal)
+    for expense in expenses:
+        delta = deltas[expense.user_id][expense.split_method]
+        delta[0] += Decimal(expense.amount)
+        delta[1] += 1
+        if expense.payer_id is not None and expense.payer_id != expense.user_id:
+            net[expense.payer_id] += Decimal(expense.amount)
+            net[expense.user_id] -= Decimal(expense.amount)
+    user_ids = set(deltas) | set(net)
+    if not user_ids:
+        return
+
+    # Rows are created and locked in user id order, so concurrent writers
+    # always wait on each other in the same order instead of deadlocking.
+    user_ids = sorted(user_ids)
+    UserBalance.objects.bulk_create(
+        [UserBalance(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+    balances = list(UserBalance.objects.select_for_update().filter(user_id__in=user_ids).order_by('user_id'))
+    for balance in balances:
+        for split_method, (amount, count) in deltas.get(balance.user_id, {}).items():
+            add_to_balance(balance, split_method, amount, count)
+        balance.net_balance += net.get(balance.user_id, 0)
+    UserBalance.objects.bulk_update(balances, BALANCE_FIELDS)
+
+
+def exact_sum(value):
+    # SQLite sums decimals as floats, which drift after enough rows.
+    return from_cents(to_cents(value))
+
+
+def computed_balances():
+    balances = {user_id: UserBalance(user_id=user_id) for user_id in User.objects.values_list('id', flat=True)}
+    # Balances are lifetime totals, so archived rows count as well.
+    for model in expense_models(True):
+        totals = model.objects.values('user_id', 'split_method').annotate(amount=Sum('amount'), count=Count('id'))
+        for row in totals.order_by():
+            balance = balances.get(row['user_id'])
+            if balance is not None and row['split_method'] in AMOUNT_FIELDS:
+                add_to_balance(balance, row['split_method'], exact_sum(row['amount']), row['count'])
+        for user_id, net_balance in computed_net_balances(model.objects.all()).items():
+            if user_id in balances:
+                balances[user_id].net_balance += net_balance
+    return balances
+
+
+def computed_net_balances(expenses):
+    """
+    Net balance per user over the ``expenses`` queryset: what others owe a
+    user for the shares they paid minus what the user owes for shares paid
+    by someone else. Rows without a payer or paid by their own user are
+    ignored.
+    """
+    owed = expenses.filter(payer__isnull=False).exclude(payer=F('user')).order_by()
+    net = defaultdict(Decimal)
+    for row in owed.values('payer_id').annotate(amount=Sum('amount')):
+        net[row['payer_id']] += exact_sum(row['amount'])
+    for row in owed.values('user_id').annotate(amount=Sum('amount')):
+        net[row['user_id']] -= exact_sum(row['amount'])
+    return dict(net)
+
+
+def rebuild_balances():
+    """
+    Recompute every UserBalance row from the expense tables. The rows are
+    locked before the totals are read and then updated in place, so writers
+    adding expenses meanwhile wait and apply their change to the rebuilt
+    row rather than having it overwritten.
+    """
+    with transaction.atomic():
+        UserBalance.objects.bulk_create(
+            [UserBalance(user_id=user_id) for user_id in User.objects.order_by('id').values_list('id', flat=True)],
+            ignore_conflicts=True, batch_size=1000)
+        locked = set(UserBalance.objects.select_for_update().order_by('user_id').values_list('user_id', flat=True))
+        balances = computed_balances()
+        UserBalance.objects.bulk_update(
+            [balance for user_id, balance in balances.items() if user_id in locked], BALANCE_FIELDS, batch_size=1000)
+        # Users added after the rows were locked.
+        UserBalance.objects.bulk_create(
+            [balance for user_id, balance in balances.items() if user_id not in locked],
+            ignore_conflicts=True, batch_size=1000)
+    return len(balances)
+
+
+def verify_balances():
+    """
+    Compare every stored UserBalance with one recomputed from the live and
+    archived expense rows and return the user ids that disagree.
+    """
+    expected = computed_balances()
+    stored = UserBalance.objects.in_bulk()
+    mismatched = []
+    for user_id, balance in expected.items():
+        current = stored.get(user_id, UserBalance(user_id=user_id))
+        if any(getattr(balance, field) != getattr(current, field) for field in BALANCE_FIELDS):
+            mismatched.append(user_id)
+    return mismatched
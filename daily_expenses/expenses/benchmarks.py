@@ -0,0 +1,159 @@
+import asyncio
+import random
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext
+from .models import User
+from .ingest import add_expense_events
+
+SEED_BATCH_SIZE = 500
+DEFAULT_SPLIT_SIZES = {2: 4, 3: 3, 5: 2, 10: 1}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_summary(latencies, elapsed):
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies, default=0) * 1000, 2),
+    }
+
+
+def parse_split_sizes(value):
+    """
+    Parse a split-size distribution such as ``"2:5,4:3,20:1"`` (size:weight
+    pairs) into a ``{size: weight}`` dict. A bare size has weight 1.
+    """
+    sizes = {}
+    for part in value.split(','):
+        size, _, weight = part.partition(':')
+        sizes[int(size)] = int(weight or 1)
+    if not sizes or min(sizes) < 1 or min(sizes.values()) < 1:
+        raise ValueError('Split sizes and weights must be positive')
+    return sizes
+
+
+def seed_dataset(user_count, event_count, split_sizes=None, seed=0):
+    """
+    Create ``user_count`` users and ``event_count`` EQUAL split events whose
+    participant count is drawn from the ``{size: weight}`` distribution
+    ``split_sizes``. Expenses go through add_expense_events so the summary
+    tables stay consistent. Returns the ids of all benchmark users.
+    """
+    split_sizes = split_sizes or DEFAULT_SPLIT_SIZES
+    rng = random.Random(seed)
+    start = User.objects.count()
+    User.objects.bulk_create([
+        User(email=f'bench{i}@gmail.com', name=f'Bench {i}', mobile_number='9000000000')
+        for i in range(start, start + user_count)
+    ], batch_size=SEED_BATCH_SIZE)
+    user_ids = list(User.objects.filter(email__startswith='bench').values_list('id', flat=True))
+
+    sizes, weights = list(split_sizes), list(split_sizes.values())
+    events = []
+    for i in range(event_count):
+        size = min(len(user_ids), rng.choices(sizes, weights)[0])
+        events.append({
+            'event': f'Bench event {i}',
+            'amount': rng.randint(1, 500000) / 100,
+            'split_method': 'EQUAL',
+            'splits': rng.sample(user_ids, size),
+        })
+        if len(events) == SEED_BATCH_SIZE:
+            add_expense_events(events)
+            events = []
+    if events:
+        add_expense_events(events)
+    return user_ids
+
+
+def run_wsgi(paths, concurrency):
+    # One thread per simulated worker, each with its own Client and
+    # database connection, the way a threaded WSGI server runs.
+    def worker(chunk):
+        client = Client()
+        latencies = []
+        for path in chunk:
+            started = time.perf_counter()
+            client.get(path)
+            latencies.append(time.perf_counter() - started)
+        connections.close_all()
+        return latencies
+
+    chunks = [paths[i::concurrency] for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = [latency for result in pool.map(worker, chunks) for latency in result]
+    return latency_summary(latencies, time.perf_counter() - started)
+
+
+def run_asgi(paths, concurrency):
+    # ``concurrency`` coroutines share one event loop, the way an ASGI
+    # server drives native async views.
+    async def worker(chunk, latencies):
+        client = AsyncClient()
+        for path in chunk:
+            started = time.perf_counter()
+            await client.get(path)
+            latencies.append(time.perf_counter() - started)
+
+    async def main():
+        latencies = []
+        chunks = [paths[i::concurrency] for i in range(concurrency)]
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(chunk, latencies) for chunk in chunks))
+        return latency_summary(latencies, time.perf_counter() - started)
+
+    return asyncio.run(main())
+
+
+def consume(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+def measure(request, iterations, memory_samples=3):
+    """
+    Call ``request(i)`` ``iterations`` times and report latency percentiles,
+    queries per request and response size. Peak Python memory is taken from
+    ``memory_samples`` extra calls under tracemalloc, which is too slow to
+    leave on while timing.
+    """
+    latencies, queries, sizes = [], [], []
+    started = time.perf_counter()
+    for i in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            request_started = time.perf_counter()
+            sizes.append(consume(request(i)))
+            latencies.append(time.perf_counter() - request_started)
+        queries.append(len(captured))
+    summary = latency_summary(latencies, time.perf_counter() - started)
+
+    peaks = []
+    for i in range(memory_samples):
+        tracemalloc.start()
+        consume(request(iterations + i))
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    summary.update({
+        'queries_avg': round(sum(queries) / len(queries), 2) if queries else 0,
+        'queries_max': max(queries, default=0),
+        'response_bytes_avg': round(sum(sizes) / len(sizes)) if sizes else 0,
+        'peak_memory_kb': round(max(peaks, default=0) / 1024, 1),
+    })
+    return summary
@@ -0,0 +1,170 @@
+import hashlib
+import time
+from asyncio import iscoroutinefunction
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+OVERALL_SCOPE = 'overall'
+CACHED_HEADERS = ['X-Next-Cursor']
+
+
+def get_cache():
+    return caches[getattr(settings, 'EXPENSES_CACHE_ALIAS', 'default')]
+
+
+def version_key(scope):
+    return f'expenses:version:{scope}'
+
+
+def get_version(cache, scope):
+    # A missing version is recreated from the clock rather than restarting
+    # at 1, so an evicted counter can never hand out an old ETag again.
+    key = version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(cache, scope):
+    key = version_key(scope)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+def changed_key(scope):
+    return f'expenses:changed:{scope}'
+
+
+def invalidate_users(user_ids):
+    """
+    Drop every cached response that depends on ``user_ids``: their own
+    entries and the overall listing. Old entries are never read again and
+    simply expire. With a read replica configured the scopes are also
+    marked as recently changed, so their next reads go to the primary.
+    """
+    scopes = [f'user:{user_id}' for user_id in set(user_ids)] + [OVERALL_SCOPE]
+    cache = get_cache()
+    cache.delete_many([version_key(scope) for scope in scopes])
+    lag = getattr(settings, 'EXPENSES_REPLICA_LAG', 0)
+    if getattr(settings, 'EXPENSES_READ_REPLICA', None) and lag > 0:
+        cache.set_many({changed_key(scope): True for scope in scopes}, timeout=lag)
+
+
+def recently_changed(scope):
+    return get_cache().get(changed_key(scope)) is not None
+
+
+def response_key(request, view_name, scope, version):
+    # Returns the cache key, the ETag and, when the client already has this
+    # version, a ready 304 response.
+    path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    key = f'expenses:response:{view_name}:{scope}:{version}:{path_hash}'
+    etag = f'"{hashlib.md5(key.encode()).hexdigest()}"'
+
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return key, etag, response
+    return key, etag, None
+
+
+def lookup(request, view_name, scope):
+    # Like response_key, but also answers from a cached entry.
+    cache = get_cache()
+    key, etag, response = response_key(request, view_name, scope, get_version(cache, scope))
+    if response is None:
+        entry = cache.get(key)
+        response = None if entry is None else cached_entry_response(entry, etag)
+    return key, etag, response
+
+
+async def alookup(request, view_name, scope):
+    cache = get_cache()
+    key, etag, response = response_key(request, view_name, scope, await aget_version(cache, scope))
+    if response is None:
+        entry = await cache.aget(key)
+        response = None if entry is None else cached_entry_response(entry, etag)
+    return key, etag, response
+
+
+def cached_entry_response(entry, etag):
+    content, content_type, headers = entry
+    response = HttpResponse(content, content_type=content_type, headers=headers)
+    response['ETag'] = etag
+    return response
+
+
+def cache_entry(etag, response):
+    # Returns the entry to cache for ``response``, or None when it is not
+    # cached. Streamed bodies are not buffered into the cache, but the ETag
+    # still lets polling clients skip them with a 304.
+    if response.status_code != 200:
+        return None
+    if response.streaming:
+        response['ETag'] = etag
+        return None
+    headers = {name: response[name] for name in CACHED_HEADERS if name in response}
+    return (response.content, response['Content-Type'], headers)
+
+
+def cache_timeout():
+    return getattr(settings, 'EXPENSES_CACHE_TIMEOUT', 300)
+
+
+def store(key, etag, response):
+    entry = cache_entry(etag, response)
+    if entry is None:
+        return response
+    get_cache().set(key, entry, cache_timeout())
+    return cached_entry_response(entry, etag)
+
+
+async def astore(key, etag, response):
+    entry = cache_entry(etag, response)
+    if entry is None:
+        return response
+    await get_cache().aset(key, entry, cache_timeout())
+    return cached_entry_response(entry, etag)
+
+
+def cached_response(per_user=True):
+    """
+    Cache successful GET responses of a JSON view under a versioned key and
+    answer matching If-None-Match headers with 304 before the view or the
+    cache entry is touched. ``per_user`` views are keyed on their
+    ``user_id`` argument, the others on the overall scope. Works for both
+    sync and async views.
+    """
+    def decorator(view):
+        def scope_for(kwargs):
+            return f"user:{kwargs['user_id']}" if per_user else OVERALL_SCOPE
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method != "GET":
+                    return await view(request, *args, **kwargs)
+                key, etag, response = await alookup(request, view.__name__, scope_for(kwargs))
+                if response is None:
+                    response = await astore(key, etag, await view(request, *args, **kwargs))
+                return response
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                return view(request, *args, **kwargs)
+            key, etag, response = lookup(request, view.__name__, scope_for(kwargs))
+            if response is None:
+                response = store(key, etag, view(request, *args, **kwargs))
+            return response
+        return wrapper
+    return decorator
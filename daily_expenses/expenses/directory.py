@@ -0,0 +1,276 @@
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, connection, transaction
+from .models import User
+
+USER_FIELDS = ('id', 'email', 'name', 'mobile_number')
+BULK_BATCH_SIZE = 1000
+
+
+class UserValidationError(ValueError):
+    pass
+
+
+class LRUCache:
+    """
+    Thread-safe in-process mapping that keeps the ``maxsize`` most recently
+    used keys, each for at most ``ttl`` seconds. State lives in the worker
+    process, so each worker has its own copy.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class BloomFilter:
+    """
+    Bloom filter over strings sized for ``capacity`` items. Membership tests
+    never miss an added item and wrongly report about ``error_rate`` of the
+    others while at most ``capacity`` items were added.
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(1, capacity)
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hash_count)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+class UserDirectory:
+    """
+    Per-process front for the users table on the hot paths: user details by
+    id from an LRU cache, and a Bloom filter over every email so that signup
+    can rule out most duplicates without a query. The database stays the
+    authority. A filter hit is confirmed with an indexed lookup, and an
+    email registered by another worker since the filter was built still
+    fails on the unique constraint.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.users = LRUCache(
+            getattr(settings, 'EXPENSES_USER_CACHE_SIZE', 10000),
+            getattr(settings, 'EXPENSES_USER_CACHE_TIMEOUT', 60)
+        )
+        self.emails = None
+        # Emails added while a new filter is being built, or None.
+        self.added = None
+
+    def stored_emails(self):
+        return User.objects.values_list('email', flat=True).iterator(chunk_size=5000)
+
+    def email_filter(self):
+        # Built from one streamed query on first use, and rebuilt larger once
+        # more emails were added than it was sized for. The new filter is
+        # built outside ``lock`` and swapped in; meanwhile other threads keep
+        # using the old one, and only the first build makes them wait.
+        emails = self.emails
+        if emails is not None and emails.count <= emails.capacity:
+            return emails
+        if not self.build_lock.acquire(blocking=emails is None):
+            return emails
+        try:
+            emails = self.emails
+            if emails is not None and emails.count <= emails.capacity:
+                return emails
+            with self.lock:
+                self.added = []
+            capacity = max(getattr(settings, 'EXPENSES_EMAIL_FILTER_CAPACITY', 100000), 2 * User.objects.count())
+            emails = BloomFilter(capacity, getattr(settings, 'EXPENSES_EMAIL_FILTER_ERROR_RATE', 0.01))
+            for email in self.stored_emails():
+                emails.add(email)
+            with self.lock:
+                for email in self.added:
+                    emails.add(email)
+                self.emails = emails
+            return emails
+        finally:
+            with self.lock:
+                self.added = None
+            self.build_lock.release()
+
+    def taken_emails(self, emails):
+        email_filter = self.email_filter()
+        maybe_taken = [email for email in emails if email in email_filter]
+        if not maybe_taken:
+            return set()
+        return set(User.objects.filter(email__in=maybe_taken).values_list('email', flat=True))
+
+    def get(self, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            user = User.objects.filter(id=user_id).values(*USER_FIELDS).first()
+            if user is not None:
+                self.users.set(user_id, user)
+        return user
+
+    async def aget(self, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            user = await User.objects.filter(id=user_id).values(*USER_FIELDS).afirst()
+            if user is not None:
+                self.users.set(user_id, user)
+        return user
+
+    def add(self, users):
+        # Without a filter there is nothing to update: the next build reads
+        # these users from the table.
+        with self.lock:
+            for user in users:
+                if self.emails is not None:
+                    self.emails.add(user.email)
+                if self.added is not None:
+                    self.added.append(user.email)
+        for user in users:
+            self.users.set(user.id, {field: getattr(user, field) for field in USER_FIELDS})
+
+    def clear(self):
+        with self.lock:
+            self.emails = None
+        self.users.clear()
+
+
+directory = UserDirectory()
+
+
+def clean_user(data):
+    if not isinstance(data, dict):
+        raise UserValidationError('Invalid user data')
+    email, mobile_number, name = data.get('email'), data.get('mobile_number'), data.get('name')
+    if not isinstance(email, str) or '@gmail.com' not in email:
+        raise UserValidationError('Invalid email address')
+    if not isinstance(mobile_number, str) or len(mobile_number) != 10:
+        raise UserValidationError('Invalid mobile number')
+    if not isinstance(name, str) or not name or len(name) > 100:
+        raise UserValidationError('Invalid name')
+    return {'email': email, 'name': name, 'mobile_number': mobile_number}
+
+
+def clean_password(data):
+    # Users created without a password get an unusable one.
+    password = data.get('password')
+    if password is not None and (not isinstance(password, str) or not password):
+        raise UserValidationError('Invalid password')
+    return password
+
+
+def hash_passwords(passwords):
+    """
+    Hash ``passwords`` on a pool of EXPENSES_PASSWORD_HASH_WORKERS threads.
+    PBKDF2 runs in hashlib without the GIL, so a batch signup takes about
+    its share of one hash per core instead of one hash per user.
+    """
+    workers = min(len(passwords), getattr(settings, 'EXPENSES_PASSWORD_HASH_WORKERS', 4))
+    if workers <= 1:
+        return [make_password(password) for password in passwords]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(make_password, passwords))
+
+
+def register_user(data):
+    """
+    Validate and create one user. Duplicate emails raise UserValidationError,
+    whether caught by the directory before the password is hashed or by the
+    unique constraint when two signups race.
+    """
+    fields = clean_user(data)
+    password = clean_password(data)
+    if directory.taken_emails([fields['email']]):
+        raise UserValidationError('Email already registered')
+    password = make_password(password)
+    try:
+        with transaction.atomic():
+            user = User.objects.create(**fields, password=password)
+    except IntegrityError:
+        raise UserValidationError('Email already registered')
+    directory.add([user])
+    return user
+
+
+def register_users(items):
+    """
+    Validate ``items`` and create all of them in one transaction with
+    bulk_create. Existing emails are found with a single query for the
+    Bloom filter hits; on any error nothing is written.
+    """
+    users, passwords = [], []
+    for index, data in enumerate(items):
+        try:
+            users.append(User(**clean_user(data)))
+            passwords.append(clean_password(data))
+        except UserValidationError as e:
+            raise UserValidationError(f'User {index}: {e}')
+
+    emails = [user.email for user in users]
+    if len(set(emails)) != len(emails):
+        raise UserValidationError('Duplicate email in request')
+    taken = directory.taken_emails(emails)
+    if taken:
+        raise UserValidationError(f"Email already registered: {', '.join(sorted(taken))}")
+
+    for user, password in zip(users, hash_passwords(passwords)):
+        user.password = password
+    try:
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                User.objects.bulk_create(users, batch_size=BULK_BATCH_SIZE)
+            else:
+                # MySQL cannot return the ids of a bulk insert.
+                for user in users:
+                    user.save()
+    except IntegrityError:
+        raise UserValidationError('Email already registered')
+    directory.add(users)
+    return users
@@ -0,0 +1,190 @@
+import heapq
+import zipfile
+from itertools import chain, count, islice
+from decimal import Decimal
+from .archive import expense_models
+from .serializers import format_timestamps
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+HEADER = ['Name', 'Event', 'Amount', 'Split Method', 'Paid Time']
+CHUNK_SIZE = 2000
+# Excel's limit is 1,048,576 rows per sheet, one of which is the header.
+SHEET_ROW_LIMIT = 1048575
+FLUSH_BYTES = 64 * 1024
+
+CONTENT_TYPES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '{overrides}'
+    '</Types>'
+)
+SHEET_OVERRIDE_XML = (
+    '<Override PartName="/xl/worksheets/sheet{index}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+ROOT_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+WORKBOOK_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets>{sheets}</sheets>'
+    '</workbook>'
+)
+WORKBOOK_SHEET_XML = '<sheet name="{name}" sheetId="{index}" r:id="rId{index}"/>'
+WORKBOOK_RELS_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '{relationships}'
+    '</Relationships>'
+)
+WORKBOOK_REL_XML = (
+    '<Relationship Id="rId{index}" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet{index}.xml"/>'
+)
+SHEET_START_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_END_XML = '</sheetData></worksheet>'
+
+
+class _ChunkSink:
+    # Write-only file object handed to ZipFile. It has no seek/tell, so
+    # zipfile writes data descriptors and never rewinds what was already sent.
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def escape(text):
+    # Same as xml.sax.saxutils.escape, which imports urllib.request and
+    # would add to every worker's startup time.
+    return text.replace('&', '&amp;').replace('>', '&gt;').replace('<', '&lt;')
+
+
+def cell_xml(value):
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def row_xml(values):
+    return '<row>' + ''.join(cell_xml(value) for value in values) + '</row>'
+
+
+def expense_values(querysets, ordering):
+    # Rows are (name, event, amount, split method, created_at), merged from
+    # ``querysets`` in ``ordering``; timestamps are formatted one chunk at a
+    # time.
+    keys = len(ordering)
+    iterator = heapq.merge(*(
+        queryset.order_by(*ordering)
+        .values_list(*ordering, 'user__name', 'event__name', 'amount', 'split_method', 'created_at')
+        .iterator(chunk_size=CHUNK_SIZE)
+        for queryset in querysets
+    ))
+    while batch := list(islice(iterator, CHUNK_SIZE)):
+        paid_times = format_timestamps([row[-1] for row in batch])
+        for row, paid_time in zip(batch, paid_times):
+            yield [*row[keys:-1], paid_time]
+
+
+def individual_rows(user, with_archived=False):
+    return expense_values(
+        [model.objects.filter(user_id=user.id) for model in expense_models(with_archived)], ['id'])
+
+
+def total_rows(with_archived=False):
+    return expense_values([model.objects.all() for model in expense_models(with_archived)], ['user_id', 'id'])
+
+
+def sheet_title(title, part):
+    return title if part == 0 else f'{title} ({part + 1})'
+
+
+def workbook_parts(titles):
+    # The package files other than the sheets, for sheets 1..len(titles).
+    indexes = range(1, len(titles) + 1)
+    return [
+        ('[Content_Types].xml', CONTENT_TYPES_XML.format(
+            overrides=''.join(SHEET_OVERRIDE_XML.format(index=index) for index in indexes))),
+        ('_rels/.rels', ROOT_RELS_XML),
+        ('xl/workbook.xml', WORKBOOK_XML.format(sheets=''.join(
+            WORKBOOK_SHEET_XML.format(name=escape(title), index=index) for index, title in zip(indexes, titles)))),
+        ('xl/_rels/workbook.xml.rels', WORKBOOK_RELS_XML.format(
+            relationships=''.join(WORKBOOK_REL_XML.format(index=index) for index in indexes))),
+    ]
+
+
+def stream_workbook(sheets, sheet_rows=SHEET_ROW_LIMIT):
+    """
+    Yield an XLSX file chunk by chunk. ``sheets`` is a list of
+    ``(title, rows)`` pairs where ``rows`` is any iterable of value lists, so
+    only one compressed chunk is ever held in memory at a time. A sheet with
+    more than ``sheet_rows`` rows continues on "<title> (2)" and so on. The
+    workbook index is written after the sheets, once their number is known.
+    """
+    sink = _ChunkSink()
+    titles = []
+
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for title, rows in sheets:
+            rows = iter(rows)
+            for part in count():
+                if part:
+                    # Only continue on a new sheet if rows are left over.
+                    first = next(rows, None)
+                    if first is None:
+                        break
+                    rows = chain([first], rows)
+                titles.append(sheet_title(title, part))
+                with archive.open(f'xl/worksheets/sheet{len(titles)}.xml', 'w') as sheet:
+                    sheet.write(SHEET_START_XML.encode())
+                    sheet.write(row_xml(HEADER).encode())
+                    written = 0
+                    for values in islice(rows, sheet_rows):
+                        sheet.write(row_xml(values).encode())
+                        written += 1
+                        if sink.size >= FLUSH_BYTES:
+                            yield sink.drain()
+                    sheet.write(SHEET_END_XML.encode())
+                yield sink.drain()
+                if written < sheet_rows:
+                    break
+
+        for name, content in workbook_parts(titles):
+            archive.writestr(name, content)
+
+    yield sink.drain()
+
+
+def balance_sheet_stream(user, with_archived=False):
+    return stream_workbook([
+        ('Individual Expenses', individual_rows(user, with_archived)),
+        ('Total Expenses', total_rows(with_archived)),
+    ])
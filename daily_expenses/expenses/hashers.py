@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 with the iteration count taken from EXPENSES_PASSWORD_ITERATIONS.
+    Hashes stay in Django's pbkdf2_sha256 format, so changing the setting
+    makes check_password rehash stored passwords on the next login.
+    """
+    @property
+    def iterations(self):
+        return getattr(settings, 'EXPENSES_PASSWORD_ITERATIONS', PBKDF2PasswordHasher.iterations)
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import time
+from asyncio import iscoroutinefunction
+from datetime import timedelta
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from .models import IdempotencyKey
+
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+
+
+def fingerprint(request):
+    # A key may only be replayed for the same endpoint and body.
+    digest = hashlib.sha256(f'{request.method} {request.path}\n'.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def claim(key, digest):
+    """
+    Return ``(record, claimed)`` for ``key``. ``claimed`` means this request
+    inserted the key, or took over one that has expired or whose request
+    was abandoned, and must now run the view. The unique index on ``key``
+    lets only one of several concurrent duplicates claim it.
+    """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=key, fingerprint=digest, created_at=now, locked_at=now), True
+    except IntegrityError:
+        record = IdempotencyKey.objects.filter(key=key).first()
+    if record is None:
+        # Released or purged since the insert failed.
+        return claim(key, digest)
+
+    expired = record.created_at < now - timedelta(seconds=getattr(settings, 'EXPENSES_IDEMPOTENCY_TTL', 86400))
+    abandoned = record.status_code is None and record.locked_at < now - timedelta(
+        seconds=getattr(settings, 'EXPENSES_IDEMPOTENCY_LOCK_TIMEOUT', 60))
+    if expired or abandoned:
+        taken = IdempotencyKey.objects.filter(
+            id=record.id, created_at=record.created_at, locked_at=record.locked_at
+        ).update(fingerprint=digest, status_code=None, content_type='', response=None, created_at=now, locked_at=now)
+        if taken:
+            record.refresh_from_db()
+            return record, True
+        record.refresh_from_db()
+    return record, False
+
+
+def store(record, response):
+    IdempotencyKey.objects.filter(id=record.id).update(
+        status_code=response.status_code, content_type=response['Content-Type'], response=response.content)
+
+
+def release(record):
+    # Nothing was stored for the request, so a retry runs it again.
+    IdempotencyKey.objects.filter(id=record.id, status_code__isnull=True).delete()
+
+
+def replay(record, digest):
+    if record.fingerprint != digest:
+        return JsonResponse({'error': 'Idempotency-Key was used for a different request'}, status=422)
+    if record.status_code is None:
+        response = JsonResponse({'error': 'A request with this Idempotency-Key is in progress'}, status=409)
+        response['Retry-After'] = '1'
+        return response
+    response = HttpResponse(bytes(record.response), status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Honour an ``Idempotency-Key`` header on POST requests. The first
+    request with a key runs the view. Its response is stored in the same
+    transaction as the view's writes; on a server error that transaction
+    is rolled back instead and the key released, so a retry runs the view
+    again. Retries with the same key and body get the stored response back
+    from one indexed lookup. A duplicate that arrives while the first is
+    still running waits up to EXPENSES_IDEMPOTENCY_WAIT seconds for its
+    result and then gets a 409. Reusing a key for a different body is a
+    422. Async views store the response after the view has run, as
+    transaction.atomic is only available to sync code. Their writes are
+    committed by then, so a server error is stored like any other
+    response rather than risk running them twice.
+    """
+    def parse_key(request):
+        key = request.headers.get('Idempotency-Key') if request.method == "POST" else None
+        if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+            raise ValueError('Invalid Idempotency-Key')
+        return key
+
+    def waiting(record, claimed, digest, deadline):
+        return not claimed and record.status_code is None and record.fingerprint == digest and time.monotonic() < deadline
+
+    def wait_deadline():
+        return time.monotonic() + getattr(settings, 'EXPENSES_IDEMPOTENCY_WAIT', 5)
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            try:
+                key = parse_key(request)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            if key is None:
+                return await view(request, *args, **kwargs)
+
+            digest, deadline = fingerprint(request), wait_deadline()
+            record, claimed = await sync_to_async(claim)(key, digest)
+            while waiting(record, claimed, digest, deadline):
+                await asyncio.sleep(POLL_INTERVAL)
+                record, claimed = await sync_to_async(claim)(key, digest)
+            if not claimed:
+                return replay(record, digest)
+
+            try:
+                response = await view(request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(release)(record)
+                raise
+            await sync_to_async(store)(record, response)
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            key = parse_key(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        if key is None:
+            return view(request, *args, **kwargs)
+
+        digest, deadline = fingerprint(request), wait_deadline()
+        record, claimed = claim(key, digest)
+        while waiting(record, claimed, digest, deadline):
+            time.sleep(POLL_INTERVAL)
+            record, claimed = claim(key, digest)
+        if not claimed:
+            return replay(record, digest)
+
+        try:
+            with transaction.atomic():
+                response = view(request, *args, **kwargs)
+                if response.status_code >= 500:
+                    transaction.set_rollback(True)
+                else:
+                    store(record, response)
+        except BaseException:
+            release(record)
+            raise
+        if response.status_code >= 500:
+            release(record)
+        return response
+    return wrapper
+
+
+def purge_expired_keys():
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'EXPENSES_IDEMPOTENCY_TTL', 86400))
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,213 @@
+import csv
+import io
+import zipfile
+from collections import deque
+from datetime import datetime
+from decimal import InvalidOperation
+from django.utils.timezone import is_naive, make_aware
+from .models import User, Event, Expense
+from .ingest import MAX_AMOUNT_CENTS, SPLIT_METHODS, save_expenses
+from .queries import parse_boundary
+from .splits import from_cents, to_cents
+
+IMPORT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+REQUIRED_COLUMNS = {'event', 'user_id', 'amount'}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class UnreadableRowsError(ImportFormatError):
+    # Raised while reading rows, when the rest of the file cannot be read.
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+
+
+def normalize_header(header):
+    names = [str(name or '').strip().lower().replace(' ', '_') for name in header]
+    missing = REQUIRED_COLUMNS.difference(names)
+    if missing:
+        raise ImportFormatError(f"Missing columns: {', '.join(sorted(missing))}")
+    return names
+
+
+def read_csv_rows(fileobj):
+    # ``fileobj`` is binary; rows are decoded as they are read. The header
+    # is checked straight away, the rows are parsed lazily and an error in
+    # them ends the rows with UnreadableRowsError.
+    reader = csv.reader(io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline=''))
+    try:
+        names = normalize_header(next(reader, []))
+    except UnicodeDecodeError:
+        raise ImportFormatError('Invalid csv file, expected UTF-8 text')
+    except csv.Error as e:
+        raise ImportFormatError(f'Invalid csv file: {e}')
+
+    def generate():
+        line = 1
+        try:
+            for line, values in enumerate(reader, start=2):
+                if any(values):
+                    yield line, dict(zip(names, values))
+        except UnicodeDecodeError:
+            raise UnreadableRowsError(line + 1, 'Invalid csv file, expected UTF-8 text; the rest of the file was not read')
+        except csv.Error as e:
+            raise UnreadableRowsError(line + 1, f'Invalid csv file: {e}; the rest of the file was not read')
+    return generate()
+
+
+def read_xlsx_rows(fileobj):
+    # openpyxl takes longer to import than the rest of the app, so workers
+    # only load it once an xlsx file is actually uploaded.
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    # read_only mode parses the sheet XML lazily, one row at a time.
+    try:
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError):
+        raise ImportFormatError('Invalid xlsx file')
+    rows = workbook.active.iter_rows(values_only=True)
+    try:
+        names = normalize_header(next(rows, ()))
+    except ImportFormatError:
+        workbook.close()
+        raise
+
+    def generate():
+        try:
+            for line, values in enumerate(rows, start=2):
+                if any(value is not None for value in values):
+                    yield line, dict(zip(names, values))
+        finally:
+            workbook.close()
+    return generate()
+
+
+def read_rows(fileobj, file_format):
+    if file_format == 'csv':
+        return read_csv_rows(fileobj)
+    if file_format == 'xlsx':
+        return read_xlsx_rows(fileobj)
+    raise ImportFormatError('Unsupported file format, use csv or xlsx')
+
+
+def file_format_for(name):
+    return name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+
+
+def parse_user_id(value, known_user_ids, message):
+    try:
+        user_id = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(message)
+    if user_id not in known_user_ids:
+        raise ValueError(message)
+    return user_id
+
+
+def parse_paid_time(value):
+    if isinstance(value, datetime):
+        return make_aware(value) if is_naive(value) else value
+    moment, _ = parse_boundary(str(value).strip())
+    return moment
+
+
+def parse_row(row, known_user_ids):
+    """
+    Validate one import row and return ``(event_ref, event fields, Expense)``.
+    Raises ValueError with a message for the row's error report.
+    """
+    name = str(row.get('event') or '').strip()
+    if not name or len(name) > 255:
+        raise ValueError('Invalid event name')
+    split_method = str(row.get('split_method') or 'EXACT').strip().upper()
+    if split_method not in SPLIT_METHODS:
+        raise ValueError('Invalid split method')
+    try:
+        cents = to_cents(row.get('amount'))
+    except (InvalidOperation, TypeError, ValueError):
+        raise ValueError('Invalid amount')
+    if abs(cents) > MAX_AMOUNT_CENTS:
+        raise ValueError('Invalid amount')
+    amount = from_cents(cents)
+
+    user_id = parse_user_id(row.get('user_id'), known_user_ids, 'user mentioned in the split is not found')
+    payer_id = None
+    if row.get('paid_by') not in (None, ''):
+        payer_id = parse_user_id(row['paid_by'], known_user_ids, 'user who paid is not found')
+    expense = Expense(user_id=user_id, payer_id=payer_id, amount=amount, split_method=split_method)
+    if row.get('paid_time') not in (None, ''):
+        expense.created_at = parse_paid_time(row['paid_time'])
+
+    event_ref = str(row.get('event_ref') or '').strip()
+    return event_ref, (name, payer_id, split_method), expense
+
+
+def import_rows(rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Import ``(line, row)`` pairs as expenses and yield a progress report
+    of the counts after every committed chunk. The last report is the
+    final result and also lists the first MAX_REPORTED_ERRORS row errors.
+
+    Each row is one user's share. Consecutive rows with the same non-empty
+    ``event_ref`` form one event, other rows are events of their own.
+    User ids are checked against one bulk-loaded id set, invalid rows are
+    skipped and reported with their line number, and every chunk of about
+    ``chunk_size`` rows is written with bulk_create in its own transaction.
+    """
+    known_user_ids = set(User.objects.values_list('id', flat=True))
+    report = {'rows': 0, 'imported': 0, 'events': 0, 'error_count': 0, 'errors': [], 'done': False}
+    chunk = []
+    current_ref, event = None, None
+
+    def flush():
+        save_expenses(chunk)
+        report['imported'] += len(chunk)
+        chunk.clear()
+        return {key: value for key, value in report.items() if key != 'errors'}
+
+    def add_error(line, error):
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'error': str(error)})
+
+    try:
+        for line, row in rows:
+            report['rows'] += 1
+            try:
+                event_ref, (name, payer_id, split_method), expense = parse_row(row, known_user_ids)
+            except ValueError as e:
+                add_error(line, e)
+                continue
+
+            if not event_ref or event_ref != current_ref:
+                # Chunks only end between events, so an event is never split
+                # across two transactions.
+                if len(chunk) >= chunk_size:
+                    yield flush()
+                event = Event(name=name, payer_id=payer_id, split_method=split_method, created_at=expense.created_at)
+                report['events'] += 1
+                current_ref = event_ref
+            event.amount += expense.amount
+            expense.event = event
+            chunk.append(expense)
+    except UnreadableRowsError as e:
+        # The rows read so far are still imported, and reported with it.
+        add_error(e.line, e)
+
+    if chunk:
+        flush()
+    report['done'] = True
+    yield report
+
+
+def import_all(rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Run import_rows to the end and return its final report. import_rows
+    yields that report last even when ``rows`` is empty.
+    """
+    return deque(import_rows(rows, chunk_size), maxlen=1)[0]
@@ -0,0 +1,152 @@
+from decimal import Decimal, InvalidOperation
+from asgiref.sync import sync_to_async
+from django.db import connection, transaction
+from .models import User, Event, Expense
+from .balances import apply_expenses
+from .analytics import apply_rollups
+from .cache import invalidate_users
+from .splits import from_cents, split_cents, to_cents
+
+BULK_BATCH_SIZE = 1000
+SPLIT_METHODS = dict(Expense.SPLIT_METHOD_CHOICES)
+# Expense.amount has two decimal places, so in cents it has max_digits digits.
+MAX_AMOUNT_CENTS = 10 ** Expense._meta.get_field('amount').max_digits - 1
+
+
+class ExpenseValidationError(ValueError):
+    pass
+
+
+def split_user_ids(data):
+    if data['split_method'] == 'EQUAL':
+        user_ids = list(data['splits'])
+    else:
+        user_ids = [split['user_id'] for split in data['splits']]
+    if data.get('paid_by') is not None:
+        user_ids.append(data['paid_by'])
+    return user_ids
+
+
+def split_amounts(data):
+    split_method = data['split_method']
+    if split_method == 'EQUAL':
+        user_ids = list(data['splits'])
+        cents = split_cents(split_method, data['amount'], len(user_ids))
+    elif split_method == 'EXACT':
+        user_ids = [split['user_id'] for split in data['splits']]
+        cents = split_cents(split_method, None, [split['amount'] for split in data['splits']])
+    else:
+        user_ids = [split['user_id'] for split in data['splits']]
+        percentages = [split['percentage'] for split in data['splits']]
+        if sum(Decimal(str(percentage)) for percentage in percentages) != 100:
+            raise ExpenseValidationError('Percentages must add up to 100')
+        cents = split_cents(split_method, data['amount'], percentages)
+    return [(user_id, from_cents(amount)) for user_id, amount in zip(user_ids, cents)]
+
+
+def build_expenses(data, known_user_ids):
+    """
+    Turn one add_expenses payload into unsaved Expense rows. Every user in
+    the split must be in ``known_user_ids``; nothing is written here.
+    """
+    try:
+        if data['split_method'] not in SPLIT_METHODS:
+            raise ExpenseValidationError('Invalid split method')
+        if not data['splits']:
+            raise ExpenseValidationError('At least one split is required')
+
+        payer_id = data.get('paid_by')
+        if payer_id is not None:
+            payer_id = int(payer_id)
+            if payer_id not in known_user_ids:
+                raise ExpenseValidationError('user who paid is not found')
+
+        expenses = []
+        event = Event(name=data['event'], payer_id=payer_id, split_method=data['split_method'])
+        for user_id, amount in split_amounts(data):
+            user_id = int(user_id)
+            if user_id not in known_user_ids:
+                raise ExpenseValidationError('user mentioned in the split is not found')
+            if abs(to_cents(amount)) > MAX_AMOUNT_CENTS:
+                raise ExpenseValidationError('Amount is too large')
+            event.amount += amount
+            expenses.append(Expense(
+                event=event,
+                user_id=user_id,
+                payer_id=payer_id,
+                amount=amount,
+                split_method=data['split_method']
+            ))
+        return expenses
+    except ExpenseValidationError:
+        raise
+    except (KeyError, TypeError, ValueError, ZeroDivisionError, InvalidOperation):
+        raise ExpenseValidationError('Invalid expense data')
+
+
+def referenced_user_ids(events):
+    user_ids = set()
+    for data in events:
+        try:
+            user_ids.update(int(user_id) for user_id in split_user_ids(data))
+        except (KeyError, TypeError, ValueError):
+            raise ExpenseValidationError('Invalid expense data')
+    return user_ids
+
+
+def build_events(events, known_user_ids):
+    expenses = []
+    for index, data in enumerate(events):
+        try:
+            expenses.extend(build_expenses(data, known_user_ids))
+        except ExpenseValidationError as e:
+            if len(events) > 1:
+                raise ExpenseValidationError(f'Event {index}: {e}')
+            raise
+    return expenses
+
+
+def save_events(expenses):
+    # Saves the unsaved Event of each row; bulk_create then picks up their
+    # ids. MySQL cannot return the ids of a bulk insert, so there each
+    # event is inserted on its own.
+    events = list({id(expense.event): expense.event for expense in expenses if expense.event.pk is None}.values())
+    if connection.features.can_return_rows_from_bulk_insert:
+        Event.objects.bulk_create(events, batch_size=BULK_BATCH_SIZE)
+    else:
+        for event in events:
+            event.save()
+
+
+def save_expenses(expenses):
+    """
+    Write ``expenses`` and their events in one transaction, updating the
+    balance and rollup tables with them. Returns the saved rows.
+    """
+    with transaction.atomic():
+        save_events(expenses)
+        Expense.objects.bulk_create(expenses, batch_size=BULK_BATCH_SIZE)
+        apply_expenses(expenses)
+        apply_rollups(expenses)
+        user_ids = {expense.user_id for expense in expenses}
+        user_ids.update(expense.payer_id for expense in expenses if expense.payer_id is not None)
+        transaction.on_commit(lambda: invalidate_users(user_ids))
+    return expenses
+
+
+def add_expense_events(events):
+    """
+    Validate every event against a single bulk user lookup, then write all
+    of their rows with bulk_create in one transaction. Returns the created
+    Expense rows; on any validation error nothing is written.
+    """
+    known_user_ids = set(User.objects.in_bulk(referenced_user_ids(events)))
+    return save_expenses(build_events(events, known_user_ids))
+
+
+async def aadd_expense_events(events):
+    # The user lookup runs on the async ORM. The write stays in one
+    # transaction.atomic block, which Django only offers to sync code, so it
+    # is handed to the thread that owns the connection.
+    known_user_ids = set(await User.objects.ain_bulk(referenced_user_ids(events)))
+    return await sync_to_async(save_expenses)(build_events(events, known_user_ids))
@@ -0,0 +1,129 @@
+import os
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+from .models import ArchivedExpense, Expense, ExportJob
+from .exports import balance_sheet_stream
+from .parallel_exports import write_balance_sheet
+
+
+def export_dir():
+    path = Path(getattr(settings, 'EXPENSES_EXPORT_DIR', settings.BASE_DIR / 'exports'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def expense_data_version():
+    # Every balance sheet includes the "Total Expenses" sheet, so any new
+    # Expense row, or one moved to the archive, makes all existing artifacts
+    # stale. Both maxima are read from an index; one aggregate per query
+    # keeps SQLite's min/max optimization.
+    last_id = Expense.objects.aggregate(value=Max('id'))['value'] or 0
+    last_archived = ArchivedExpense.objects.aggregate(value=Max('archived_at'))['value']
+    return f"{last_id}:{last_archived.timestamp() if last_archived else 0}"
+
+
+def request_export(user):
+    """
+    Return the export job for ``user`` at the current expense data version
+    and whether it was newly queued. Identical requests share one job
+    through the unique ``(user, data_version)`` constraint, and a finished
+    job is reused until new expenses make it stale. Failed jobs and jobs
+    whose file has gone missing are queued again.
+    """
+    version = expense_data_version()
+    try:
+        with transaction.atomic():
+            return ExportJob.objects.create(user=user, data_version=version), True
+    except IntegrityError:
+        job = ExportJob.objects.get(user=user, data_version=version)
+
+    missing_file = job.status == ExportJob.DONE and not os.path.exists(job.file_path)
+    if job.status == ExportJob.FAILED or missing_file:
+        requeued = ExportJob.objects.filter(id=job.id, status=job.status).update(
+            status=ExportJob.PENDING, error='', file_path='', started_at=None, finished_at=None)
+        job.refresh_from_db()
+        return job, bool(requeued)
+    return job, False
+
+
+def claim_next_job():
+    """
+    Atomically move the oldest pending job, or a running job whose worker
+    gave up more than EXPENSES_EXPORT_JOB_TIMEOUT seconds ago, to RUNNING
+    and return it. The conditional update lets any number of workers poll
+    the same table without handing a job out twice.
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=getattr(settings, 'EXPENSES_EXPORT_JOB_TIMEOUT', 600))
+    candidates = ExportJob.objects.filter(
+        Q(status=ExportJob.PENDING) | Q(status=ExportJob.RUNNING, started_at__lt=expired)
+    ).order_by('created_at', 'id').values_list('id', 'status', 'started_at')[:10]
+
+    for job_id, status, started_at in candidates:
+        claimed = ExportJob.objects.filter(id=job_id, status=status, started_at=started_at).update(
+            status=ExportJob.RUNNING, started_at=now)
+        if claimed:
+            return ExportJob.objects.select_related('user').get(id=job_id)
+    return None
+
+
+def finish_job(job, **fields):
+    # Only the worker holding the current claim finishes the job. One that
+    # ran past EXPENSES_EXPORT_JOB_TIMEOUT has lost it to another worker.
+    return ExportJob.objects.filter(id=job.id, status=ExportJob.RUNNING, started_at=job.started_at).update(
+        finished_at=timezone.now(), **fields)
+
+
+def run_job(job):
+    path = export_dir() / f'balance_sheet_{job.user_id}_{job.id}.xlsx'
+    # Unique per run, so a worker that lost its claim never writes into
+    # the file of the one that took over.
+    partial = path.with_name(f'{path.name}.{uuid.uuid4().hex}.part')
+    try:
+        workers = getattr(settings, 'EXPENSES_EXPORT_WORKERS', 1)
+        with open(partial, 'wb') as output:
+            if workers > 1:
+                write_balance_sheet(job.user, output, workers)
+            else:
+                for chunk in balance_sheet_stream(job.user):
+                    output.write(chunk)
+        os.replace(partial, path)
+    except Exception as e:
+        if partial.exists():
+            partial.unlink()
+        finish_job(job, status=ExportJob.FAILED, error=str(e))
+        return False
+
+    if not finish_job(job, status=ExportJob.DONE, file_path=str(path)):
+        return False
+    discard_stale_exports(job)
+    return True
+
+
+def discard_stale_exports(job):
+    # Older finished jobs of the same user are superseded by ``job``.
+    stale = ExportJob.objects.filter(user_id=job.user_id, id__lt=job.id).exclude(status=ExportJob.RUNNING)
+    for file_path in stale.exclude(file_path='').values_list('file_path', flat=True):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    stale.delete()
+
+
+def process_jobs(limit=None):
+    """
+    Run queued export jobs until the queue is empty or ``limit`` jobs have
+    been processed. Returns the number of jobs run.
+    """
+    processed = 0
+    while limit is None or processed < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from expenses.archive import ARCHIVE_BATCH_SIZE, archive_cutoff, archive_expenses
+from expenses.models import Expense
+
+
+class Command(BaseCommand):
+    help = (
+        'Move Expense rows older than EXPENSES_ARCHIVE_AFTER_DAYS (or --older-than-days) into the '
+        'ArchivedExpense table in small batches, so it can run while the site is serving requests.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, help='Archive rows created more than this many days ago.')
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help='Rows moved per transaction.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches.')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be archived.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        cutoff = archive_cutoff(options['older_than_days'])
+        if options['dry_run']:
+            count = Expense.objects.filter(created_at__lt=cutoff).count()
+            self.stdout.write(f'{count} expenses created before {cutoff.isoformat()} would be archived')
+            return
+
+        archived = 0
+        for archived in archive_expenses(cutoff, options['batch_size'], options['pause'], options['max_batches']):
+            self.stdout.write(f'Archived {archived} expenses')
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} expenses created before {cutoff.isoformat()}'))
@@ -0,0 +1,107 @@
+import json
+import platform
+import random
+import subprocess
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from expenses.models import User
+from expenses.benchmarks import measure, parse_split_sizes, seed_dataset
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic dataset and measure latency percentiles, query counts and peak memory '
+        'for every endpoint. Prints JSON so results can be diffed between commits. '
+        'Run with --settings=daily_expenses.settings_bench for a local SQLite database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--events', type=int, default=5000, help='Expense events to seed; each creates one row per participant.')
+        parser.add_argument('--split-sizes', default='2:4,3:3,5:2,10:1',
+                            help='Participants per event as size:weight pairs, e.g. "2:5,4:3,20:1".')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint.')
+        parser.add_argument('--memory-samples', type=int, default=3, help='Extra requests per endpoint traced for peak memory.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the dataset and request mix.')
+        parser.add_argument('--flush', action='store_true', help='Empty the database before seeding.')
+        parser.add_argument('--reuse', action='store_true', help='Benchmark the existing data without seeding.')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            split_sizes = parse_split_sizes(options['split_sizes'])
+        except ValueError as e:
+            raise CommandError(f'Invalid --split-sizes: {e}')
+
+        if options['flush']:
+            call_command('flush', interactive=False, verbosity=0)
+        if not options['reuse']:
+            if User.objects.exists():
+                raise CommandError('The database is not empty; pass --flush for a reproducible run or --reuse to keep it.')
+            seed_dataset(options['users'], options['events'], split_sizes, seed=options['seed'])
+
+        user_ids = list(User.objects.values_list('id', flat=True))
+        if not user_ids:
+            raise CommandError('No users to benchmark against.')
+        rng = random.Random(options['seed'])
+        client = Client()
+        sizes, weights = list(split_sizes), list(split_sizes.values())
+
+        def create_user(i):
+            return client.post(reverse('home'), data=json.dumps({
+                'email': f'bench-signup-{options["seed"]}-{i}@gmail.com',
+                'name': f'Signup {i}',
+                'mobile_number': '9000000000',
+                'password': 'benchmark'
+            }), content_type='application/json')
+
+        def add_expenses(i):
+            size = min(len(user_ids), rng.choices(sizes, weights)[0])
+            return client.post(reverse('add'), data=json.dumps({
+                'event': f'Benchmark {i}',
+                'amount': rng.randint(1, 500000) / 100,
+                'split_method': 'EQUAL',
+                'splits': rng.sample(user_ids, size)
+            }), content_type='application/json')
+
+        endpoints = {
+            'user_expenses': lambda i: client.get(reverse('user_expenses', args=[rng.choice(user_ids)])),
+            'overall_expenses': lambda i: client.get(reverse('all_expenses')),
+            'download_balance_sheet': lambda i: client.get(reverse('download_balance_sheet', args=[rng.choice(user_ids)])),
+            'create_user': create_user,
+            'add_expenses': add_expenses,
+        }
+        results = {
+            name: measure(request, options['iterations'], options['memory_samples'])
+            for name, request in endpoints.items()
+        }
+
+        output = json.dumps({
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': django.db.connection.vendor,
+            'dataset': {
+                'users': len(user_ids),
+                'events': options['events'] if not options['reuse'] else None,
+                'split_sizes': split_sizes,
+                'seed': options['seed'],
+            },
+            'iterations': options['iterations'],
+            'results': results,
+        }, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
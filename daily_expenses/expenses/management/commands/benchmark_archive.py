@@ -0,0 +1,90 @@
+import json
+import random
+import time
+from datetime import timedelta
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from expenses.archive import archive_cutoff, archive_expenses
+from expenses.benchmarks import DEFAULT_SPLIT_SIZES, measure, seed_dataset
+from expenses.imports import import_all
+from expenses.models import ArchivedExpense, Expense, User
+
+SUMMARY_FIELDS = ('p50_ms', 'p95_ms', 'queries_avg')
+
+
+def history_rows(user_ids, event_count, rng, start):
+    # Import rows for ``event_count`` events paid two to three years ago.
+    sizes, weights = list(DEFAULT_SPLIT_SIZES), list(DEFAULT_SPLIT_SIZES.values())
+    line = 1
+    for i in range(event_count):
+        paid_time = (timezone.now() - timedelta(days=rng.randint(730, 1095))).isoformat()
+        for user_id in rng.sample(user_ids, min(len(user_ids), rng.choices(sizes, weights)[0])):
+            line += 1
+            yield line, {
+                'event_ref': str(start + i),
+                'event': f'History {start + i}',
+                'user_id': user_id,
+                'amount': f'{rng.randint(1, 50000) / 100:.2f}',
+                'paid_time': paid_time,
+            }
+
+
+class Command(BaseCommand):
+    help = (
+        'Grow the expense history step by step, archive it, and measure the hot read endpoints on the '
+        'live table and with include_archived, which costs what reading an unarchived table would. Prints JSON. '
+        'Run with --settings=daily_expenses.settings_bench.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recent-events', type=int, default=2000, help='Recent events, kept in the live table.')
+        parser.add_argument('--history-events', type=int, default=20000, help='Old events added per step.')
+        parser.add_argument('--steps', type=int, default=3)
+        parser.add_argument('--iterations', type=int, default=30, help='Timed requests per endpoint and phase.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--flush', action='store_true', help='Empty the database before seeding.')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            call_command('flush', interactive=False, verbosity=0)
+        if User.objects.exists():
+            raise CommandError('The database is not empty; pass --flush.')
+        rng = random.Random(options['seed'])
+        user_ids = seed_dataset(options['users'], options['recent_events'], seed=options['seed'])
+        client = Client()
+
+        def endpoints(params):
+            return {
+                'user_expenses': lambda i: client.get(reverse('user_expenses', args=[rng.choice(user_ids)]), params),
+                'overall_expenses': lambda i: client.get(reverse('all_expenses'), params),
+                'download_balance_sheet': lambda i: client.get(
+                    reverse('download_balance_sheet', args=[rng.choice(user_ids)]), params),
+            }
+
+        def run(params):
+            return {
+                name: {field: summary[field] for field in SUMMARY_FIELDS}
+                for name, request in endpoints(params).items()
+                for summary in [measure(request, options['iterations'], memory_samples=0)]
+            }
+
+        steps = []
+        for step in range(options['steps']):
+            import_all(history_rows(user_ids, options['history_events'], rng, step * options['history_events']))
+            started = time.perf_counter()
+            for _ in archive_expenses(archive_cutoff()):
+                pass
+            archive_seconds = time.perf_counter() - started
+
+            steps.append({
+                'live_rows': Expense.objects.count(),
+                'archived_rows': ArchivedExpense.objects.count(),
+                'archive_seconds': round(archive_seconds, 2),
+                'live': run({}),
+                'include_archived': run({'include_archived': '1'}),
+            })
+        self.stdout.write(json.dumps(steps, indent=2))
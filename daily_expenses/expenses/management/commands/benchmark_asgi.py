@@ -0,0 +1,45 @@
+import json
+import random
+from django.core.management.base import BaseCommand
+from django.urls import reverse
+from expenses.models import User
+from expenses.benchmarks import run_asgi, run_wsgi, seed_dataset
+
+ENDPOINTS = {
+    'user_details': ('user_details', 'async_user_details'),
+    'user_expenses': ('user_expenses', 'async_user_expenses'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare requests per second and latency percentiles of the sync views '
+        'under a threaded WSGI handler with the async views under an ASGI handler. '
+        'Run with --settings=daily_expenses.settings_bench for a local SQLite database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Users to seed when the database is empty.')
+        parser.add_argument('--events', type=int, default=2000, help='Expense events to seed when the database is empty.')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per endpoint and mode.')
+        parser.add_argument('--concurrency', type=int, default=16, help='Concurrent clients.')
+
+    def handle(self, *args, **options):
+        if not User.objects.exists():
+            seed_dataset(options['users'], options['events'])
+        user_ids = list(User.objects.values_list('id', flat=True))
+
+        rng = random.Random(0)
+        sample = [rng.choice(user_ids) for _ in range(options['requests'])]
+        results = {}
+        for endpoint, (sync_name, async_name) in ENDPOINTS.items():
+            results[endpoint] = {
+                'wsgi': run_wsgi([reverse(sync_name, args=[user_id]) for user_id in sample], options['concurrency']),
+                'asgi': run_asgi([reverse(async_name, args=[user_id]) for user_id in sample], options['concurrency']),
+            }
+
+        self.stdout.write(json.dumps({
+            'users': len(user_ids),
+            'concurrency': options['concurrency'],
+            'results': results,
+        }, indent=2))
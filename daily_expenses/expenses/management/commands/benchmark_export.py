@@ -0,0 +1,97 @@
+import json
+import os
+import random
+import tempfile
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from expenses.exports import balance_sheet_stream
+from expenses.ingest import save_events
+from expenses.models import Event, Expense, User
+from expenses.parallel_exports import write_balance_sheet
+
+SEED_BATCH_SIZE = 5000
+SPLITS_PER_EVENT = 4
+
+
+def seed_rows(row_count, user_count, rng):
+    # Bulk-inserts events and their splits directly, skipping the balance
+    # and rollup tables, which exports never read. Benchmark databases only.
+    users = User.objects.bulk_create([
+        User(email=f'export{i}@gmail.com', name=f'Export {i}', mobile_number='9000000000') for i in range(user_count)
+    ])
+    # MySQL cannot return the ids of a bulk insert, so they are read back.
+    users = list(User.objects.filter(email__in=[user.email for user in users]).order_by('id'))
+    user_ids = [user.id for user in users]
+    for offset in range(0, row_count // SPLITS_PER_EVENT, SEED_BATCH_SIZE):
+        count = min(SEED_BATCH_SIZE, row_count // SPLITS_PER_EVENT - offset)
+        with transaction.atomic():
+            events = [
+                Event(name=f'Export event {offset + i}', split_method='EXACT', amount=0) for i in range(count)
+            ]
+            expenses = [
+                Expense(event=event, user_id=user_id, amount=rng.randint(1, 50000) / 100, split_method='EXACT')
+                for event in events
+                for user_id in rng.sample(user_ids, SPLITS_PER_EVENT)
+            ]
+            # Inserts the events, one at a time where bulk inserts return no ids.
+            save_events(expenses)
+            Expense.objects.bulk_create(expenses, batch_size=SEED_BATCH_SIZE)
+    return users[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a large expense table and time the balance-sheet export with the streaming writer and with '
+        'the sharded multi-process writer at several worker counts. Prints JSON. '
+        'Run with --settings=daily_expenses.settings_bench.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000000, help='Expense rows to seed.')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--workers', default='1,2,4,8', help='Comma-separated worker counts.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--flush', action='store_true', help='Empty the database before seeding.')
+        parser.add_argument('--reuse', action='store_true', help='Benchmark the existing data without seeding.')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            call_command('flush', interactive=False, verbosity=0)
+        if options['reuse']:
+            user = User.objects.order_by('id').first()
+            if user is None:
+                raise CommandError('No users to export.')
+        else:
+            if User.objects.exists():
+                raise CommandError('The database is not empty; pass --flush or --reuse.')
+            user = seed_rows(options['rows'], options['users'], random.Random(options['seed']))
+
+        def timed(write):
+            with tempfile.TemporaryFile() as output:
+                started = time.perf_counter()
+                write(output)
+                elapsed = time.perf_counter() - started
+                return elapsed, output.tell()
+
+        rows = Expense.objects.count()
+        seconds, size = timed(lambda output: output.writelines(balance_sheet_stream(user)))
+        results = {'streaming': {'seconds': round(seconds, 2), 'rows_per_second': round(rows / seconds), 'bytes': size}}
+        baseline = None
+        for workers in (int(value) for value in options['workers'].split(',')):
+            seconds, size = timed(lambda output: write_balance_sheet(user, output, workers))
+            baseline = baseline or seconds
+            results[f'workers_{workers}'] = {
+                'seconds': round(seconds, 2),
+                'rows_per_second': round(rows / seconds),
+                'speedup': round(baseline / seconds, 2),
+                'bytes': size,
+            }
+
+        self.stdout.write(json.dumps({
+            'rows': rows,
+            'cpu_count': os.cpu_count(),
+            'database': Expense.objects.db,
+            'results': results,
+        }, indent=2))
@@ -0,0 +1,141 @@
+import json
+import random
+import time
+from datetime import timedelta
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from expenses.benchmarks import measure
+from expenses.ingest import save_events
+from expenses.models import Event, Expense, User
+from expenses.search import prefix_index, search_backend
+
+SEED_BATCH_SIZE = 5000
+SPLITS_PER_EVENT = 4
+SUMMARY_FIELDS = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_avg')
+WHAT = ['Lunch', 'Dinner', 'Breakfast', 'Coffee', 'Groceries', 'Taxi', 'Movie', 'Rent', 'Electricity', 'Internet',
+        'Snacks', 'Fuel', 'Flight', 'Hotel', 'Concert', 'Pizza', 'Drinks', 'Gift', 'Tickets', 'Parking']
+WHERE = ['with team', 'at office', 'downtown', 'at airport', 'with family', 'in Goa', 'at cafe', 'for party',
+         'near station', 'on weekend']
+
+
+def event_name(rng):
+    return f'{rng.choice(WHAT)} {rng.choice(WHERE)} {rng.randint(1, 500)}'
+
+
+def seed_rows(row_count, user_count, rng):
+    # Bulk-inserts named events over the last year and their splits
+    # directly; the database indexes the names. Benchmark databases only.
+    users = User.objects.bulk_create([
+        User(email=f'search{i}@gmail.com', name=f'Search {i}', mobile_number='9000000000') for i in range(user_count)
+    ])
+    # MySQL cannot return the ids of a bulk insert, so they are read back.
+    users = list(User.objects.filter(email__in=[user.email for user in users]).order_by('id'))
+    user_ids = [user.id for user in users]
+    now = timezone.now()
+    for offset in range(0, row_count // SPLITS_PER_EVENT, SEED_BATCH_SIZE):
+        count = min(SEED_BATCH_SIZE, row_count // SPLITS_PER_EVENT - offset)
+        with transaction.atomic():
+            events = [
+                Event(name=event_name(rng), split_method='EXACT', amount=0,
+                      created_at=now - timedelta(seconds=rng.randint(0, 365 * 86400)))
+                for _ in range(count)
+            ]
+            expenses = [
+                Expense(event=event, user_id=user_id, amount=rng.randint(1, 50000) / 100, split_method='EXACT',
+                        created_at=event.created_at)
+                for event in events
+                for user_id in rng.sample(user_ids, SPLITS_PER_EVENT)
+            ]
+            # Inserts the events, one at a time where bulk inserts return no ids.
+            save_events(expenses)
+            Expense.objects.bulk_create(expenses, batch_size=SEED_BATCH_SIZE)
+    return user_ids
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a large expense table with named events and time event name search: typeahead on '
+        '/events/?q=, a user\'s matches in the last quarter and overall on /user/<id>/search/, per search '
+        'backend, against paging /user/<id>/ and filtering on the client. Prints JSON. '
+        'Run with --settings=daily_expenses.settings_bench.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='Expense rows to seed.')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--backends', help='Comma-separated search backends; defaults to the database\'s and memory.')
+        parser.add_argument('--iterations', type=int, default=200, help='Timed requests per endpoint and backend.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--flush', action='store_true', help='Empty the database before seeding.')
+        parser.add_argument('--reuse', action='store_true', help='Benchmark the existing data without seeding.')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            call_command('flush', interactive=False, verbosity=0)
+        rng = random.Random(options['seed'])
+        if options['reuse']:
+            user_ids = list(User.objects.values_list('id', flat=True))
+            if not user_ids:
+                raise CommandError('No users to search.')
+        else:
+            if User.objects.exists():
+                raise CommandError('The database is not empty; pass --flush or --reuse.')
+            started = time.perf_counter()
+            user_ids = seed_rows(options['rows'], options['users'], rng)
+            self.stderr.write(f'Seeded in {time.perf_counter() - started:.1f}s')
+
+        client = Client()
+        quarter_start = (timezone.now() - timedelta(days=91)).date().isoformat()
+
+        def word():
+            return rng.choice(WHAT).lower()
+
+        endpoints = {
+            'typeahead': lambda i: client.get(reverse('event_list'), {'q': word()[:2 + i % 3], 'limit': 10}),
+            'search_last_quarter': lambda i: client.get(
+                reverse('search_user_expenses', args=[rng.choice(user_ids)]), {'q': word(), 'from': quarter_start}),
+            'search_all': lambda i: client.get(
+                reverse('search_user_expenses', args=[rng.choice(user_ids)]), {'q': f'{word()} {rng.choice(WHERE)[:3]}'}),
+        }
+
+        def client_filter(i):
+            # What clients do without search: page through the listing and
+            # filter the names themselves.
+            user_id, name, params, matched = rng.choice(user_ids), word(), {'from': quarter_start, 'limit': 1000}, []
+            while True:
+                response = client.get(reverse('user_expenses', args=[user_id]), params)
+                matched += [row for row in response.json() if name in row['Event'].lower()]
+                if not response.get('X-Next-Cursor'):
+                    return response
+                params['cursor'] = response['X-Next-Cursor']
+
+        backends = options['backends'] or ','.join(dict.fromkeys([search_backend(connection).name, 'memory']))
+        results = {}
+        for backend in backends.split(','):
+            with override_settings(EXPENSES_SEARCH_BACKEND=backend):
+                build_seconds = None
+                if backend == 'memory':
+                    prefix_index.clear()
+                    started = time.perf_counter()
+                    client.get(reverse('event_list'), {'q': 'a'})
+                    build_seconds = round(time.perf_counter() - started, 2)
+                results[backend] = {
+                    name: {field: summary[field] for field in SUMMARY_FIELDS}
+                    for name, request in endpoints.items()
+                    for summary in [measure(request, options['iterations'], memory_samples=0)]
+                }
+                if build_seconds is not None:
+                    results[backend]['index_build_seconds'] = build_seconds
+        summary = measure(client_filter, max(1, options['iterations'] // 10), memory_samples=0)
+        results['client_filter_last_quarter'] = {field: summary[field] for field in SUMMARY_FIELDS}
+
+        self.stdout.write(json.dumps({
+            'rows': Expense.objects.count(),
+            'events': Event.objects.count(),
+            'database': connection.vendor,
+            'results': results,
+        }, indent=2))
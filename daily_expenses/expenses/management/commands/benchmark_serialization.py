@@ -0,0 +1,80 @@
+import json
+import time
+from decimal import Decimal
+from itertools import islice
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse
+from django.utils.timezone import make_naive
+from expenses.models import User, Event, Expense
+from expenses.ingest import save_expenses
+from expenses.queries import ROW_FIELDS, STREAM_CHUNK_SIZE, expense_rows
+from expenses.serializers import orjson, stream_json_array
+
+BENCH_EMAIL = 'serialization-bench@gmail.com'
+SEED_CHUNK_SIZE = 10000
+
+
+def bench_expense(user, i):
+    amount = Decimal(i % 100000).scaleb(-2)
+    event = Event(name=f'Bench {i}', split_method='EXACT', amount=amount)
+    return Expense(event=event, user_id=user.id, amount=amount, split_method='EXACT')
+
+
+def seed_rows(count):
+    user, _ = User.objects.get_or_create(
+        email=BENCH_EMAIL, defaults={'name': 'Serialization Bench', 'mobile_number': '9000000000'})
+    existing = Expense.objects.filter(user=user).count()
+    for start in range(existing, count, SEED_CHUNK_SIZE):
+        save_expenses([bench_expense(user, i) for i in range(start, min(count, start + SEED_CHUNK_SIZE))])
+    return user
+
+
+def model_instance_path(user, rows):
+    # The listing code before the values_list serializer.
+    splits = Expense.objects.filter(user=user).select_related('event').order_by('id')[:rows]
+    data = [{
+        'Name': user.name,
+        'Event': split.event.name,
+        'amount': split.amount,
+        'split_method': split.split_method,
+        'paid_time': make_naive(split.created_at).strftime('%Y-%m-%d %H:%M:%S')
+    } for split in splits]
+    return len(JsonResponse(data, safe=False).content)
+
+
+def values_list_path(user, rows):
+    iterator = (Expense.objects.filter(user=user).order_by('id').values_list(*ROW_FIELDS)[:rows]
+                .iterator(chunk_size=STREAM_CHUNK_SIZE))
+    chunks = iter(lambda: expense_rows(user.name, list(islice(iterator, STREAM_CHUNK_SIZE))), [])
+    return sum(len(chunk) for chunk in stream_json_array(chunks))
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the model-instance + JsonResponse listing path with the values_list + streamed JSON path. '
+        'Run with --settings=daily_expenses.settings_bench for a local SQLite database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='10000,100000,1000000', help='Comma-separated row counts.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per size; the fastest is reported.')
+
+    def handle(self, *args, **options):
+        sizes = [int(value) for value in options['rows'].split(',')]
+        user = seed_rows(max(sizes))
+
+        results = []
+        for rows in sizes:
+            result = {'rows': rows}
+            for name, path in (('model_instances', model_instance_path), ('values_list_stream', values_list_path)):
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    size = path(user, rows)
+                    timings.append(time.perf_counter() - started)
+                result[name] = {'seconds': round(min(timings), 4), 'rows_per_second': round(rows / min(timings)),
+                                'bytes': size}
+            result['speedup'] = round(result['model_instances']['seconds'] / result['values_list_stream']['seconds'], 2)
+            results.append(result)
+
+        self.stdout.write(json.dumps({'encoder': 'orjson' if orjson else 'json', 'results': results}, indent=2))
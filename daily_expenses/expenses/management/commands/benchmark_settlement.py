@@ -0,0 +1,40 @@
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from expenses.settlement import simplify_debts
+
+
+def random_balances(participants, rng):
+    # Random balances in cents that sum to exactly zero.
+    cents = [rng.randint(-500000, 500000) for _ in range(participants - 1)]
+    cents.append(-sum(cents))
+    return {user_id: cents[user_id] / 100 for user_id in range(participants)}
+
+
+class Command(BaseCommand):
+    help = 'Time simplify_debts on random balanced groups of increasing size and print JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated group sizes.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per size; the fastest is reported.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        results = []
+        for size in (int(value) for value in options['sizes'].split(',')):
+            balances = random_balances(size, rng)
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                payments = simplify_debts(balances)
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            results.append({
+                'participants': size,
+                'payments': len(payments),
+                'seconds': round(best, 4),
+                'us_per_participant': round(best / size * 1e6, 2),
+            })
+        self.stdout.write(json.dumps(results, indent=2))
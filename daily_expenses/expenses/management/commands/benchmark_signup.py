@@ -0,0 +1,74 @@
+import json
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from expenses.benchmarks import latency_summary
+from expenses.directory import directory
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer create_user from concurrent threads with a mix of new and already registered '
+        'emails, several threads racing for each duplicate, and print throughput and latency '
+        'per outcome as JSON. Run with --settings=daily_expenses.settings_bench.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--signups', type=int, default=400, help='Signup requests to send.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Client threads.')
+        parser.add_argument('--duplicate-ratio', type=float, default=0.5,
+                            help='Share of requests that reuse an email sent by another request.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not 0 <= options['duplicate_ratio'] < 1:
+            raise CommandError('--duplicate-ratio must be in [0, 1).')
+        rng = random.Random(options['seed'])
+        run = f'{options["seed"]}-{time.time_ns()}'
+        fresh = max(1, round(options['signups'] * (1 - options['duplicate_ratio'])))
+        emails = [f'signup-{run}-{i}@gmail.com' for i in range(fresh)]
+        emails += [rng.choice(emails) for _ in range(options['signups'] - fresh)]
+        rng.shuffle(emails)
+        directory.clear()
+
+        def worker(chunk):
+            client = Client(raise_request_exception=False)
+            results = []
+            for email in chunk:
+                started = time.perf_counter()
+                response = client.post(reverse('home'), data=json.dumps({
+                    'email': email,
+                    'name': 'Signup',
+                    'mobile_number': '9000000000',
+                    'password': 'benchmark'
+                }), content_type='application/json')
+                results.append((response.status_code, time.perf_counter() - started))
+            connections.close_all()
+            return results
+
+        concurrency = options['concurrency']
+        chunks = [emails[i::concurrency] for i in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = [result for chunk in pool.map(worker, chunks) for result in chunk]
+        elapsed = time.perf_counter() - started
+
+        by_status = {}
+        for status, latency in results:
+            by_status.setdefault(status, []).append(latency)
+        self.stdout.write(json.dumps({
+            'signups': len(results),
+            'unique_emails': fresh,
+            'concurrency': concurrency,
+            'status_counts': dict(Counter(status for status, _ in results)),
+            'overall': latency_summary([latency for _, latency in results], elapsed),
+            'by_status': {
+                status: latency_summary(latencies, elapsed)
+                for status, latencies in sorted(by_status.items())
+            },
+        }, indent=2))
@@ -0,0 +1,114 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules that only some requests need. A worker that has them loaded
+# after startup pays for them on every cold start.
+LAZY_MODULES = (
+    'openpyxl', 'cProfile', 'pstats', 'concurrent.futures.process', 'urllib.request',
+    'django.contrib.admin', 'django.contrib.sessions', 'django.contrib.messages',
+)
+
+# Starts a worker the way the WSGI server does, resolves the URLconf, which
+# imports every view, and reports the setup time and peak resident memory.
+# On Linux ru_maxrss keeps the peak of the process that forked the worker,
+# so the peak of the worker itself is read from VmHWM.
+BOOTSTRAP = f'''
+import time
+started = time.perf_counter()
+import json, resource, sys
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+try:
+    with open('/proc/self/status') as status:
+        max_rss_kb = int(next(line for line in status if line.startswith('VmHWM:')).split()[1])
+except OSError:
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == 'darwin' else 1)
+print(json.dumps({{
+    'setup_seconds': time.perf_counter() - started,
+    'max_rss_kb': max_rss_kb,
+    'modules': len(sys.modules),
+    'lazy_modules_loaded': [name for name in {LAZY_MODULES!r} if name in sys.modules],
+}}))
+'''
+
+
+def parse_importtime(output):
+    # ``-X importtime`` writes "import time: self [us] | cumulative | name"
+    # per module, with the name indented by its nesting depth.
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        yield name.strip(), int(own)
+
+
+def start_worker(settings_module, importtime=False):
+    # -X importtime slows the imports down and adds to the memory, so the
+    # timings and memory come from runs without it.
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    options = ['-X', 'importtime'] if importtime else []
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *options, '-c', BOOTSTRAP],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode:
+        raise CommandError(f'{settings_module} failed to start:\n{result.stderr[-2000:]}')
+    stats = json.loads(result.stdout.splitlines()[-1])
+    stats['process_seconds'] = elapsed
+    stats['imports'] = list(parse_importtime(result.stderr))
+    return stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Start fresh worker processes under each settings module with python -X importtime and print '
+        'the cold-start time, peak resident memory, import time per top-level package and the optional '
+        'modules loaded at startup as JSON. Run with --settings=daily_expenses.settings_bench.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settings-modules', help=(
+            'Comma-separated settings modules to compare; defaults to the current settings and '
+            'daily_expenses.settings_production.'
+        ))
+        parser.add_argument('--runs', type=int, default=10, help='Worker processes started per settings module.')
+        parser.add_argument('--top', type=int, default=10, help='Packages listed in the import breakdown.')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be positive.')
+        modules = options['settings_modules'] or f"{os.environ['DJANGO_SETTINGS_MODULE']},daily_expenses.settings_production"
+
+        results = {}
+        for settings_module in modules.split(','):
+            runs = [start_worker(settings_module) for _ in range(options['runs'])]
+            traced = [start_worker(settings_module, importtime=True) for _ in range(options['runs'])]
+            packages = Counter()
+            for run in traced:
+                for name, own in run['imports']:
+                    packages[name.split('.')[0]] += own
+            results[settings_module] = {
+                'process_ms_p50': round(statistics.median(run['process_seconds'] for run in runs) * 1000, 1),
+                'process_ms_max': round(max(run['process_seconds'] for run in runs) * 1000, 1),
+                'setup_ms_p50': round(statistics.median(run['setup_seconds'] for run in runs) * 1000, 1),
+                'import_ms_p50': round(statistics.median(
+                    sum(own for _, own in run['imports']) for run in traced) / 1000, 1),
+                'max_rss_mb_p50': round(statistics.median(run['max_rss_kb'] for run in runs) / 1024, 1),
+                'modules': runs[-1]['modules'],
+                'lazy_modules_loaded': runs[-1]['lazy_modules_loaded'],
+                'import_ms_by_package': {
+                    name: round(total / len(traced) / 1000, 1) for name, total in packages.most_common(options['top'])
+                },
+            }
+        self.stdout.write(json.dumps({'runs': options['runs'], 'results': results}, indent=2))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from expenses.imports import IMPORT_CHUNK_SIZE, ImportFormatError, file_format_for, import_rows, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Import expenses from a CSV or XLSX file with the columns event, user_id, amount and optionally '
+        'split_method, paid_by, paid_time and event_ref (rows sharing an event_ref form one event).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument('--format', choices=['csv', 'xlsx'], help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Rows per transaction.')
+
+    def handle(self, *args, **options):
+        with open(options['path'], 'rb') as source:
+            try:
+                rows = read_rows(source, options['format'] or file_format_for(options['path']))
+            except ImportFormatError as e:
+                raise CommandError(str(e))
+
+            for report in import_rows(rows, chunk_size=options['chunk_size']):
+                if not report['done']:
+                    self.stdout.write(
+                        f"{report['rows']} rows read, {report['imported']} imported, {report['error_count']} errors")
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        if report['error_count'] > len(report['errors']):
+            self.stderr.write(f"... and {report['error_count'] - len(report['errors'])} more errors")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['imported']} of {report['rows']} rows as {report['events']} events"))
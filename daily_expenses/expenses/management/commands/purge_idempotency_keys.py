@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from expenses.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Delete stored Idempotency-Key responses older than EXPENSES_IDEMPOTENCY_TTL seconds.'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} idempotency keys'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from expenses.analytics import rebuild_rollups, verify_rollups
+from expenses.balances import rebuild_balances, verify_balances
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the UserBalance and ExpenseRollup summary tables from the raw Expense rows, '
+        'or verify them with --verify.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only check the stored summaries, do not rewrite them.')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatched = verify_balances()
+            if mismatched:
+                raise CommandError(f'{len(mismatched)} balances out of date: {mismatched[:20]}')
+            mismatched = verify_rollups()
+            if mismatched:
+                raise CommandError(f'{len(mismatched)} rollups out of date: {mismatched[:20]}')
+            self.stdout.write(self.style.SUCCESS('All balances and rollups match the expense rows'))
+            return
+
+        count = rebuild_balances()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} balances'))
+        count = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} rollups'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from expenses.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the event name search index from the Event table, for example after the Event table '
+        'was restored from a dump without the search triggers.'
+    )
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the search index over {count} events'))
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand
+from expenses.jobs import process_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Build queued balance-sheet exports. Jobs are claimed from the ExportJob table, so several workers '
+        'can run side by side without a message broker.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the queue and exit instead of polling.')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when the queue is empty.')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_jobs()
+            if processed:
+                self.stdout.write(f'Processed {processed} export jobs')
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,162 @@
+import random
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from .cache import recently_changed
+from .profiling import RequestMetrics, current_metrics, metrics_store, start_profile
+from .routers import current_read_alias, replica_alias
+
+PRIMARY_COOKIE = 'expenses_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in per-request instrumentation, enabled with EXPENSES_PROFILING.
+    Records wall time, database query count and time, the timings views
+    report through ``profiling.timed`` and the response size. Adds them as
+    a Server-Timing header and aggregates them for the /metrics/ endpoint.
+    A EXPENSES_PROFILING_SAMPLE_RATE share of requests also runs under
+    cProfile, and the stats of the slowest ones are kept.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'EXPENSES_PROFILING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'EXPENSES_PROFILING_SAMPLE_RATE', 0.0)
+        metrics_store.keep_slowest = getattr(settings, 'EXPENSES_PROFILING_KEEP_SLOWEST', 10)
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        profile = start_profile() if self.sample_rate and random.random() < self.sample_rate else None
+        try:
+            with instrument_queries(metrics):
+                response = self.get_response(request)
+        finally:
+            if profile is not None:
+                profile.disable()
+            current_metrics.reset(token)
+
+        view_name = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        wall_time = time.perf_counter() - metrics.started
+        response['Server-Timing'] = server_timing(wall_time, metrics)
+        if profile is not None:
+            metrics_store.record_profile(view_name, request.get_full_path(), wall_time, profile)
+
+        if response.streaming:
+            measure = self.ameasure_stream if response.is_async else self.measure_stream
+            response.streaming_content = measure(response.streaming_content, view_name, metrics)
+        else:
+            metrics_store.record(view_name, wall_time, metrics, len(response.content))
+        return response
+
+    def measure_stream(self, chunks, view_name, metrics):
+        # Streamed bodies are produced after the view returns, so their
+        # generation time and size are recorded once the last chunk is sent.
+        size = 0
+        stream_time = 0.0
+        iterator = iter(chunks)
+        while True:
+            started = time.perf_counter()
+            try:
+                with instrument_queries(metrics):
+                    chunk = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                stream_time += time.perf_counter() - started
+            size += len(chunk)
+            yield chunk
+        metrics.add_timing('stream', stream_time)
+        metrics_store.record(view_name, time.perf_counter() - metrics.started, metrics, size)
+
+    async def ameasure_stream(self, chunks, view_name, metrics):
+        # measure_stream for async bodies. Their queries run in the sync
+        # thread through sync_to_async, so only the time is measured.
+        size = 0
+        stream_time = 0.0
+        iterator = aiter(chunks)
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = await anext(iterator)
+            except StopAsyncIteration:
+                break
+            finally:
+                stream_time += time.perf_counter() - started
+            size += len(chunk)
+            yield chunk
+        metrics.add_timing('stream', stream_time)
+        metrics_store.record(view_name, time.perf_counter() - metrics.started, metrics, size)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Route the queries of views marked with ``routers.replica_reads`` to the
+    EXPENSES_READ_REPLICA database, keeping read-your-writes consistency:
+    a client that has just written gets a short-lived cookie and reads
+    from the primary, and so does anyone reading a scope written within
+    the last EXPENSES_REPLICA_LAG seconds.
+    """
+    def __init__(self, get_response):
+        self.alias = replica_alias()
+        if self.alias is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.lag = getattr(settings, 'EXPENSES_REPLICA_LAG', 5)
+
+    def __call__(self, request):
+        token = current_read_alias.set(None)
+        try:
+            response = self.get_response(request)
+            alias = current_read_alias.get()
+        finally:
+            current_read_alias.reset(token)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400 and self.lag > 0:
+            response.set_cookie(PRIMARY_COOKIE, '1', max_age=self.lag, httponly=True, samesite='Lax')
+        if alias is not None and response.streaming and not response.is_async:
+            response.streaming_content = self.read_from(alias, response.streaming_content)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        scope = getattr(view_func, 'replica_scope', None)
+        if scope is None or request.method != 'GET' or PRIMARY_COOKIE in request.COOKIES:
+            return None
+        if scope == 'user':
+            scope = f"user:{view_kwargs['user_id']}"
+        if not recently_changed(scope):
+            current_read_alias.set(self.alias)
+        return None
+
+    def read_from(self, alias, chunks):
+        # Streamed bodies run their queries after the view has returned.
+        iterator = iter(chunks)
+        while True:
+            token = current_read_alias.set(alias)
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                current_read_alias.reset(token)
+            yield chunk
+
+
+def instrument_queries(metrics):
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(metrics.record_query))
+    return stack
+
+
+def server_timing(wall_time, metrics):
+    entries = [
+        f'total;dur={wall_time * 1000:.2f}',
+        f'db;dur={metrics.query_time * 1000:.2f};desc="{metrics.query_count} queries"',
+    ]
+    entries.extend(f'{name};dur={seconds * 1000:.2f}' for name, seconds in metrics.timings.items())
+    return ', '.join(entries)
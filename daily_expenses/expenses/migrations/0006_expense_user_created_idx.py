@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_user_password'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user_id', 'created_at'], name='expense_user_created_idx'),
+        ),
+    ]
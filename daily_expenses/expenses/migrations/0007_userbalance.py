@@ -0,0 +1,63 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:33
+
+from decimal import Decimal
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+AMOUNT_FIELDS = {
+    'EQUAL': ('equal_amount', 'equal_count'),
+    'EXACT': ('exact_amount', 'exact_count'),
+    'PERCENTAGE': ('percentage_amount', 'percentage_count'),
+}
+
+
+def build_balances(apps, schema_editor):
+    # Expense.user_id is still the legacy text column here; rows whose text
+    # is not exactly a user's id are left for 0009 to reject.
+    db_alias = schema_editor.connection.alias
+    Expense = apps.get_model('expenses', 'Expense')
+    User = apps.get_model('expenses', 'User')
+    UserBalance = apps.get_model('expenses', 'UserBalance')
+    balances = {}
+    users = {str(user_id): user_id for user_id in User.objects.using(db_alias).values_list('id', flat=True)}
+    totals = Expense.objects.using(db_alias).values('user_id', 'split_method').annotate(
+        amount=Sum('amount'), count=Count('id')).order_by()
+    for row in totals.iterator():
+        user_id = users.get(row['user_id'])
+        if user_id is None or row['split_method'] not in AMOUNT_FIELDS:
+            continue
+        # SQLite sums decimals as floats.
+        amount = Decimal(str(row['amount'])).quantize(Decimal('0.01'))
+        balance = balances.setdefault(user_id, UserBalance(user_id=user_id))
+        amount_field, count_field = AMOUNT_FIELDS[row['split_method']]
+        balance.total_amount += amount
+        balance.expense_count += row['count']
+        setattr(balance, amount_field, getattr(balance, amount_field) + amount)
+        setattr(balance, count_field, getattr(balance, count_field) + row['count'])
+    UserBalance.objects.using(db_alias).bulk_create(balances.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0006_expense_user_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBalance',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='expenses.user')),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expense_count', models.PositiveIntegerField(default=0)),
+                ('equal_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('equal_count', models.PositiveIntegerField(default=0)),
+                ('exact_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('exact_count', models.PositiveIntegerField(default=0)),
+                ('percentage_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('percentage_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_balances, migrations.RunPython.noop),
+    ]
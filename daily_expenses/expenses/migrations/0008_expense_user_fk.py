@@ -0,0 +1,26 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0007_userbalance'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='expense_user_created_idx',
+        ),
+        migrations.RenameField(
+            model_name='expense',
+            old_name='user_id',
+            new_name='legacy_user_id',
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='expenses', to='expenses.user'),
+        ),
+    ]
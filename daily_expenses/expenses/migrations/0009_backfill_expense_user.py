@@ -0,0 +1,63 @@
+from django.db import migrations, models, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Cast
+
+CHUNK_SIZE = 5000
+
+
+def backfill_user(apps, schema_editor):
+    # Runs outside a migration-wide transaction and commits one primary key
+    # range at a time, so a large table is never locked for the whole run.
+    db_alias = schema_editor.connection.alias
+    Expense = apps.get_model('expenses', 'Expense')
+    User = apps.get_model('expenses', 'User')
+
+    # A row is an orphan unless its legacy id is the exact text of an
+    # existing user's id. The correlated subquery is an index lookup per
+    # row, instead of a NOT IN list with every user id.
+    legacy_id = Cast('legacy_user_id', models.BigIntegerField())
+    known_user = User.objects.using(db_alias).filter(id=Cast(OuterRef('legacy_user_id'), models.BigIntegerField()))
+    orphans = Expense.objects.using(db_alias).filter(
+        ~Exists(known_user) | ~Q(legacy_user_id=Cast(legacy_id, models.CharField(max_length=10)))
+    ).values_list('id', flat=True)
+    if orphans.exists():
+        raise RuntimeError(
+            f'{orphans.count()} expenses reference users that do not exist '
+            f'(first ids: {list(orphans[:20])}); fix or remove them before migrating.'
+        )
+
+    bounds = Expense.objects.using(db_alias).aggregate(low=models.Min('id'), high=models.Max('id'))
+    if bounds['low'] is None:
+        return
+    for start in range(bounds['low'], bounds['high'] + 1, CHUNK_SIZE):
+        with transaction.atomic(using=db_alias):
+            Expense.objects.using(db_alias).filter(
+                id__gte=start, id__lt=start + CHUNK_SIZE, user__isnull=True
+            ).update(user_id=Cast('legacy_user_id', models.BigIntegerField()))
+
+
+def restore_legacy_user_id(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Expense = apps.get_model('expenses', 'Expense')
+
+    bounds = Expense.objects.using(db_alias).aggregate(low=models.Min('id'), high=models.Max('id'))
+    if bounds['low'] is None:
+        return
+    for start in range(bounds['low'], bounds['high'] + 1, CHUNK_SIZE):
+        with transaction.atomic(using=db_alias):
+            Expense.objects.using(db_alias).filter(id__gte=start, id__lt=start + CHUNK_SIZE).update(
+                legacy_user_id=Cast('user_id', models.CharField(max_length=10))
+            )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('expenses', '0008_expense_user_fk'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_user, restore_legacy_user_id),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.7 on 2026-10-18 14:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0011_user_password_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='payer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='paid_expenses', to='expenses.user'),
+        ),
+        migrations.AddField(
+            model_name='userbalance',
+            name='net_balance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+    ]
@@ -0,0 +1,94 @@
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 5000
+# Split rows written by one add_expenses call share their name, split
+# method and payer, have consecutive ids and were stamped within moments
+# of each other. Older rows carry no other link, so that is how they are
+# grouped into events.
+EVENT_WINDOW_SECONDS = 5
+
+
+def same_event(group, row):
+    first = group[0]
+    return (
+        (row.Event, row.split_method, row.payer_id) == (first.Event, first.split_method, first.payer_id)
+        and abs((row.created_at - first.created_at).total_seconds()) <= EVENT_WINDOW_SECONDS
+        and all(split.user_id != row.user_id for split in group)
+    )
+
+
+def group_rows(rows):
+    groups = []
+    for row in rows:
+        if groups and same_event(groups[-1], row):
+            groups[-1].append(row)
+        else:
+            groups.append([row])
+    return groups
+
+
+def create_events(Event, events, connection):
+    # MySQL cannot return the ids of a bulk insert.
+    if connection.features.can_return_rows_from_bulk_insert:
+        Event.objects.using(connection.alias).bulk_create(events)
+    else:
+        for event in events:
+            event.save(using=connection.alias)
+
+
+def backfill_events(apps, schema_editor):
+    # Runs outside a migration-wide transaction and commits one chunk of
+    # rows at a time. A chunk never ends in the middle of a group, so an
+    # event is not split across two chunks.
+    db_alias = schema_editor.connection.alias
+    Expense = apps.get_model('expenses', 'Expense')
+    Event = apps.get_model('expenses', 'Event')
+
+    last_id = 0
+    while True:
+        rows = list(Expense.objects.using(db_alias).filter(id__gt=last_id, event__isnull=True)
+                    .order_by('id')[:CHUNK_SIZE])
+        if not rows:
+            return
+        groups = group_rows(rows)
+        if len(rows) == CHUNK_SIZE and len(groups) > 1:
+            groups.pop()
+
+        with transaction.atomic(using=db_alias):
+            events = [Event(
+                name=group[0].Event,
+                payer_id=group[0].payer_id,
+                split_method=group[0].split_method,
+                amount=sum(row.amount for row in group),
+                # Events keep the timestamp of their first row.
+                created_at=group[0].created_at
+            ) for group in groups]
+            create_events(Event, events, schema_editor.connection)
+            changed = []
+            for event, group in zip(events, groups):
+                for row in group:
+                    row.event_id = event.id
+                    changed.append(row)
+            Expense.objects.using(db_alias).bulk_update(changed, ['event'], batch_size=1000)
+        last_id = changed[-1].id
+
+
+def remove_events(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    Expense = apps.get_model('expenses', 'Expense')
+    Event = apps.get_model('expenses', 'Event')
+    Expense.objects.using(db_alias).update(event=None)
+    Event.objects.using(db_alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('expenses', '0015_event'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_events, remove_events),
+    ]
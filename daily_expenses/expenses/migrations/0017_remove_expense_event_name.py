@@ -0,0 +1,49 @@
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+CHUNK_SIZE = 5000
+
+
+def restore_event_names(apps, schema_editor):
+    # Reverse only: copy the names back onto the split rows before the
+    # event link is dropped again.
+    db_alias = schema_editor.connection.alias
+    Expense = apps.get_model('expenses', 'Expense')
+
+    bounds = Expense.objects.using(db_alias).aggregate(low=models.Min('id'), high=models.Max('id'))
+    if bounds['low'] is None:
+        return
+    for start in range(bounds['low'], bounds['high'] + 1, CHUNK_SIZE):
+        with transaction.atomic(using=db_alias):
+            rows = list(Expense.objects.using(db_alias).filter(id__gte=start, id__lt=start + CHUNK_SIZE)
+                        .select_related('event'))
+            for row in rows:
+                row.Event = row.event.name
+            Expense.objects.using(db_alias).bulk_update(rows, ['Event'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0016_backfill_expense_event'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_event_names),
+        # A default lets the reverse migration add the column back to a
+        # table that already has rows.
+        migrations.AlterField(
+            model_name='expense',
+            name='Event',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RemoveField(
+            model_name='expense',
+            name='Event',
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='event',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='splits', to='expenses.event'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+SEARCH_TABLE = 'expenses_event_search'
+FULLTEXT_INDEX = 'expenses_event_name_fulltext'
+
+
+def create_search_index(apps, schema_editor):
+    # A full-text index on Event.name: FTS5 on SQLite, FULLTEXT on MySQL.
+    # Other databases, and SQLite builds without FTS5, use the in-process
+    # index in expenses.search instead.
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(name, content='expenses_event', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+        except OperationalError:
+            return
+        schema_editor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+    elif vendor == 'mysql':
+        schema_editor.execute(f'CREATE FULLTEXT INDEX {FULLTEXT_INDEX} ON expenses_event (name)')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+    elif vendor == 'mysql':
+        schema_editor.execute(f'DROP INDEX {FULLTEXT_INDEX} ON expenses_event')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0020_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+SEARCH_TABLE = 'expenses_event_search'
+TRIGGERS = {
+    'expenses_event_search_insert': (
+        f"AFTER INSERT ON expenses_event BEGIN "
+        f"INSERT INTO {SEARCH_TABLE}(rowid, name) VALUES (new.id, new.name); END"),
+    'expenses_event_search_delete': (
+        f"AFTER DELETE ON expenses_event BEGIN "
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name) VALUES ('delete', old.id, old.name); END"),
+    'expenses_event_search_rename': (
+        f"AFTER UPDATE OF name ON expenses_event BEGIN "
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name) VALUES ('delete', old.id, old.name); "
+        f"INSERT INTO {SEARCH_TABLE}(rowid, name) VALUES (new.id, new.name); END"),
+}
+
+
+def create_triggers(apps, schema_editor):
+    # Keep the FTS5 table in step with every write to the Event table,
+    # whoever makes it. MySQL's FULLTEXT index needs nothing of the kind.
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or SEARCH_TABLE not in connection.introspection.table_names():
+        return
+    for name, body in TRIGGERS.items():
+        schema_editor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+    # Events written between 0021 and these triggers.
+    schema_editor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for name in TRIGGERS:
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0022_archived_at_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
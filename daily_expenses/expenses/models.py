@@ -1,26 +1,152 @@
 from django.db import models
+from django.utils import timezone
 
 class User(models.Model):
     email = models.EmailField(unique=True)
     name = models.CharField(max_length=100)
     mobile_number = models.CharField(max_length=15)
-    password=models.CharField(max_length=12,default="NUll")
+    password=models.CharField(max_length=128,default="NUll")
 
     def __str__(self):
         return self.name
-    
+
+
+SPLIT_METHOD_CHOICES = [
+    ('EQUAL', 'Equal'),
+    ('EXACT', 'Exact'),
+    ('PERCENTAGE', 'Percentage'),
+]
+
+
+class Event(models.Model):
+    # One add_expenses call. Its per-user split rows are Expense rows
+    # pointing here, so the name is stored once per event.
+    name = models.CharField(max_length=255, db_index=True)
+    payer = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='paid_events')
+    split_method = models.CharField(max_length=10, choices=SPLIT_METHOD_CHOICES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
 class Expense(models.Model):
-    SPLIT_METHOD_CHOICES = [
-        ('EQUAL', 'Equal'),
-        ('EXACT', 'Exact'),
-        ('PERCENTAGE', 'Percentage'),
-    ]
+    SPLIT_METHOD_CHOICES = SPLIT_METHOD_CHOICES
 
-    user_id = models.CharField(max_length=10)
-    Event = models.CharField(max_length=255)
+    event = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='splits')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expenses')
+    payer = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='paid_expenses')
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     split_method = models.CharField(max_length=10, choices=SPLIT_METHOD_CHOICES)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add, so imported history keeps its dates.
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='expense_user_created_idx'),
+        ]
 
     def __str__(self):
         return self.description
+
+
+class ArchivedExpense(models.Model):
+    # Expense rows older than EXPENSES_ARCHIVE_AFTER_DAYS, moved here by the
+    # archive_expenses command. They keep their original ids, so the two
+    # tables can be merged on (created_at, id).
+    id = models.BigIntegerField(primary_key=True)
+    event = models.ForeignKey('Event', on_delete=models.CASCADE, related_name='archived_splits')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_expenses')
+    payer = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='paid_archived_expenses')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    split_method = models.CharField(max_length=10, choices=SPLIT_METHOD_CHOICES)
+    created_at = models.DateTimeField(db_index=True)
+    archived_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='archived_user_created_idx'),
+        ]
+
+
+class UserBalance(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense_count = models.PositiveIntegerField(default=0)
+    equal_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    equal_count = models.PositiveIntegerField(default=0)
+    exact_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    exact_count = models.PositiveIntegerField(default=0)
+    percentage_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    percentage_count = models.PositiveIntegerField(default=0)
+    net_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f'{self.user_id}: {self.total_amount}'
+
+
+class ExportJob(models.Model):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_jobs')
+    data_version = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    file_path = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'data_version'], name='export_job_user_version_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='export_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.status}'
+
+
+class ExpenseRollup(models.Model):
+    # Daily spend per user and split method, kept in step with Expense by
+    # expenses.analytics.apply_rollups.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rollups')
+    bucket = models.DateField()
+    split_method = models.CharField(max_length=10, choices=Expense.SPLIT_METHOD_CHOICES)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'bucket', 'split_method'], name='rollup_user_bucket_method_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.bucket} {self.split_method}: {self.amount}'
+
+
+class IdempotencyKey(models.Model):
+    # The stored outcome of a write sent with an Idempotency-Key header. A
+    # row without a status_code is a request still in progress.
+    key = models.CharField(max_length=255, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    response = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    locked_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,242 @@
+import math
+import struct
+import zlib
+from itertools import chain, islice
+from django.db import connections
+from django.db.models import Max, Q
+from .models import Expense
+from .exports import (
+    CHUNK_SIZE, HEADER, SHEET_END_XML, SHEET_ROW_LIMIT, SHEET_START_XML, expense_values, row_xml, sheet_title, workbook_parts,
+)
+
+MIN_SHARD_ROWS = 5000
+MAX_SHARD_ROWS = 200000
+SHARDS_PER_WORKER = 4
+# A final, empty deflate block: ends a stream made of sync-flushed pieces.
+DEFLATE_END = b'\x03\x00'
+# DOS date and time of 1980-01-01 00:00, like zipfile's default.
+ZIP_DATE_TIME = (0, 33)
+
+
+def gf2_times(matrix, vector):
+    total, index = 0, 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[index]
+        vector >>= 1
+        index += 1
+    return total
+
+
+def gf2_square(matrix):
+    return [gf2_times(matrix, row) for row in matrix]
+
+
+def crc32_combine(crc1, crc2, length2):
+    """
+    CRC-32 of the concatenation of two byte strings from their CRCs and the
+    length of the second one, as zlib's crc32_combine, which Python's zlib
+    module does not expose.
+    """
+    if length2 == 0:
+        return crc1
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = gf2_square(odd)
+    odd = gf2_square(even)
+    while True:
+        even = gf2_square(odd)
+        if length2 & 1:
+            crc1 = gf2_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = gf2_square(even)
+        if length2 & 1:
+            crc1 = gf2_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+def deflate_piece(chunks):
+    # Compress ``chunks`` into raw deflate data ending on a byte boundary
+    # without a final block, so pieces can be concatenated. Returns the
+    # data, the CRC-32 and the length of the uncompressed input.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    output, crc, size = [], 0, 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        size += len(chunk)
+        output.append(compressor.compress(chunk))
+    output.append(compressor.flush(zlib.Z_SYNC_FLUSH))
+    return b''.join(output), crc, size
+
+
+class ZipWriter:
+    """
+    Minimal zip writer for members whose deflate data is produced
+    elsewhere. Members are written with a trailing data descriptor, so the
+    output only ever has to be appended to.
+    """
+    def __init__(self, output):
+        self.output = output
+        self.offset = 0
+        self.members = []
+
+    def write(self, data):
+        self.output.write(data)
+        self.offset += len(data)
+
+    def add(self, name, pieces):
+        """
+        Add the member ``name`` from ``(data, crc, size)`` pieces as
+        returned by deflate_piece.
+        """
+        encoded = name.encode()
+        header_offset = self.offset
+        self.write(struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, 0x08, 8, *ZIP_DATE_TIME, 0, 0, 0, len(encoded), 0))
+        self.write(encoded)
+        crc = compressed = size = 0
+        for data, piece_crc, piece_size in pieces:
+            self.write(data)
+            crc = crc32_combine(crc, piece_crc, piece_size)
+            compressed += len(data)
+            size += piece_size
+        self.write(DEFLATE_END)
+        compressed += len(DEFLATE_END)
+        if max(self.offset, size) > 0xFFFFFFFF:
+            raise ValueError('Workbook too large for a zip file without ZIP64')
+        self.write(struct.pack('<IIII', 0x08074b50, crc, compressed, size))
+        self.members.append((encoded, crc, compressed, size, header_offset))
+
+    def close(self):
+        directory_offset = self.offset
+        for encoded, crc, compressed, size, header_offset in self.members:
+            self.write(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014b50, 20, 20, 0x08, 8, *ZIP_DATE_TIME,
+                crc, compressed, size, len(encoded), 0, 0, 0, 0, 0, header_offset))
+            self.write(encoded)
+        self.write(struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0, len(self.members), len(self.members),
+            self.offset - directory_offset, directory_offset, 0))
+
+
+def keyset_from(ordering, key):
+    # Rows whose ``ordering`` values are at or after ``key``.
+    if len(ordering) == 1:
+        return Q(**{f'{ordering[0]}__gte': key[0]})
+    first, second = ordering
+    return Q(**{f'{first}__gt': key[0]}) | Q(**{first: key[0], f'{second}__gte': key[1]})
+
+
+def sheet_queryset(user_id, last_id):
+    # The Individual sheet is one user's rows by id, the Total sheet every
+    # row by user and id. Rows added after ``last_id`` was read belong to
+    # the next export.
+    queryset = Expense.objects.filter(id__lte=last_id)
+    if user_id is None:
+        return queryset, ['user_id', 'id']
+    return queryset.filter(user_id=user_id), ['id']
+
+
+def plan_shards(user_id, last_id, workers, sheet_rows=SHEET_ROW_LIMIT):
+    """
+    Split one sheet's rows up to ``last_id`` into ``(start key, end key)``
+    shards and return them grouped per output sheet, so no shard spans two
+    sheets. The keys are found by stepping through the ordered rows with
+    OFFSET from the previous key, which reads the index once in total.
+    Rows inserted meanwhile have higher ids, so they cannot move a key.
+    """
+    queryset, ordering = sheet_queryset(user_id, last_id)
+    total = queryset.count()
+    shard_rows = min(MAX_SHARD_ROWS, max(MIN_SHARD_ROWS, math.ceil(total / (workers * SHARDS_PER_WORKER))))
+
+    starts = []
+    for sheet_start in range(0, total, sheet_rows):
+        starts.append(list(range(sheet_start, min(sheet_start + sheet_rows, total), shard_rows)))
+    if not starts:
+        return [[]]
+
+    # The first shard is open-ended; a ``None`` key means no lower bound.
+    keys, position, key = {0: None}, 0, None
+    ordered = queryset.order_by(*ordering).values_list(*ordering)
+    for start in sorted(start for sheet in starts for start in sheet[1 if sheet[0] == 0 else 0:]):
+        remaining = ordered.filter(keyset_from(ordering, key)) if key else ordered
+        key = keys[start] = remaining[start - position]
+        position = start
+    # Each shard ends where the next one, possibly on the next sheet, starts.
+    ends = dict(zip(sorted(keys), [keys[start] for start in sorted(keys)[1:]] + [None]))
+    return [[(keys[start], ends[start]) for start in sheet] for sheet in starts]
+
+
+def render_shard(task):
+    """
+    Render the rows of one shard as sheet XML and compress it into a
+    deflate piece. Runs in the worker processes.
+    """
+    user_id, last_id, start, end = task
+    queryset, ordering = sheet_queryset(user_id, last_id)
+    if start is not None:
+        queryset = queryset.filter(keyset_from(ordering, start))
+    if end is not None:
+        queryset = queryset.exclude(keyset_from(ordering, end))
+    rows = expense_values([queryset], ordering)
+    return deflate_piece(
+        ''.join(row_xml(values) for values in batch).encode() for batch in iter(lambda: list(islice(rows, CHUNK_SIZE)), [])
+    )
+
+
+def init_worker():
+    # Under the spawn start method the worker has to set Django up itself;
+    # under fork this is a no-op. Either way it opens its own connection.
+    import django
+    django.setup()
+    connections.close_all()
+
+
+def write_balance_sheet(user, output, workers=1, sheet_rows=SHEET_ROW_LIMIT):
+    """
+    Write ``user``'s balance sheet to the binary file ``output``, with the
+    same sheets as balance_sheet_stream. The rows are split into key range
+    shards that ``workers`` processes render and compress in parallel. The
+    compressed shards are concatenated in order into each sheet member, so
+    the parent process only copies bytes. With ``workers=1`` the shards
+    are rendered in this process.
+    """
+    # Both sheets cover the rows that exist now, whatever is added while
+    # the workbook is written.
+    last_id = Expense.objects.aggregate(value=Max('id'))['value'] or 0
+    sheets = []
+    for title, user_id in (('Individual Expenses', user.id), ('Total Expenses', None)):
+        for part, shards in enumerate(plan_shards(user_id, last_id, workers, sheet_rows)):
+            sheets.append((sheet_title(title, part), [(user_id, last_id, start, end) for start, end in shards]))
+    tasks = [task for _, shards in sheets for task in shards]
+
+    if workers > 1:
+        # Imported here so that API workers, which export with one process,
+        # never load multiprocessing.
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Forked workers must not share the parent's database connections.
+        connections.close_all()
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        pieces = pool.map(render_shard, tasks)
+    else:
+        pool = None
+        pieces = map(render_shard, tasks)
+
+    try:
+        writer = ZipWriter(output)
+        head = deflate_piece([SHEET_START_XML.encode(), row_xml(HEADER).encode()])
+        tail = deflate_piece([SHEET_END_XML.encode()])
+        for index, (_, shards) in enumerate(sheets, start=1):
+            body = (next(pieces) for _ in shards)
+            writer.add(f'xl/worksheets/sheet{index}.xml', chain([head], body, [tail]))
+        for name, content in workbook_parts([title for title, _ in sheets]):
+            writer.add(name, [deflate_piece([content.encode()])])
+        writer.close()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return len(tasks)
@@ -0,0 +1,131 @@
+import heapq
+import io
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+current_metrics = ContextVar('expenses_request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.query_time = 0.0
+        self.timings = {}
+
+    def add_timing(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_count += 1
+            self.query_time += time.perf_counter() - started
+
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the block to the current request's ``name``
+    timing. Does nothing when profiling is off.
+    """
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_timing(name, time.perf_counter() - started)
+
+
+class MetricsStore:
+    """
+    In-process aggregate of request metrics per view, plus the cProfile
+    output of the slowest profiled requests.
+    """
+    def __init__(self, keep_slowest=10):
+        self.keep_slowest = keep_slowest
+        self.lock = threading.Lock()
+        self.views = {}
+        self.slowest = []
+
+    def record(self, view_name, wall_time, metrics, response_size):
+        with self.lock:
+            stats = self.views.setdefault(view_name, {
+                'requests': 0, 'wall_time': 0.0, 'max_wall_time': 0.0,
+                'queries': 0, 'query_time': 0.0, 'response_bytes': 0, 'timings': {},
+            })
+            stats['requests'] += 1
+            stats['wall_time'] += wall_time
+            stats['max_wall_time'] = max(stats['max_wall_time'], wall_time)
+            stats['queries'] += metrics.query_count
+            stats['query_time'] += metrics.query_time
+            stats['response_bytes'] += response_size
+            for name, seconds in metrics.timings.items():
+                stats['timings'][name] = stats['timings'].get(name, 0.0) + seconds
+
+    def record_profile(self, view_name, path, wall_time, profile):
+        if self.keep_slowest < 1:
+            return
+        with self.lock:
+            if len(self.slowest) >= self.keep_slowest and wall_time <= self.slowest[0][0]:
+                return
+            import pstats
+
+            output = io.StringIO()
+            pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(25)
+            entry = (wall_time, id(profile), {'view': view_name, 'path': path, 'stats': output.getvalue()})
+            if len(self.slowest) >= self.keep_slowest:
+                heapq.heapreplace(self.slowest, entry)
+            else:
+                heapq.heappush(self.slowest, entry)
+
+    def snapshot(self):
+        with self.lock:
+            views = {}
+            for view_name, stats in self.views.items():
+                requests = stats['requests']
+                views[view_name] = {
+                    'requests': requests,
+                    'avg_ms': round(stats['wall_time'] / requests * 1000, 2),
+                    'max_ms': round(stats['max_wall_time'] * 1000, 2),
+                    'avg_queries': round(stats['queries'] / requests, 2),
+                    'avg_query_ms': round(stats['query_time'] / requests * 1000, 2),
+                    'avg_response_bytes': round(stats['response_bytes'] / requests),
+                    'avg_timings_ms': {
+                        name: round(seconds / requests * 1000, 2) for name, seconds in stats['timings'].items()
+                    },
+                }
+            slowest = [
+                dict(entry, wall_ms=round(wall_time * 1000, 2))
+                for wall_time, _, entry in sorted(self.slowest, key=lambda item: item[0], reverse=True)
+            ]
+            return {'views': views, 'slowest_profiles': slowest}
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.slowest = []
+
+
+metrics_store = MetricsStore()
+
+
+def start_profile():
+    # Only one profiler can be active at a time on Python 3.12+, so a
+    # request that overlaps another profiled one is simply not profiled.
+    # cProfile is imported here, as profiling is off in most workers.
+    import cProfile
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        return None
+    return profile
@@ -0,0 +1,180 @@
+import base64
+import heapq
+from asgiref.sync import sync_to_async
+from datetime import datetime, time, timedelta
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from .models import User, Expense
+from .archive import expense_models, include_archived
+from .search import matching_events
+from .serializers import format_timestamps
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+ROW_FIELDS = ('id', 'event__name', 'amount', 'split_method', 'created_at')
+STREAM_CHUNK_SIZE = 2000
+
+
+def expense_rows(name, rows):
+    """
+    Serialize ``(id, event name, amount, split_method, created_at)`` tuples from
+    ``values_list(*ROW_FIELDS)`` into the listing format, formatting all of
+    their timestamps in one pass.
+    """
+    paid_times = format_timestamps([row[4] for row in rows])
+    return [{
+        'Name': name,
+        'Event': event,
+        'amount': str(amount),
+        'split_method': split_method,
+        'paid_time': paid_time
+    } for (_, event, amount, split_method, _), paid_time in zip(rows, paid_times)]
+
+
+def stream_expenses_grouped_by_user(with_archived=False):
+    """
+    Yield the overall listing, one JSON-ready list per user in id order, as
+    lists of items for stream_json_array. Users and expenses are read with
+    chunked queries and merged in step, so memory stays bounded by the
+    chunk size and the largest single user. ``with_archived`` merges in the
+    ArchivedExpense rows as well.
+    """
+    users = User.objects.order_by('id').values_list('id', 'name').iterator(chunk_size=STREAM_CHUNK_SIZE)
+    splits = heapq.merge(*(
+        model.objects.order_by('user_id', 'id').values_list('user_id', *ROW_FIELDS).iterator(chunk_size=STREAM_CHUNK_SIZE)
+        for model in expense_models(with_archived)
+    ))
+    pending = next(splits, None)
+    batch = []
+    for user_id, name in users:
+        rows = []
+        while pending is not None and pending[0] <= user_id:
+            if pending[0] == user_id:
+                rows.append(pending[1:])
+            pending = next(splits, None)
+        batch.append(expense_rows(name, rows))
+        if len(batch) >= STREAM_CHUNK_SIZE:
+            yield batch
+            batch = []
+    yield batch
+
+
+async def astream_expenses_grouped_by_user(with_archived=False):
+    """
+    stream_expenses_grouped_by_user for async views. Each batch is read in
+    the sync thread, so the chunked queries never block the event loop.
+    """
+    batches = stream_expenses_grouped_by_user(with_archived)
+    next_batch = sync_to_async(next)
+    while (batch := await next_batch(batches, None)) is not None:
+        yield batch
+
+
+def encode_cursor(created_at, expense_id):
+    raw = f'{created_at.isoformat()}|{expense_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, expense_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError
+        return created_at, int(expense_id)
+    except ValueError:
+        raise ValueError('Invalid cursor')
+
+
+def parse_boundary(value):
+    # Returns the aware moment and whether ``value`` was a bare date, in
+    # which case an upper bound has to cover the whole day.
+    try:
+        day = parse_date(value)
+        moment = datetime.combine(day, time.min) if day else parse_datetime(value)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ValueError(f'Invalid date: {value}')
+    return (make_aware(moment) if is_naive(moment) else moment), day is not None
+
+
+def parse_page_size(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('Invalid limit')
+    if limit < 1:
+        raise ValueError('Invalid limit')
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def user_expense_queryset(user_id, params):
+    """
+    Build the filtered, keyset-ordered queryset for one page of a user's
+    expenses. ``params`` is a QueryDict with optional ``limit``, ``cursor``,
+    ``from``, ``to``, ``split_method``, ``q`` (event name search) and
+    ``include_archived`` keys.
+    Returns the queryset sliced to one row more than the page size, so the
+    caller can tell whether a next page exists. Raises ValueError for
+    malformed parameters.
+    """
+    limit = parse_page_size(params.get('limit'))
+    conditions = Q(user_id=user_id)
+
+    if params.get('from'):
+        start, _ = parse_boundary(params['from'])
+        conditions &= Q(created_at__gte=start)
+    if params.get('to'):
+        end, whole_day = parse_boundary(params['to'])
+        if whole_day:
+            conditions &= Q(created_at__lt=end + timedelta(days=1))
+        else:
+            conditions &= Q(created_at__lte=end)
+    if params.get('split_method'):
+        if params['split_method'] not in dict(Expense.SPLIT_METHOD_CHOICES):
+            raise ValueError('Invalid split method')
+        conditions &= Q(split_method=params['split_method'])
+    if params.get('q'):
+        conditions &= Q(event_id__in=matching_events(params['q'], user_id))
+    if params.get('cursor'):
+        created_at, expense_id = decode_cursor(params['cursor'])
+        conditions &= Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=expense_id)
+
+    # Archived rows keep their ids, so one keyset cursor pages across both
+    # tables of the UNION.
+    live, *archived = [
+        model.objects.filter(conditions).values_list(*ROW_FIELDS) for model in expense_models(include_archived(params))
+    ]
+    splits = live.union(*archived, all=True) if archived else live
+    return splits.order_by('created_at', 'id')[:limit + 1], limit
+
+
+def expense_page(name, page, limit):
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1][4], page[-1][0])
+    return expense_rows(name, page), next_cursor
+
+
+def user_expense_page(user, params):
+    """
+    Return one keyset page of ``user``'s expenses ordered by
+    ``(created_at, id)`` plus the cursor for the next page (``None`` on the
+    last page).
+    """
+    splits, limit = user_expense_queryset(user.id, params)
+    return expense_page(user.name, list(splits), limit)
+
+
+async def auser_expense_page(user, params):
+    # Building the queryset may query the database: picking the search
+    # backend and refreshing the in-process index.
+    splits, limit = await sync_to_async(user_expense_queryset)(user.id, params)
+    return expense_page(user.name, [split async for split in splits], limit)
@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+MAX_KEYS = 100000
+
+
+class SlidingWindowLimiter:
+    """
+    In-process sliding-window rate limiter: at most ``limit`` hits per key
+    within the last ``window`` seconds. State lives in the worker process,
+    so each worker enforces its own budget. Keys are kept in the order
+    they were last seen; keys whose hits have all left the window are
+    dropped, and past ``max_keys`` the least recently seen key goes, so
+    memory stays bounded however many distinct keys arrive.
+    """
+    def __init__(self, limit, window, max_keys=MAX_KEYS):
+        if limit < 1:
+            raise ValueError('A rate limit must allow at least one hit')
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.hits = OrderedDict()
+
+    def sweep(self, now):
+        # The least recently seen keys come first; stop at the first one
+        # that still has a hit inside the window.
+        while self.hits:
+            key, hits = next(iter(self.hits.items()))
+            if hits[-1] > now - self.window and len(self.hits) < self.max_keys:
+                break
+            del self.hits[key]
+
+    def hit(self, key, now=None):
+        """
+        Record a hit for ``key``. Returns 0 if it is allowed, otherwise the
+        number of seconds until the oldest hit leaves the window.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            hits = self.hits.pop(key, None) or deque()
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+            self.sweep(now)
+            if len(hits) >= self.limit:
+                self.hits[key] = hits
+                return hits[0] + self.window - now
+            hits.append(now)
+            self.hits[key] = hits
+            return 0
+
+    def refund(self, key):
+        # Takes back the latest hit of ``key``, for attempts that should
+        # not count against its budget after all.
+        with self.lock:
+            hits = self.hits.get(key)
+            if hits:
+                hits.pop()
+
+    def reset(self):
+        with self.lock:
+            self.hits.clear()
@@ -0,0 +1,42 @@
+from contextvars import ContextVar
+from django.conf import settings
+from .cache import OVERALL_SCOPE
+
+current_read_alias = ContextVar('expenses_read_alias', default=None)
+
+
+def replica_alias():
+    alias = getattr(settings, 'EXPENSES_READ_REPLICA', None)
+    return alias if alias in settings.DATABASES else None
+
+
+def replica_reads(per_user=True):
+    """
+    Mark a read-only view whose queries may go to the EXPENSES_READ_REPLICA
+    database. Like cached_response, ``per_user`` views depend on their
+    ``user_id`` argument and the others on every user's data; a view reads
+    from the primary while that scope was written within
+    EXPENSES_REPLICA_LAG seconds.
+    """
+    def decorator(view):
+        view.replica_scope = 'user' if per_user else OVERALL_SCOPE
+        return view
+    return decorator
+
+
+class ReplicaRouter:
+    """
+    Send reads to the alias chosen for the current request by
+    ReplicaRoutingMiddleware and every write to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        return current_read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Anything the request reads after writing has to see the write.
+        if current_read_alias.get() is not None:
+            current_read_alias.set(None)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
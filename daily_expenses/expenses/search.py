@@ -0,0 +1,205 @@
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .archive import expense_models
+from .models import Event
+
+SEARCH_TABLE = 'expenses_event_search'
+MAX_TERMS = 8
+# How far below the newest indexed event id the in-process index keeps
+# looking for ids it has not seen, so events whose transaction commits
+# after one with a higher id are not missed.
+REFRESH_WINDOW = 1000
+# Characters with a meaning in a MySQL boolean-mode query.
+BOOLEAN_OPERATORS = re.compile(r'[-+<>()~*"@]')
+# The in-process index narrows a typeahead match to this many of the
+# newest events, which keeps the id list it sends to the database short.
+MAX_MATCHES = 1000
+
+
+def boolean_query(terms):
+    # Every term is required and matched as a prefix. search_terms only
+    # returns words, but the operators are stripped here all the same.
+    terms = [BOOLEAN_OPERATORS.sub('', term) for term in terms]
+    return ' '.join(f'+{term}*' for term in terms if term)
+
+
+def search_terms(text):
+    """
+    Split ``text`` into lower-case words without accents, as the FTS5
+    unicode61 tokenizer does. Every word is matched as a word prefix.
+    """
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return re.findall(r'[^\W_]+', text)[:MAX_TERMS]
+
+
+class FTS5Search:
+    """
+    SQLite FTS5 table over Event.name with prefix indexes for two and three
+    characters, so typeahead queries stay index lookups. It is an external
+    content table, which stores only the index; triggers on the Event table
+    update it in the transaction that inserts, renames or deletes events.
+    """
+    name = 'fts5'
+
+    def matching(self, terms, user_id=None):
+        query = ' '.join(f'"{term}"*' for term in terms)
+        return RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [query])
+
+    def rebuild(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+
+
+class FullTextSearch:
+    """
+    MySQL FULLTEXT index on Event.name, searched in boolean mode. InnoDB
+    keeps the index up to date with the table itself, but leaves out words
+    shorter than innodb_ft_min_token_size (EXPENSES_FULLTEXT_MIN_TOKEN_SIZE
+    here). Shorter terms are matched with LIKE instead, at the start of the
+    name or of a word after a space, which the index cannot narrow down.
+    """
+    name = 'fulltext'
+
+    def matching(self, terms, user_id=None):
+        min_size = getattr(settings, 'EXPENSES_FULLTEXT_MIN_TOKEN_SIZE', 3)
+        indexed = [term for term in terms if len(term) >= min_size]
+        conditions, params = [], []
+        if indexed:
+            conditions.append('MATCH(name) AGAINST (%s IN BOOLEAN MODE)')
+            params.append(boolean_query(indexed))
+        for term in terms:
+            if len(term) < min_size:
+                # Terms are plain words, so there is nothing to escape.
+                conditions.append('(name LIKE %s OR name LIKE %s)')
+                params += [f'{term}%', f'% {term}%']
+        return RawSQL(f'SELECT id FROM {Event._meta.db_table} WHERE {" AND ".join(conditions)}', params)
+
+    def rebuild(self, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'OPTIMIZE TABLE {Event._meta.db_table}')
+
+
+class PrefixIndex:
+    """
+    In-process word-prefix index over event names, for databases without a
+    full-text index. Each process builds it from the Event table on first
+    use. Every search first reads the events with a higher id than the
+    newest indexed one, and the few lower ids it has not seen yet, so the
+    index also sees events written by other processes. Renamed events keep
+    their old words until the index is rebuilt.
+    """
+    name = 'memory'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.words = []
+        self.postings = {}
+        self.last_id = None
+        # Ids within REFRESH_WINDOW below last_id that have not been read:
+        # events still being committed, or ids lost to a rollback.
+        self.missing = set()
+
+    def index(self, event_id, name):
+        for word in set(search_terms(name)):
+            if word not in self.postings:
+                insort(self.words, word)
+                self.postings[word] = array('q')
+            self.postings[word].append(event_id)
+
+    def refresh(self):
+        rows = Event.objects.order_by('id').values_list('id', 'name')
+        if self.last_id is not None:
+            rows = rows.filter(Q(id__gt=self.last_id) | Q(id__in=self.missing) if self.missing else Q(id__gt=self.last_id))
+        for event_id, name in rows.iterator(chunk_size=10000):
+            self.index(event_id, name)
+            if self.last_id is None or event_id > self.last_id:
+                floor = max(self.last_id or 0, event_id - REFRESH_WINDOW)
+                self.missing.update(range(floor + 1, event_id))
+                self.last_id = event_id
+            self.missing.discard(event_id)
+        if self.last_id is not None:
+            self.missing = {event_id for event_id in self.missing if event_id > self.last_id - REFRESH_WINDOW}
+
+    def lookup(self, term):
+        found = set()
+        position = bisect_left(self.words, term)
+        while position < len(self.words) and self.words[position].startswith(term):
+            found.update(self.postings[self.words[position]])
+            position += 1
+        return found
+
+    def matching(self, terms, user_id=None):
+        with self.lock:
+            self.refresh()
+            ids = set.intersection(*(self.lookup(term) for term in terms))
+        if user_id is None:
+            return sorted(ids)[-MAX_MATCHES:]
+        if len(ids) > MAX_MATCHES:
+            own = set()
+            for model in expense_models(True):
+                own.update(model.objects.filter(user_id=user_id).values_list('event_id', flat=True))
+            ids &= own
+        return sorted(ids)
+
+    def rebuild(self, connection):
+        with self.lock:
+            self.clear()
+
+
+fts5_search = FTS5Search()
+fulltext_search = FullTextSearch()
+prefix_index = PrefixIndex()
+BACKENDS = {backend.name: backend for backend in (fts5_search, fulltext_search, prefix_index)}
+fts5_tables = {}
+
+
+def search_backend(connection):
+    """
+    The backend set by EXPENSES_SEARCH_BACKEND, or else the full-text index
+    of the database behind ``connection``, with the in-process index when
+    it has none.
+    """
+    name = getattr(settings, 'EXPENSES_SEARCH_BACKEND', None)
+    if name is not None:
+        return BACKENDS[name]
+    if connection.vendor == 'mysql':
+        return fulltext_search
+    if connection.vendor == 'sqlite':
+        # The migration skips the table when SQLite lacks FTS5.
+        if connection.alias not in fts5_tables:
+            fts5_tables[connection.alias] = SEARCH_TABLE in connection.introspection.table_names()
+        if fts5_tables[connection.alias]:
+            return fts5_search
+    return prefix_index
+
+
+def matching_events(text, user_id=None):
+    """
+    Return the value for an ``event_id__in`` filter matching the events
+    whose name has a word starting with every word of ``text``: a subquery
+    on the full-text index, or a list of ids from the in-process index.
+    ``user_id`` lets the in-process index drop other users' events from a
+    large match; without it, that index only returns the MAX_MATCHES
+    newest events. Raises ValueError when ``text`` has no words.
+    """
+    terms = search_terms(text)
+    if not terms:
+        raise ValueError('Invalid search query')
+    return search_backend(connections[router.db_for_read(Event)]).matching(terms, user_id)
+
+
+def rebuild_search_index():
+    connection = connections[router.db_for_write(Event)]
+    search_backend(connection).rebuild(connection)
+    return Event.objects.count()
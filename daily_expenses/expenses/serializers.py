@@ -0,0 +1,67 @@
+import json
+from datetime import timezone as dt_timezone
+from django.http import HttpResponse
+from django.utils import timezone
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_CONTENT_TYPE = 'application/json'
+
+
+def dumps(value):
+    """
+    Encode ``value`` to JSON bytes with orjson when it is installed and the
+    standard library otherwise. Rows are built with plain str/int values, so
+    both encoders give the same result.
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode()
+
+
+def json_response(data, status=200):
+    return HttpResponse(dumps(data), content_type=JSON_CONTENT_TYPE, status=status)
+
+
+def format_timestamps(values):
+    """
+    Format aware datetimes as 'YYYY-MM-DD HH:MM:SS' in the current time zone,
+    a whole list at a time. The zone is looked up once and the UTC case,
+    which is what the database returns, skips the conversion altogether.
+    """
+    zone = timezone.get_current_timezone()
+    if zone is dt_timezone.utc or getattr(zone, 'key', None) == 'UTC':
+        return [value.replace(tzinfo=None).isoformat(' ', 'seconds') for value in values]
+    return [value.astimezone(zone).replace(tzinfo=None).isoformat(' ', 'seconds') for value in values]
+
+
+def stream_json_array(chunks):
+    """
+    Yield a JSON array as bytes. ``chunks`` is an iterable of lists of
+    already-JSON-able items; each list is encoded in one call.
+    """
+    yield b'['
+    first = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        encoded = dumps(chunk)[1:-1]
+        yield encoded if first else b',' + encoded
+        first = False
+    yield b']'
+
+
+async def astream_json_array(chunks):
+    # stream_json_array over an async iterable of chunks.
+    yield b'['
+    first = True
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        encoded = dumps(chunk)[1:-1]
+        yield encoded if first else b',' + encoded
+        first = False
+    yield b']'
@@ -0,0 +1,53 @@
+import heapq
+from collections import defaultdict
+from decimal import Decimal
+from .models import UserBalance
+from .archive import expense_models
+from .balances import computed_net_balances
+
+CENT = Decimal('0.01')
+
+
+def simplify_debts(net_balances):
+    """
+    Turn ``{user_id: net balance}`` (positive means the user is owed money)
+    into a short list of ``(debtor, creditor, amount)`` payments that
+    clears every balance. Greedily matches the largest debtor with the
+    largest creditor using two max-heaps, so it runs in O(n log n) and
+    produces at most n - 1 payments.
+    """
+    creditors = []
+    debtors = []
+    for user_id, balance in net_balances.items():
+        cents = int(Decimal(balance).quantize(CENT) * 100)
+        if cents > 0:
+            creditors.append((-cents, user_id))
+        elif cents < 0:
+            debtors.append((cents, user_id))
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    payments = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        payments.append((debtor, creditor, (Decimal(amount) / 100).quantize(CENT)))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+    return payments
+
+
+def cached_net_balances():
+    balances = UserBalance.objects.exclude(net_balance=0).values_list('user_id', 'net_balance')
+    return dict(balances.iterator(chunk_size=5000))
+
+
+def event_net_balances(event_id):
+    net = defaultdict(Decimal)
+    for model in expense_models(True):
+        for user_id, balance in computed_net_balances(model.objects.filter(event_id=event_id)).items():
+            net[user_id] += balance
+    return dict(net)
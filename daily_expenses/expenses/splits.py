@@ -0,0 +1,79 @@
+import heapq
+from decimal import Decimal, ROUND_HALF_UP
+
+CENTS = 100
+
+
+def to_cents(value):
+    """
+    Convert an amount given as a number or string to integer minor units
+    (paise/cents), rounding half up. Floats go through ``str`` so 0.1 means
+    ten cents, not its binary approximation.
+    """
+    return int((Decimal(str(value)) * CENTS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)
+
+
+def spread_remainder(shares, remainders, leftover):
+    # Largest-remainder method: the ``leftover`` cents go to the shares with
+    # the largest dropped fractions, ties broken by position, so the result
+    # is deterministic and always sums to the total.
+    for index in heapq.nlargest(leftover, range(len(shares)), key=lambda i: (remainders[i], -i)):
+        shares[index] += 1
+    return shares
+
+
+def weighted_split(total_cents, weights):
+    """
+    Split ``total_cents`` in proportion to non-negative integer ``weights``.
+    Works on whole lists of integers at once; the shares sum exactly to
+    ``total_cents``.
+    """
+    weight_sum = sum(weights)
+    if weight_sum <= 0 or min(weights) < 0:
+        raise ValueError('Weights must be non-negative and not all zero')
+    sign = -1 if total_cents < 0 else 1
+    total = abs(total_cents)
+    divided = [divmod(total * weight, weight_sum) for weight in weights]
+    shares = [quotient for quotient, _ in divided]
+    remainders = [remainder for _, remainder in divided]
+    shares = spread_remainder(shares, remainders, total - sum(shares))
+    return [sign * share for share in shares]
+
+
+def equal_split(total_cents, count):
+    if count < 1:
+        raise ValueError('At least one participant is required')
+    return weighted_split(total_cents, [1] * count)
+
+
+def percentage_split(total_cents, percentages):
+    """
+    Split by percentages given as numbers or strings. They must add up to
+    exactly 100.
+    """
+    percentages = [Decimal(str(percentage)) for percentage in percentages]
+    if sum(percentages) != 100:
+        raise ValueError('Percentages must add up to 100')
+    # Scale to integers so the division below is exact integer arithmetic.
+    places = max(-percentage.as_tuple().exponent for percentage in percentages)
+    places = max(places, 0)
+    return weighted_split(total_cents, [int(percentage.scaleb(places)) for percentage in percentages])
+
+
+def split_cents(split_method, total, shares):
+    """
+    Return the per-participant amounts in cents for one expense. ``shares``
+    is the participant count for EQUAL, the exact amounts for EXACT and the
+    percentages for PERCENTAGE.
+    """
+    if split_method == 'EQUAL':
+        return equal_split(to_cents(total), shares)
+    if split_method == 'EXACT':
+        return [to_cents(amount) for amount in shares]
+    if split_method == 'PERCENTAGE':
+        return percentage_split(to_cents(total), shares)
+    raise ValueError('Invalid split method')
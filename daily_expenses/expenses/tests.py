@@ -1,10 +1,50 @@
-from django.test import TestCase, Client
+from unittest import skipUnless
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.http import JsonResponse
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
-from .models import User, Expense
+from .models import User, Event, Expense, ExportJob, UserBalance
+from .directory import BloomFilter, LRUCache, directory
 import json
+import os
+from decimal import Decimal
 
-class UserViewsTests(TestCase):
+
+def create_expense(name, **fields):
+    # An event with one split row, written directly like a legacy row:
+    # balances and the search index are not updated.
+    event = Event.objects.create(
+        name=name, payer_id=fields.get('payer_id'), split_method=fields['split_method'], amount=fields['amount'])
+    return Expense.objects.create(event=event, **fields)
+
+
+def create_users(prefix, count):
+    return [
+        User.objects.create(
+            email=f'{prefix}{i}@gmail.com', name=f'{prefix.capitalize()} {i}', mobile_number='1234567890')
+        for i in range(count)
+    ]
+
+
+def post_json(client, url_name, payload):
+    return client.post(reverse(url_name), data=json.dumps(payload), content_type='application/json')
+
+
+@override_settings(EXPENSES_READ_REPLICA=None)
+class ExpensesTestCase(TestCase):
+    # Reads stay on the primary unless a test opts into the replica.
+    def setUp(self):
+        # Cached responses are keyed on user ids, which the test database
+        # reuses between tests, and so is the per-process user directory.
+        cache.clear()
+        directory.clear()
+
+
+class UserViewsTests(ExpensesTestCase):
     def setUp(self):
+        super().setUp()
         self.client = Client()
         self.user = User.objects.create(
             email='testuser@gmail.com',
@@ -18,11 +58,11 @@ class UserViewsTests(TestCase):
         self.download_balance_sheet_url = reverse('download_balance_sheet', args=[self.user.id])
         
     def test_create_user(self):
-        response = self.client.post(reverse('home'), data=json.dumps({
+        response = post_json(self.client, 'home', {
             'email': 'newuser@gmail.com',
             'name': 'New User',
             'mobile_number': '0987654321'
-        }), content_type='application/json')
+        })
         self.assertEqual(response.status_code, 200)
         self.assertIn('id', response.json())
         
@@ -38,14 +78,14 @@ class UserViewsTests(TestCase):
             'event': 'Lunch',
             'amount': 100.00,
             'split_method': 'EQUAL',
-            'participants': [self.user.id]
+            'splits': [self.user.id]
         }), content_type='application/json')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(Expense.objects.count(), 1)
         
     def test_user_expenses(self):
-        Expense.objects.create(
-            Event='Dinner',
+        create_expense(
+            'Dinner',
             user_id=self.user.id,
             amount=50.00,
             split_method='EQUAL'
@@ -63,8 +103,8 @@ class UserViewsTests(TestCase):
         self.assertGreater(len(data), 0) 
         
     def test_download_balance_sheet(self):
-        Expense.objects.create(
-            Event='Event1',
+        create_expense(
+            'Event1',
             user_id=self.user.id,
             amount=200.00,
             split_method='EXACT'
@@ -79,19 +119,1657 @@ class UserViewsTests(TestCase):
         self.assertEqual(response.json()['error'], 'Invalid method')
 
     def test_create_user_invalid_email(self):
-        response = self.client.post(reverse('home'), data=json.dumps({
+        response = post_json(self.client, 'home', {
             'email': 'invalidemail.com',
             'name': 'Invalid User',
             'mobile_number': '1234567890'
-        }), content_type='application/json')
+        })
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json()['error'], 'Invalid email address')
         
     def test_create_user_invalid_mobile(self):
-        response = self.client.post(reverse('home'), data=json.dumps({
+        response = post_json(self.client, 'home', {
             'email': 'validemail@gmail.com',
             'name': 'Invalid Mobile',
             'mobile_number': '12345'
-        }), content_type='application/json')
+        })
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json()['error'], 'Invalid mobile number')
+
+
+class OverallExpensesQueryTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.overall_expenses_url = reverse('all_expenses')
+
+    def create_users_with_expenses(self, count):
+        start = User.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(
+                email=f'user{i}@gmail.com',
+                name=f'User {i}',
+                mobile_number='1234567890'
+            )
+            create_expense(
+                'Lunch',
+                user_id=user.id,
+                amount=10.00,
+                split_method='EQUAL'
+            )
+
+    def test_query_count_does_not_grow_with_users(self):
+        self.create_users_with_expenses(2)
+        with self.assertNumQueries(2):
+            self.client.get(self.overall_expenses_url)
+
+        self.create_users_with_expenses(20)
+        cache.clear()
+        with self.assertNumQueries(2):
+            response = self.client.get(self.overall_expenses_url)
+        self.assertEqual(len(response.json()), 22)
+
+    def test_expenses_grouped_per_user(self):
+        self.create_users_with_expenses(3)
+        User.objects.create(email='empty@gmail.com', name='Empty', mobile_number='1234567890')
+        data = self.client.get(self.overall_expenses_url).json()
+        self.assertEqual([len(rows) for rows in data], [1, 1, 1, 0])
+        self.assertEqual(data[1][0]['Name'], 'User 1')
+
+    def test_streamed_listing_matches_buffered(self):
+        self.create_users_with_expenses(3)
+        buffered = self.client.get(self.overall_expenses_url)
+        streamed = self.client.get(self.overall_expenses_url, {'stream': '1'})
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(json.loads(b''.join(streamed.streaming_content)), buffered.json())
+        self.assertEqual(buffered.json()[0][0]['amount'], '10.00')
+
+    def test_format_timestamps(self):
+        from datetime import datetime, timezone
+        from .serializers import format_timestamps
+
+        moment = datetime(2024, 5, 1, 9, 30, 15, 123456, tzinfo=timezone.utc)
+        self.assertEqual(format_timestamps([moment]), ['2024-05-01 09:30:15'])
+        self.assertEqual(format_timestamps([]), [])
+
+
+class BalanceSheetExportTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.user = User.objects.create(email='first@gmail.com', name='First', mobile_number='1234567890')
+        self.other = User.objects.create(email='second@gmail.com', name='Second & Co', mobile_number='1234567890')
+        for user in (self.user, self.other):
+            create_expense('Lunch <team>', user_id=user.id, amount=120.50, split_method='EXACT')
+
+    def test_streamed_workbook_is_valid_xlsx(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+
+        response = self.client.get(reverse('download_balance_sheet', args=[self.user.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(workbook.sheetnames, ['Individual Expenses', 'Total Expenses'])
+        individual = list(workbook['Individual Expenses'].values)
+        total = list(workbook['Total Expenses'].values)
+        self.assertEqual(individual[0], ('Name', 'Event', 'Amount', 'Split Method', 'Paid Time'))
+        self.assertEqual(individual[1][:4], ('First', 'Lunch <team>', 120.5, 'EXACT'))
+        self.assertEqual([row[0] for row in total[1:]], ['First', 'Second & Co'])
+
+    def test_unknown_user(self):
+        response = self.client.get(reverse('download_balance_sheet', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+
+class AddExpensesBulkTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.users = create_users('split', 50)
+        self.ids = [user.id for user in self.users]
+
+    def test_query_count_does_not_grow_with_split_size(self):
+        with self.assertNumQueries(10):
+            post_json(self.client, 'add', {
+                'event': 'Small', 'amount': 90, 'split_method': 'EQUAL', 'splits': self.ids[:3]})
+        with self.assertNumQueries(10):
+            response = post_json(self.client, 'add', {
+                'event': 'Big', 'amount': 500, 'split_method': 'EQUAL', 'splits': self.ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Expense.objects.filter(event__name='Big').count(), 50)
+
+    def test_all_split_methods(self):
+        post_json(self.client, 'add', {'event': 'Exact', 'amount': 30, 'split_method': 'EXACT',
+                                       'splits': [{'user_id': self.ids[0], 'amount': 10},
+                                                  {'user_id': self.ids[1], 'amount': 20}]})
+        post_json(self.client, 'add', {'event': 'Percent', 'amount': 200, 'split_method': 'PERCENTAGE',
+                                       'splits': [{'user_id': self.ids[0], 'percentage': 25},
+                                                  {'user_id': self.ids[1], 'percentage': 75}]})
+        self.assertEqual(
+            sorted(Expense.objects.filter(event__name='Exact').values_list('amount', flat=True)), [10, 20])
+        self.assertEqual(
+            sorted(Expense.objects.filter(event__name='Percent').values_list('amount', flat=True)), [50, 150])
+
+    def test_unknown_user_writes_nothing(self):
+        response = post_json(self.client, 'add', {'event': 'Lunch', 'amount': 100, 'split_method': 'EXACT',
+                                                  'splits': [{'user_id': self.ids[0], 'amount': 50},
+                                                             {'user_id': 9999, 'amount': 50}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'user mentioned in the split is not found')
+        self.assertEqual(Expense.objects.count(), 0)
+
+    def test_amount_too_large_for_the_column(self):
+        response = post_json(self.client, 'add', {'event': 'Yacht', 'amount': 100000000, 'split_method': 'EXACT',
+                                                  'splits': [{'user_id': self.ids[0], 'amount': 100000000}]})
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'Amount is too large'))
+        self.assertEqual(Expense.objects.count(), 0)
+
+    def test_batch_endpoint(self):
+        events = [{'event': f'Event {i}', 'amount': 100, 'split_method': 'EQUAL', 'splits': self.ids[:4]}
+                  for i in range(10)]
+        response = post_json(self.client, 'add_batch', {'events': events})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['expenses'], 40)
+        self.assertEqual(Expense.objects.count(), 40)
+
+    def test_batch_endpoint_is_all_or_nothing(self):
+        events = [
+            {'event': 'Good', 'amount': 100, 'split_method': 'EQUAL', 'splits': self.ids[:2]},
+            {'event': 'Bad', 'amount': 100, 'split_method': 'PERCENTAGE',
+             'splits': [{'user_id': self.ids[0], 'percentage': 40}]},
+        ]
+        response = post_json(self.client, 'add_batch', {'events': events})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Event 1: Percentages must add up to 100')
+        self.assertEqual(Expense.objects.count(), 0)
+
+
+class UserExpensesPaginationTests(ExpensesTestCase):
+    def setUp(self):
+        from datetime import datetime, timezone
+
+        super().setUp()
+        self.client = Client()
+        self.user = User.objects.create(email='pager@gmail.com', name='Pager', mobile_number='1234567890')
+        self.url = reverse('user_expenses', args=[self.user.id])
+        for day in range(1, 8):
+            expense = create_expense(
+                f'Day {day}',
+                user_id=self.user.id,
+                amount=day,
+                split_method='EXACT' if day % 2 else 'EQUAL'
+            )
+            Expense.objects.filter(id=expense.id).update(created_at=datetime(2024, 7, day, 12, tzinfo=timezone.utc))
+
+    def test_keyset_pages_cover_every_row_once(self):
+        events = []
+        params = {'limit': 3}
+        while True:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()), 3)
+            events.extend(row['Event'] for row in response.json())
+            if 'X-Next-Cursor' not in response:
+                break
+            params['cursor'] = response['X-Next-Cursor']
+        self.assertEqual(events, [f'Day {day}' for day in range(1, 8)])
+
+    def test_date_range_and_split_method_filters(self):
+        response = self.client.get(self.url, {'from': '2024-07-02', 'to': '2024-07-05', 'split_method': 'EXACT'})
+        self.assertEqual([row['Event'] for row in response.json()], ['Day 3', 'Day 5'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'limit': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'from': 'yesterday'}).status_code, 400)
+
+
+class UserBalanceTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.first = User.objects.create(email='payer1@gmail.com', name='Payer 1', mobile_number='1234567890')
+        self.second = User.objects.create(email='payer2@gmail.com', name='Payer 2', mobile_number='1234567890')
+
+    def test_balance_maintained_on_add(self):
+        post_json(self.client, 'add', {
+            'event': 'Lunch', 'amount': 100, 'split_method': 'EQUAL', 'splits': [self.first.id, self.second.id]})
+        post_json(self.client, 'add', {
+            'event': 'Cab', 'amount': 30, 'split_method': 'EXACT',
+            'splits': [{'user_id': self.first.id, 'amount': 30}]})
+
+        data = self.client.get(reverse('user_balance', args=[self.first.id])).json()
+        self.assertEqual(data['total_amount'], '80.00')
+        self.assertEqual(data['expense_count'], 2)
+        self.assertEqual(data['split_methods']['EQUAL'], {'amount': '50.00', 'count': 1})
+        self.assertEqual(data['split_methods']['PERCENTAGE']['count'], 0)
+
+        from .balances import verify_balances
+        self.assertEqual(verify_balances(), [])
+
+    def test_rebuild_command(self):
+        from io import StringIO
+        from django.core.management import call_command, CommandError
+        from .models import UserBalance
+
+        create_expense('Legacy', user_id=self.second.id, amount=12.5, split_method='EXACT')
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--verify')
+
+        call_command('rebuild_balances', stdout=StringIO())
+        self.assertEqual(UserBalance.objects.get(user=self.second).exact_amount, 12.5)
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+    def test_unknown_user(self):
+        self.assertEqual(self.client.get(reverse('user_balance', args=[999])).status_code, 404)
+
+
+# settings_bench points EXPENSES_CACHE_ALIAS at a dummy cache.
+@override_settings(EXPENSES_CACHE_ALIAS='default')
+class ResponseCacheTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.user = User.objects.create(email='cached@gmail.com', name='Cached', mobile_number='1234567890')
+        self.other = User.objects.create(email='other@gmail.com', name='Other', mobile_number='1234567890')
+        self.user_expenses_url = reverse('user_expenses', args=[self.user.id])
+        self.other_expenses_url = reverse('user_expenses', args=[self.other.id])
+
+    def add(self, user):
+        with self.captureOnCommitCallbacks(execute=True):
+            post_json(self.client, 'add', {
+                'event': 'Lunch', 'amount': 10, 'split_method': 'EQUAL', 'splits': [user.id]
+            })
+
+    def test_repeated_reads_are_served_from_cache(self):
+        self.add(self.user)
+        self.client.get(self.user_expenses_url)
+        self.client.get(reverse('all_expenses'))
+        self.client.get(reverse('user_details', args=[self.user.id]))
+        with self.assertNumQueries(0):
+            self.client.get(self.user_expenses_url)
+            self.client.get(reverse('all_expenses'))
+            self.client.get(reverse('user_details', args=[self.user.id]))
+
+    def test_add_expenses_invalidates_only_affected_users(self):
+        self.add(self.user)
+        self.add(self.other)
+        self.client.get(self.user_expenses_url)
+        self.client.get(self.other_expenses_url)
+
+        self.add(self.user)
+        self.assertEqual(len(self.client.get(self.user_expenses_url).json()), 2)
+        self.assertEqual(len(self.client.get(reverse('all_expenses')).json()[0]), 2)
+        with self.assertNumQueries(0):
+            self.client.get(self.other_expenses_url)
+
+    def test_create_user_invalidates_overall(self):
+        self.assertEqual(len(self.client.get(reverse('all_expenses')).json()), 2)
+        post_json(self.client, 'home', {
+            'email': 'third@gmail.com', 'name': 'Third', 'mobile_number': '0987654321', 'password': 'secret'
+        })
+        self.assertEqual(len(self.client.get(reverse('all_expenses')).json()), 3)
+
+    def test_etag_returns_not_modified(self):
+        self.add(self.user)
+        etag = self.client.get(self.user_expenses_url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.user_expenses_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.add(self.user)
+        response = self.client.get(self.user_expenses_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    async def test_async_views_use_the_cache(self):
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncClient
+
+        await sync_to_async(self.add)(self.user)
+        client = AsyncClient()
+        url = reverse('async_user_expenses', args=[self.user.id])
+        first = await client.get(url)
+        await Expense.objects.all().adelete()
+        second = await client.get(url)
+        self.assertEqual((second.content, second['ETag']), (first.content, first['ETag']))
+        response = await client.get(url, headers={'If-None-Match': first['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+
+class AsyncViewsTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(email='async@gmail.com', name='Async', mobile_number='1234567890')
+
+    async def test_async_endpoints(self):
+        from django.test import AsyncClient
+
+        client = AsyncClient()
+        response = await client.post(reverse('async_add'), data=json.dumps({
+            'event': 'Lunch', 'amount': 40, 'split_method': 'EQUAL', 'splits': [self.user.id]
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        response = await client.get(reverse('async_user_details', args=[self.user.id]))
+        self.assertEqual(response.json()['name'], 'Async')
+        response = await client.get(reverse('async_user_expenses', args=[self.user.id]))
+        self.assertEqual(response.json()[0]['amount'], '40.00')
+        response = await client.get(reverse('async_all_expenses'))
+        self.assertEqual(len(response.json()), 1)
+
+    async def test_async_errors(self):
+        from django.test import AsyncClient
+
+        client = AsyncClient()
+        response = await client.get(reverse('async_user_details', args=[999]))
+        self.assertEqual(response.status_code, 404)
+        response = await client.post(reverse('async_add'), data=json.dumps({
+            'event': 'Lunch', 'amount': 40, 'split_method': 'EQUAL', 'splits': [999]
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BenchmarkCommandTests(ExpensesTestCase):
+    def test_benchmark_emits_json_for_every_endpoint(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command('benchmark', users=5, events=10, split_sizes='2:3,4:1', iterations=2, memory_samples=1, stdout=out)
+        results = json.loads(out.getvalue())['results']
+        self.assertEqual(set(results), {
+            'create_user', 'add_expenses', 'user_expenses', 'overall_expenses', 'download_balance_sheet'
+        })
+        self.assertEqual(results['overall_expenses']['queries_max'], 2)
+        self.assertIn('p99_ms', results['add_expenses'])
+
+    def test_startup_benchmark_defers_optional_imports(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        out = StringIO()
+        settings_module = os.environ['DJANGO_SETTINGS_MODULE']
+        call_command('benchmark_startup', settings_modules=settings_module, runs=1, stdout=out)
+        result = json.loads(out.getvalue())['results'][settings_module]
+        # openpyxl and the profilers are only imported by the requests that use them.
+        for module in ('openpyxl', 'cProfile', 'concurrent.futures.process'):
+            self.assertNotIn(module, result['lazy_modules_loaded'])
+        self.assertNotIn('openpyxl', result['import_ms_by_package'])
+        self.assertGreater(result['max_rss_mb_p50'], 0)
+        self.assertIn('django', result['import_ms_by_package'])
+
+    def test_seeding_without_bulk_insert_ids(self):
+        import random
+        from unittest import mock
+        from .management.commands import benchmark_export, benchmark_search
+
+        # As on MySQL, bulk_create leaves the primary keys unset.
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            user = benchmark_export.seed_rows(16, 5, random.Random(0))
+            user_ids = benchmark_search.seed_rows(16, 5, random.Random(0))
+        self.assertIsNotNone(user.id)
+        self.assertEqual(len(set(user_ids)), 5)
+        self.assertEqual(Expense.objects.count(), 32)
+        self.assertEqual(Event.objects.count(), 8)
+
+
+class ProfilingMiddlewareTests(ExpensesTestCase):
+    def setUp(self):
+        from .profiling import metrics_store
+
+        super().setUp()
+        metrics_store.reset()
+        self.user = User.objects.create(email='profiled@gmail.com', name='Profiled', mobile_number='1234567890')
+        create_expense('Lunch', user_id=self.user.id, amount=10, split_method='EXACT')
+
+    def test_disabled_by_default(self):
+        response = Client().get(reverse('user_expenses', args=[self.user.id]))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(Client().get(reverse('metrics')).status_code, 404)
+
+    def test_server_timing_and_metrics(self):
+        with self.settings(EXPENSES_PROFILING=True, EXPENSES_PROFILING_SAMPLE_RATE=1.0, EXPENSES_PROFILING_KEEP_SLOWEST=1):
+            client = Client()
+            response = client.get(reverse('user_expenses', args=[self.user.id]))
+            self.assertIn('db;dur=', response['Server-Timing'])
+            self.assertIn('desc="2 queries"', response['Server-Timing'])
+            self.assertIn('serialize;dur=', response['Server-Timing'])
+
+            response = client.get(reverse('download_balance_sheet', args=[self.user.id]))
+            b''.join(response.streaming_content)
+
+            data = client.get(reverse('metrics')).json()
+        self.assertEqual(data['views']['user_expenses']['avg_queries'], 2)
+        self.assertIn('stream', data['views']['download_balance_sheet']['avg_timings_ms'])
+        self.assertGreater(data['views']['download_balance_sheet']['avg_response_bytes'], 0)
+        self.assertEqual(len(data['slowest_profiles']), 1)
+
+    async def test_async_streamed_body(self):
+        from django.test import AsyncClient
+
+        with self.settings(EXPENSES_PROFILING=True):
+            client = AsyncClient()
+            response = await client.get(reverse('async_all_expenses'), {'stream': '1'})
+            body = b''.join([chunk async for chunk in response.streaming_content])
+            data = (await client.get(reverse('metrics'))).json()
+        self.assertEqual(json.loads(body)[0][0]['Event'], 'Lunch')
+        view = data['views']['async_all_expenses']
+        self.assertIn('stream', view['avg_timings_ms'])
+        self.assertEqual(view['avg_response_bytes'], len(body))
+
+
+class ExpenseUserForeignKeyMigrationTests(TransactionTestCase):
+    migrate_from = ('expenses', '0007_userbalance')
+    migrate_to = ('expenses', '0010_expense_user_not_null')
+
+    def migrate(self, target=None):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+
+        executor = MigrationExecutor(connection)
+        targets = [target] if target else executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate()
+
+    def test_existing_expenses_survive(self):
+        from decimal import Decimal
+
+        apps = self.migrate(self.migrate_from)
+        OldUser = apps.get_model('expenses', 'User')
+        OldExpense = apps.get_model('expenses', 'Expense')
+        users = [OldUser.objects.create(email=f'legacy{i}@gmail.com', name=f'Legacy {i}', mobile_number='1234567890')
+                 for i in range(3)]
+        before = []
+        for i in range(12):
+            expense = OldExpense.objects.create(
+                Event=f'Legacy {i}',
+                user_id=str(users[i % 3].id),
+                amount=Decimal(i) + Decimal('0.25'),
+                split_method='EXACT'
+            )
+            before.append((expense.id, users[i % 3].id, expense.Event, expense.amount, expense.created_at))
+
+        apps = self.migrate(self.migrate_to)
+        NewExpense = apps.get_model('expenses', 'Expense')
+        after = list(NewExpense.objects.order_by('id').values_list('id', 'user_id', 'Event', 'amount', 'created_at'))
+        self.assertEqual(after, before)
+        self.assertEqual(NewExpense.objects.filter(user__name='Legacy 1').count(), 4)
+
+    def test_balances_are_backfilled(self):
+        from decimal import Decimal
+
+        apps = self.migrate(('expenses', '0006_expense_user_created_idx'))
+        OldUser = apps.get_model('expenses', 'User')
+        OldExpense = apps.get_model('expenses', 'Expense')
+        users = [OldUser.objects.create(email=f'legacy{i}@gmail.com', name=f'Legacy {i}', mobile_number='1234567890')
+                 for i in range(2)]
+        for i in range(6):
+            OldExpense.objects.create(Event=f'Legacy {i}', user_id=str(users[i % 2].id),
+                                      amount=Decimal('0.10'), split_method='EQUAL' if i < 4 else 'EXACT')
+
+        apps = self.migrate(self.migrate_from)
+        balances = apps.get_model('expenses', 'UserBalance').objects.order_by('user_id')
+        self.assertEqual(
+            list(balances.values_list('user_id', 'total_amount', 'expense_count', 'equal_amount', 'exact_count')),
+            [(users[0].id, Decimal('0.30'), 3, Decimal('0.20'), 1),
+             (users[1].id, Decimal('0.30'), 3, Decimal('0.20'), 1)])
+
+    def test_orphaned_expenses_stop_the_backfill(self):
+        apps = self.migrate(self.migrate_from)
+        OldUser = apps.get_model('expenses', 'User')
+        OldExpense = apps.get_model('expenses', 'Expense')
+        user = OldUser.objects.create(email='owner@gmail.com', name='Owner', mobile_number='1234567890')
+        orphans = [
+            OldExpense.objects.create(Event='Orphan', user_id=legacy_id, amount=1, split_method='EXACT').id
+            for legacy_id in (str(user.id), '999', f'0{user.id}', 'abc')
+        ][1:]
+
+        with self.assertRaisesMessage(RuntimeError, f'3 expenses reference users that do not exist (first ids: {orphans})'):
+            self.migrate(self.migrate_to)
+        apps = self.migrate(('expenses', '0008_expense_user_fk'))
+        apps.get_model('expenses', 'Expense').objects.filter(id__in=orphans).delete()
+
+
+@override_settings(EXPENSES_PASSWORD_ITERATIONS=1000)
+class LoginTests(ExpensesTestCase):
+    def setUp(self):
+        from .auth import ip_limiter, user_limiter
+
+        super().setUp()
+        user_limiter.reset()
+        ip_limiter.reset()
+        self.client = Client()
+        response = post_json(self.client, 'home', {
+            'email': 'login@gmail.com', 'name': 'Login', 'mobile_number': '1234567890', 'password': 'secret'
+        })
+        self.user = User.objects.get(id=response.json()['id'])
+
+    def login(self, password, user_id=None):
+        return self.client.post(reverse('login', args=[user_id or self.user.id]),
+                                data=json.dumps({'password': password}), content_type='application/json')
+
+    def test_password_is_hashed_and_token_issued(self):
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(self.login('wrong').status_code, 400)
+
+        token = self.login('secret').json()['token']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('whoami'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.json()['id'], self.user.id)
+        self.assertEqual(self.client.get(reverse('whoami'), HTTP_AUTHORIZATION='Bearer forged').status_code, 401)
+
+    def test_plain_text_and_outdated_hashes_are_upgraded(self):
+        User.objects.filter(id=self.user.id).update(password='legacy')
+        self.assertEqual(self.login('legacy').status_code, 200)
+        self.assertTrue(User.objects.get(id=self.user.id).password.startswith('pbkdf2_sha256$1000$'))
+
+        with self.settings(EXPENSES_PASSWORD_ITERATIONS=2000):
+            self.assertEqual(self.login('legacy').status_code, 200)
+        self.assertTrue(User.objects.get(id=self.user.id).password.startswith('pbkdf2_sha256$2000$'))
+
+    def test_unset_password_never_matches(self):
+        for password in ('NUll', ''):
+            User.objects.filter(id=self.user.id).update(password=password)
+            self.assertEqual(self.login(password).status_code, 400)
+
+    def test_body_must_be_an_object(self):
+        url = reverse('login', args=[self.user.id])
+        for body in (['secret'], 'secret', {'password': 1}):
+            response = self.client.post(url, data=json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_rate_limited_per_user(self):
+        from .auth import user_limiter
+
+        for _ in range(user_limiter.limit):
+            self.login('wrong')
+        with self.assertNumQueries(0):
+            response = self.login('secret')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_successful_logins_do_not_use_the_user_budget(self):
+        from .auth import user_limiter
+
+        for _ in range(user_limiter.limit - 1):
+            self.assertEqual(self.login('wrong').status_code, 400)
+        for _ in range(3):
+            self.assertEqual(self.login('secret').status_code, 200)
+        self.assertEqual(self.login('wrong').status_code, 400)
+        self.assertEqual(self.login('secret').status_code, 429)
+
+    def test_sliding_window(self):
+        from .ratelimit import SlidingWindowLimiter
+
+        limiter = SlidingWindowLimiter(2, 10)
+        self.assertEqual(limiter.hit('key', now=0), 0)
+        self.assertEqual(limiter.hit('key', now=5), 0)
+        self.assertEqual(limiter.hit('key', now=6), 4)
+        self.assertEqual(limiter.hit('key', now=10.5), 0)
+        with self.assertRaises(ValueError):
+            SlidingWindowLimiter(0, 10)
+
+    def test_limiter_drops_idle_keys(self):
+        from .ratelimit import SlidingWindowLimiter
+
+        limiter = SlidingWindowLimiter(2, 10, max_keys=3)
+        for i in range(5):
+            limiter.hit(f'key{i}', now=i)
+        self.assertEqual(list(limiter.hits), ['key2', 'key3', 'key4'])
+        limiter.hit('key4', now=13)
+        self.assertEqual(list(limiter.hits), ['key4'])
+        limiter.hit('key4', now=14)
+        self.assertEqual(limiter.hit('key4', now=15), 8)
+
+    def test_client_ip_behind_proxies(self):
+        from django.test import RequestFactory
+        from .auth import client_ip
+
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 1.2.3.4')
+        self.assertEqual(client_ip(request), '10.0.0.1')
+        with override_settings(EXPENSES_TRUSTED_PROXY_COUNT=1):
+            self.assertEqual(client_ip(request), '1.2.3.4')
+
+
+class SettlementTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.a, self.b, self.c = create_users('settle', 3)
+
+    def test_simplify_debts_clears_every_balance(self):
+        import random
+        from decimal import Decimal
+        from .settlement import simplify_debts
+
+        rng = random.Random(1)
+        cents = [rng.randint(-10000, 10000) for _ in range(199)]
+        cents.append(-sum(cents))
+        balances = {i: Decimal(c) / 100 for i, c in enumerate(cents)}
+
+        payments = simplify_debts(balances)
+        self.assertLess(len(payments), len(balances))
+        for debtor, creditor, amount in payments:
+            self.assertGreater(amount, 0)
+            balances[debtor] += amount
+            balances[creditor] -= amount
+        self.assertTrue(all(balance == 0 for balance in balances.values()))
+
+    def test_settle_endpoint_uses_payer(self):
+        post_json(self.client, 'add', {'event': 'Dinner', 'amount': 90, 'split_method': 'EQUAL', 'paid_by': self.a.id,
+                                       'splits': [self.a.id, self.b.id, self.c.id]})
+        post_json(self.client, 'add', {'event': 'Cab', 'amount': 20, 'split_method': 'EXACT', 'paid_by': self.b.id,
+                                       'splits': [{'user_id': self.c.id, 'amount': 20}]})
+
+        data = self.client.get(reverse('settle_up')).json()
+        self.assertEqual(data['balances'], {str(self.a.id): '60.00', str(self.b.id): '-10.00', str(self.c.id): '-50.00'})
+        self.assertEqual(data['transactions'], [
+            {'from': self.c.id, 'to': self.a.id, 'amount': '50.00'},
+            {'from': self.b.id, 'to': self.a.id, 'amount': '10.00'},
+        ])
+
+        # A second event with the same name is not part of the settlement.
+        post_json(self.client, 'add', {'event': 'Cab', 'amount': 40, 'split_method': 'EXACT', 'paid_by': self.a.id,
+                                       'splits': [{'user_id': self.b.id, 'amount': 40}]})
+        cab = Event.objects.filter(name='Cab').earliest('id')
+        data = self.client.get(reverse('settle_up'), {'event_id': cab.id}).json()
+        self.assertEqual(data['transactions'], [{'from': self.c.id, 'to': self.b.id, 'amount': '20.00'}])
+
+        self.assertEqual(self.client.get(reverse('settle_up'), {'event_id': 'Cab'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('settle_up'), {'event_id': 999}).status_code, 404)
+
+        from .balances import verify_balances
+        self.assertEqual(verify_balances(), [])
+
+    def test_unknown_payer(self):
+        response = post_json(self.client, 'add', {
+            'event': 'Dinner', 'amount': 90, 'split_method': 'EQUAL', 'paid_by': 999, 'splits': [self.a.id]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'user who paid is not found')
+
+
+class SplitCalculationTests(ExpensesTestCase):
+    def test_equal_split_spreads_remainder(self):
+        from .splits import equal_split, from_cents
+
+        self.assertEqual(equal_split(10000, 3), [3334, 3333, 3333])
+        self.assertEqual(equal_split(-100, 3), [-34, -33, -33])
+        self.assertEqual(from_cents(3334), Decimal('33.34'))
+
+    def test_percentage_split_uses_largest_remainder(self):
+        from .splits import percentage_split
+
+        self.assertEqual(percentage_split(1000, ['33.33', '33.33', '33.34']), [333, 333, 334])
+        self.assertEqual(percentage_split(1, [50, 50]), [1, 0])
+        with self.assertRaises(ValueError):
+            percentage_split(1000, [50, 49.99])
+
+    def test_seeded_random_splits_sum_to_total(self):
+        import random
+        from .splits import equal_split, percentage_split, split_cents, to_cents
+
+        # 500 cases from a fixed seed, so a failure always reproduces.
+        rng = random.Random(13)
+        for _ in range(500):
+            total = rng.randint(-10**9, 10**9)
+            count = rng.randint(1, 300)
+            shares = equal_split(total, count)
+            self.assertEqual(sum(shares), total)
+            self.assertLessEqual(max(shares) - min(shares), 1)
+
+            cuts = sorted(rng.randint(0, 10000) for _ in range(count - 1))
+            percentages = [Decimal(b - a) / 100 for a, b in zip([0] + cuts, cuts + [10000])]
+            shares = percentage_split(total, percentages)
+            self.assertEqual(sum(shares), total)
+            for share, percentage in zip(shares, percentages):
+                self.assertLess(abs(share - total * percentage / 100), 1)
+
+            amount = rng.randint(1, 10**7) / 100
+            self.assertEqual(sum(split_cents('EQUAL', amount, count)), to_cents(amount))
+
+    def test_add_expenses_shares_sum_to_amount(self):
+        users = [User.objects.create(email=f'cent{i}@gmail.com', name=f'Cent {i}', mobile_number='1234567890')
+                 for i in range(3)]
+        post_json(Client(), 'add', {
+            'event': 'Thirds', 'amount': 100, 'split_method': 'EQUAL', 'splits': [user.id for user in users]
+        })
+        post_json(Client(), 'add', {
+            'event': 'Percent', 'amount': 0.1, 'split_method': 'PERCENTAGE',
+            'splits': [{'user_id': user.id, 'percentage': 33.33} for user in users[:2]] +
+                      [{'user_id': users[2].id, 'percentage': 33.34}]
+        })
+        for event, total in (('Thirds', Decimal('100')), ('Percent', Decimal('0.1'))):
+            amounts = Expense.objects.filter(event__name=event).values_list('amount', flat=True)
+            self.assertEqual(sum(amounts), total)
+
+
+class ExportJobTests(ExpensesTestCase):
+    def setUp(self):
+        import tempfile
+
+        super().setUp()
+        self.client = Client()
+        export_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(export_dir.cleanup)
+        settings_override = override_settings(EXPENSES_EXPORT_DIR=export_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create(email='export@gmail.com', name='Export', mobile_number='1234567890')
+        create_expense('Lunch', user_id=self.user.id, amount=12.50, split_method='EXACT')
+        self.export_url = reverse('request_balance_sheet', args=[self.user.id])
+
+    def test_identical_requests_share_one_job(self):
+        first = self.client.post(self.export_url)
+        second = self.client.post(self.export_url)
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(first.json()['job_id'], second.json()['job_id'])
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+        download = self.client.get(reverse('download_export', args=[first.json()['job_id']]))
+        self.assertEqual(download.status_code, 409)
+
+    def test_worker_builds_file_and_reuses_it_until_stale(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        from .jobs import process_jobs
+
+        job_id = self.client.post(self.export_url).json()['job_id']
+        self.assertEqual(process_jobs(), 1)
+        status = self.client.get(reverse('export_status', args=[job_id])).json()
+        self.assertEqual((status['status'], status['stale']), ('DONE', False))
+
+        download = self.client.get(status['download_url'])
+        workbook = load_workbook(BytesIO(b''.join(download.streaming_content)))
+        self.assertEqual(list(workbook['Individual Expenses'].values)[1][1], 'Lunch')
+
+        cached = self.client.post(self.export_url)
+        self.assertEqual((cached.status_code, cached.json()['job_id']), (200, job_id))
+
+        create_expense('Dinner', user_id=self.user.id, amount=8, split_method='EXACT')
+        self.assertTrue(self.client.get(reverse('export_status', args=[job_id])).json()['stale'])
+        old_file = ExportJob.objects.get(id=job_id).file_path
+        new_job_id = self.client.post(self.export_url).json()['job_id']
+        self.assertNotEqual(new_job_id, job_id)
+
+        process_jobs()
+        self.assertFalse(ExportJob.objects.filter(id=job_id).exists())
+        self.assertFalse(os.path.exists(old_file))
+
+    def test_failed_job_is_requeued(self):
+        from unittest import mock
+        from .jobs import process_jobs
+
+        job_id = self.client.post(self.export_url).json()['job_id']
+        with mock.patch('expenses.jobs.balance_sheet_stream', side_effect=RuntimeError('disk full')):
+            process_jobs()
+        status = self.client.get(reverse('export_status', args=[job_id])).json()
+        self.assertEqual((status['status'], status['error']), ('FAILED', 'disk full'))
+
+        retried = self.client.post(self.export_url).json()
+        self.assertEqual((retried['job_id'], retried['status']), (job_id, 'PENDING'))
+
+    def test_archiving_makes_exports_stale(self):
+        from .archive import archive_batch
+        from .jobs import expense_data_version
+        from django.utils import timezone
+
+        with self.assertNumQueries(2):
+            version = expense_data_version()
+        archive_batch(timezone.now())
+        self.assertNotEqual(expense_data_version(), version)
+
+    def test_worker_that_lost_its_claim_leaves_the_job(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .jobs import claim_next_job, run_job
+
+        job_id = self.client.post(self.export_url).json()['job_id']
+        late = claim_next_job()
+        ExportJob.objects.filter(id=job_id).update(started_at=timezone.now() - timedelta(hours=1))
+        current = claim_next_job()
+        self.assertEqual(current.id, job_id)
+
+        self.assertFalse(run_job(late))
+        self.assertEqual(ExportJob.objects.get(id=job_id).status, ExportJob.RUNNING)
+        self.assertTrue(run_job(current))
+        self.assertEqual(ExportJob.objects.get(id=job_id).status, ExportJob.DONE)
+
+    def test_unknown_user(self):
+        response = self.client.post(reverse('request_balance_sheet', args=[9999]))
+        self.assertEqual(response.status_code, 404)
+
+
+class AnalyticsTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.users = create_users('stats', 2)
+        self.ids = [user.id for user in self.users]
+
+    def add(self, event, amount, split_method='EQUAL'):
+        post_json(self.client, 'add', {
+            'event': event, 'amount': amount, 'split_method': split_method, 'splits': self.ids
+        })
+
+    def backdate(self, event, when):
+        from datetime import datetime, timezone
+        from .analytics import rebuild_rollups
+
+        Expense.objects.filter(event__name=event).update(created_at=datetime.fromisoformat(when).replace(tzinfo=timezone.utc))
+        rebuild_rollups()
+
+    def test_rollups_track_added_expenses(self):
+        from .analytics import verify_rollups
+        from .models import ExpenseRollup
+
+        self.add('Lunch', 30)
+        self.add('Cab', 10)
+        self.add('Rent', 100, 'PERCENTAGE')
+        self.assertEqual(verify_rollups(), [])
+        rollup = ExpenseRollup.objects.get(user_id=self.ids[0], split_method='EQUAL')
+        self.assertEqual((rollup.amount, rollup.count), (Decimal('20.00'), 2))
+
+    def test_spend_per_period(self):
+        self.add('Lunch', 30)
+        self.add('Cab', 10)
+        self.add('Dinner', 50)
+        self.backdate('Lunch', '2024-01-30 10:00')
+        self.backdate('Cab', '2024-02-01 09:00')
+        self.backdate('Dinner', '2024-02-20 21:00')
+        url = reverse('user_analytics', args=[self.ids[0]])
+
+        months = self.client.get(url, {'period': 'month'}).json()
+        self.assertEqual([(row['period'], row['amount'], row['count']) for row in months],
+                         [('2024-01-01', '15.00', 1), ('2024-02-01', '30.00', 2)])
+        self.assertEqual(months[1]['split_methods']['EQUAL'], {'amount': '30.00', 'count': 2})
+
+        days = self.client.get(url, {'from': '2024-02-01', 'to': '2024-02-28'}).json()
+        self.assertEqual([row['period'] for row in days], ['2024-02-01', '2024-02-20'])
+        weeks = self.client.get(url, {'period': 'week'}).json()
+        self.assertEqual([row['period'] for row in weeks], ['2024-01-29', '2024-02-19'])
+
+    def test_spend_per_event(self):
+        self.add('Lunch', 30)
+        self.add('Lunch', 10)
+        self.add('Cab', 8)
+        rows = self.client.get(reverse('user_event_analytics', args=[self.ids[1]]), {'period': 'month'}).json()
+        # The two Lunch events share a name but stay separate rows.
+        self.assertEqual([(row['Event'], row['amount'], row['count']) for row in rows],
+                         [('Lunch', '15.00', 1), ('Lunch', '5.00', 1), ('Cab', '4.00', 1)])
+        self.assertEqual([row['event_id'] for row in rows],
+                         list(Event.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_invalid_requests(self):
+        url = reverse('user_analytics', args=[self.ids[0]])
+        self.assertEqual(self.client.get(url, {'period': 'year'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('user_analytics', args=[9999])).status_code, 404)
+
+
+class EventTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.users = create_users('event', 3)
+        self.ids = [user.id for user in self.users]
+
+    def test_event_and_splits_in_two_queries(self):
+        response = post_json(self.client, 'add', {
+            'event': 'Dinner', 'amount': 100, 'split_method': 'EQUAL', 'splits': self.ids, 'paid_by': self.ids[0]
+        })
+        event_id = response.json()['event_id']
+
+        with self.assertNumQueries(2):
+            data = self.client.get(reverse('event_details', args=[event_id])).json()
+        self.assertEqual((data['name'], data['amount'], data['payer']), ('Dinner', '100.00', 'Event 0'))
+        self.assertEqual([split['amount'] for split in data['splits']], ['33.34', '33.33', '33.33'])
+        self.assertEqual(Expense.objects.get(event_id=event_id, user_id=self.ids[1]).event.name, 'Dinner')
+
+        listed = self.client.get(reverse('event_list'), {'name': 'Dinner'}).json()
+        self.assertEqual([event['id'] for event in listed], [event_id])
+        self.assertEqual(self.client.get(reverse('event_details', args=[9999])).status_code, 404)
+
+
+class ExpenseEventMigrationTests(TransactionTestCase):
+    migrate_from = ('expenses', '0015_event')
+
+    def migrate(self, target=None):
+        from django.db import connection
+        from django.db.migrations.executor import MigrationExecutor
+
+        executor = MigrationExecutor(connection)
+        targets = [target] if target else executor.loader.graph.leaf_nodes()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate()
+
+    def test_split_rows_are_grouped_into_events(self):
+        from datetime import datetime, timezone
+
+        apps = self.migrate(self.migrate_from)
+        OldUser = apps.get_model('expenses', 'User')
+        OldExpense = apps.get_model('expenses', 'Expense')
+        users = [OldUser.objects.create(email=f'group{i}@gmail.com', name=f'Group {i}', mobile_number='1234567890')
+                 for i in range(3)]
+        rows = [('Dinner', users[0]), ('Dinner', users[1]), ('Dinner', users[2]),
+                ('Dinner', users[0]), ('Dinner', users[1]), ('Cab', users[2])]
+        for name, user in rows:
+            OldExpense.objects.create(Event=name, user=user, amount=10, split_method='EQUAL')
+        paid_time = datetime(2020, 1, 1, tzinfo=timezone.utc)
+        OldExpense.objects.update(created_at=paid_time)
+
+        apps = self.migrate()
+        NewExpense = apps.get_model('expenses', 'Expense')
+        grouped = list(NewExpense.objects.order_by('id').values_list('event__name', 'event__amount', 'event_id'))
+        self.assertEqual(set(NewExpense.objects.values_list('event__created_at', flat=True)), {paid_time})
+        self.assertEqual([row[:2] for row in grouped], [(name, amount) for name, amount in [
+            ('Dinner', 30), ('Dinner', 30), ('Dinner', 30), ('Dinner', 20), ('Dinner', 20), ('Cab', 10)]])
+        self.assertEqual(len({row[2] for row in grouped}), 3)
+
+        apps = self.migrate(('expenses', '0014_expense_rollup'))
+        RestoredExpense = apps.get_model('expenses', 'Expense')
+        self.assertEqual(list(RestoredExpense.objects.order_by('id').values_list('Event', flat=True)),
+                         [name for name, _ in rows])
+
+
+@skipUnless('replica' in settings.DATABASES, 'needs a "replica" database, see settings_replica.py')
+@override_settings(EXPENSES_READ_REPLICA='replica', EXPENSES_REPLICA_LAG=5)
+class ReplicaRoutingTests(ExpensesTestCase):
+    databases = {'default', 'replica'} if 'replica' in settings.DATABASES else {'default'}
+
+    def setUp(self):
+        super().setUp()
+        # Nothing replicates in tests, so rows written to the primary are
+        # missing from the replica until a test copies them there.
+        self.user = User.objects.create(email='primary@gmail.com', name='Primary', mobile_number='1234567890')
+
+    def test_read_only_views_use_the_replica(self):
+        response = Client().get(reverse('user_details', args=[self.user.id]))
+        self.assertEqual(response.status_code, 404)
+
+        User.objects.using('replica').create(
+            id=self.user.id, email='primary@gmail.com', name='Replica copy', mobile_number='1234567890')
+        response = Client().get(reverse('user_details', args=[self.user.id]))
+        self.assertEqual(response.json()['name'], 'Replica copy')
+
+    def test_reads_after_a_write_use_the_primary(self):
+        writer = Client()
+        response = post_json(writer, 'home', {
+            'email': 'fresh@gmail.com', 'name': 'Fresh', 'mobile_number': '0987654321'
+        })
+        user_id = response.json()['id']
+        self.assertIn('expenses_primary', response.cookies)
+
+        self.assertEqual(writer.get(reverse('user_details', args=[user_id])).status_code, 200)
+        # Other clients stay on the primary while the user was just changed.
+        self.assertEqual(Client().get(reverse('user_details', args=[user_id])).status_code, 200)
+
+    def test_streamed_export_reads_from_the_replica(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+
+        replica_user = User.objects.using('replica').create(
+            id=self.user.id, email='primary@gmail.com', name='Replica copy', mobile_number='1234567890')
+        Expense.objects.using('replica').create(
+            event=Event.objects.using('replica').create(name='Replica lunch', split_method='EXACT', amount=5),
+            user=replica_user, amount=5, split_method='EXACT')
+
+        response = Client().get(reverse('download_balance_sheet', args=[self.user.id]))
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(list(workbook['Total Expenses'].values)[1][:2], ('Replica copy', 'Replica lunch'))
+
+
+class ImportExpensesTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.users = create_users('import', 3)
+        self.ids = [user.id for user in self.users]
+
+    def csv_upload(self, lines, name='history.csv'):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        return SimpleUploadedFile(name, '\n'.join(lines).encode(), content_type='text/csv')
+
+    def test_csv_import_groups_events_and_reports_errors(self):
+        a, b, c = self.ids
+        upload = self.csv_upload([
+            'event_ref,event,user_id,amount,split_method,paid_by,paid_time',
+            f'1,Trip,{a},10.50,EXACT,{a},2023-05-01 10:00:00',
+            f'1,Trip,{b},4.50,EXACT,{a},2023-05-01 10:00:00',
+            f'2,Cab,{c},abc,EXACT,,',
+            '3,Cab,9999,3,EXACT,,',
+            f'4,Yacht,{a},100000000,EXACT,,',
+            f',Snacks,{c},2,,,2023-06-02',
+        ])
+        report = self.client.post(reverse('import_expenses'), {'file': upload}).json()
+        self.assertEqual((report['rows'], report['imported'], report['events']), (6, 3, 2))
+        self.assertEqual(report['errors'], [
+            {'line': 4, 'error': 'Invalid amount'},
+            {'line': 5, 'error': 'user mentioned in the split is not found'},
+            {'line': 6, 'error': 'Invalid amount'},
+        ])
+
+        trip = Event.objects.get(name='Trip')
+        self.assertEqual((trip.amount, trip.payer_id, trip.splits.count()), (Decimal('15.00'), a, 2))
+        self.assertEqual(trip.created_at.isoformat(), '2023-05-01T10:00:00+00:00')
+        self.assertEqual(UserBalance.objects.get(user_id=b).total_amount, Decimal('4.50'))
+        self.assertEqual(Expense.objects.get(event__name='Snacks').created_at.date().isoformat(), '2023-06-02')
+
+    def test_xlsx_import_in_chunks(self):
+        from io import BytesIO
+        from openpyxl import Workbook
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .imports import import_rows, read_rows
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Event', 'User ID', 'Amount', 'Split Method'])
+        for i in range(25):
+            sheet.append([f'Row {i}', self.ids[i % 3], i + 1, 'EXACT'])
+        output = BytesIO()
+        workbook.save(output)
+        output.seek(0)
+
+        reports = list(import_rows(read_rows(output, 'xlsx'), chunk_size=10))
+        self.assertEqual([report['imported'] for report in reports], [10, 20, 25])
+        self.assertTrue(reports[-1]['done'])
+        self.assertEqual(Expense.objects.count(), 25)
+
+        upload = SimpleUploadedFile('broken.xlsx', b'not a workbook')
+        response = self.client.post(reverse('import_expenses'), {'file': upload})
+        self.assertEqual(response.json(), {'error': 'Invalid xlsx file'})
+
+    def test_missing_columns_and_streamed_progress(self):
+        response = self.client.post(reverse('import_expenses'), {'file': self.csv_upload(['event,amount'])})
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'Missing columns: user_id'))
+
+        upload = self.csv_upload(['event,user_id,amount', f'Tea,{self.ids[0]},1'])
+        response = self.client.post(reverse('import_expenses') + '?stream=1', {'file': upload})
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[-1]['imported'], 1)
+
+        response = self.client.post(reverse('import_expenses'), {'file': self.csv_upload(['event,user_id,amount'])})
+        self.assertEqual((response.json()['rows'], response.json()['done']), (0, True))
+
+    def test_undecodable_rows_end_the_import_with_a_report(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        # Past the first block the header read decodes.
+        lines = ['event,user_id,amount'] + [f'Tea {i},{self.ids[0]},1' for i in range(1000)]
+        upload = SimpleUploadedFile('history.csv', '\n'.join(lines).encode() + b'\nCaf\xe9,1,1\n')
+        imported = []
+        for params in ('', '?stream=1'):
+            upload.seek(0)
+            response = self.client.post(reverse('import_expenses') + params, {'file': upload})
+            if params:
+                report = json.loads(b''.join(response.streaming_content).splitlines()[-1])
+            else:
+                report = response.json()
+            self.assertEqual((report['done'], report['error_count'], report['rows']), (True, 1, report['imported']))
+            self.assertEqual(report['errors'][0]['line'], report['imported'] + 2)
+            self.assertIn('expected UTF-8 text', report['errors'][0]['error'])
+            imported.append(report['imported'])
+        self.assertTrue(0 < imported[0] < 1000)
+        self.assertEqual(Expense.objects.count(), sum(imported))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserDirectoryTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.user = User.objects.create(email='taken@gmail.com', name='Taken', mobile_number='1234567890')
+
+    def signup(self, email, url='home'):
+        payload = {'email': email, 'name': 'New', 'mobile_number': '0987654321', 'password': 'secret'}
+        return post_json(self.client, url, payload)
+
+    def test_duplicate_signup_is_rejected_before_hashing(self):
+        with self.assertNumQueries(3):
+            response = self.signup('taken@gmail.com')
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'Email already registered'))
+
+        self.assertEqual(self.signup('fresh@gmail.com').status_code, 200)
+        # The filter now knows the new email without rebuilding.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.signup('fresh@gmail.com').status_code, 400)
+
+    def test_unique_constraint_race_is_a_client_error(self):
+        directory.email_filter()
+        # Registered behind the directory's back, e.g. by another worker.
+        User.objects.create(email='raced@gmail.com', name='Raced', mobile_number='1234567890')
+        response = self.signup('raced@gmail.com')
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'Email already registered'))
+
+    def test_user_details_are_served_from_the_directory(self):
+        self.client.get(reverse('user_details', args=[self.user.id]))
+        cache.clear()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('user_details', args=[self.user.id]))
+        self.assertEqual(response.json(), {
+            'id': self.user.id, 'email': 'taken@gmail.com', 'name': 'Taken', 'mobile_number': '1234567890'
+        })
+
+    def test_bulk_signup(self):
+        users = [{'email': f'bulk{i}@gmail.com', 'name': f'Bulk {i}', 'mobile_number': '0987654321'} for i in range(3)]
+        response = post_json(self.client, 'create_users_batch', {'users': users})
+        self.assertEqual([user['email'] for user in response.json()['users']], [user['email'] for user in users])
+        self.assertEqual(User.objects.filter(email__startswith='bulk').count(), 3)
+
+        users[1]['email'] = 'taken@gmail.com'
+        users[2]['mobile_number'] = '1'
+        response = post_json(self.client, 'create_users_batch', users)
+        self.assertEqual(response.json()['error'], 'User 2: Invalid mobile number')
+        response = post_json(self.client, 'create_users_batch', users[:2])
+        self.assertEqual(response.json()['error'], 'Email already registered: bulk0@gmail.com, taken@gmail.com')
+
+    def test_password_must_be_a_string(self):
+        for password in (123, ['secret'], ''):
+            payload = {'email': 'typed@gmail.com', 'name': 'Typed', 'mobile_number': '0987654321', 'password': password}
+            response = post_json(self.client, 'home', payload)
+            self.assertEqual((response.status_code, response.json()['error']), (400, 'Invalid password'))
+            response = post_json(self.client, 'create_users_batch', [payload])
+            self.assertEqual(response.json()['error'], 'User 0: Invalid password')
+        self.assertFalse(User.objects.filter(email='typed@gmail.com').exists())
+
+    @override_settings(EXPENSES_PASSWORD_HASH_WORKERS=3)
+    def test_bulk_signup_hashes_on_a_thread_pool(self):
+        from django.contrib.auth.hashers import check_password
+
+        users = [{'email': f'hashed{i}@gmail.com', 'name': f'Hashed {i}', 'mobile_number': '0987654321',
+                  'password': f'secret{i}'} for i in range(3)]
+        post_json(self.client, 'create_users_batch', users)
+        stored = User.objects.filter(email__startswith='hashed').order_by('id').values_list('password', flat=True)
+        self.assertEqual([check_password(f'secret{i}', password) for i, password in enumerate(stored)], [True] * 3)
+
+    def test_email_filter_is_rebuilt_outside_the_lock(self):
+        from unittest import mock
+
+        old = directory.email_filter()
+        old.count = old.capacity + 1
+        # While one thread rebuilds the filter, the others keep the old one.
+        with directory.build_lock, self.assertNumQueries(0):
+            self.assertIs(directory.email_filter(), old)
+
+        def stored_emails():
+            # A signup completes while the new filter is being built.
+            directory.add([User(id=999, email='late@gmail.com', name='Late', mobile_number='1234567890')])
+            yield 'taken@gmail.com'
+
+        with mock.patch.object(directory, 'stored_emails', stored_emails):
+            rebuilt = directory.email_filter()
+        self.assertIsNot(rebuilt, old)
+        self.assertIn('late@gmail.com', rebuilt)
+        self.assertIsNone(directory.added)
+
+    def test_bloom_filter_and_lru(self):
+        emails = BloomFilter(1000)
+        for i in range(1000):
+            emails.add(f'user{i}@gmail.com')
+        self.assertTrue(all(f'user{i}@gmail.com' in emails for i in range(1000)))
+        self.assertLess(sum(f'other{i}@gmail.com' in emails for i in range(10000)), 300)
+
+        users = LRUCache(maxsize=2, ttl=10)
+        users.set(1, 'a', now=0)
+        users.set(2, 'b', now=0)
+        users.get(1, now=1)
+        users.set(3, 'c', now=1)
+        self.assertEqual((users.get(1, now=2), users.get(2, now=2), users.get(3, now=12)), ('a', None, None))
+
+
+class ArchiveTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        from .imports import import_all
+
+        self.client = Client()
+        self.a, self.b = create_users('archive', 2)
+        rows = [
+            {'event_ref': '1', 'event': 'Old trip', 'user_id': self.a.id, 'amount': '30', 'paid_by': self.a.id,
+             'paid_time': '2020-01-01 10:00:00'},
+            {'event_ref': '1', 'event': 'Old trip', 'user_id': self.b.id, 'amount': '20', 'paid_by': self.a.id,
+             'paid_time': '2020-01-01 10:00:00'},
+            {'event_ref': '2', 'event': 'Old cab', 'user_id': self.a.id, 'amount': '5', 'paid_time': '2020-02-01'},
+        ]
+        import_all(enumerate(rows, start=2))
+        post_json(self.client, 'add', {
+            'event': 'Lunch', 'amount': 10, 'split_method': 'EQUAL', 'splits': [self.a.id, self.b.id]
+        })
+
+    def archive(self):
+        from .archive import archive_cutoff, archive_expenses
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return list(archive_expenses(archive_cutoff(365), batch_size=2))
+
+    def test_archiving_moves_old_rows_in_batches(self):
+        from .analytics import verify_rollups
+        from .archive import ArchivedExpense
+        from .balances import verify_balances
+
+        self.client.get(reverse('user_expenses', args=[self.a.id]))
+        self.assertEqual(self.archive(), [2, 3])
+        self.assertEqual(ArchivedExpense.objects.count(), 3)
+        self.assertEqual(list(Expense.objects.values_list('event__name', flat=True).distinct()), ['Lunch'])
+        self.assertEqual((verify_balances(), verify_rollups()), ([], []))
+
+        response = self.client.get(reverse('user_expenses', args=[self.a.id]))
+        self.assertEqual([row['Event'] for row in response.json()], ['Lunch'])
+        self.assertEqual(self.client.get(reverse('user_balance', args=[self.a.id])).json()['total_amount'], '40.00')
+        self.assertEqual(self.archive(), [])
+
+    def test_include_archived_merges_both_tables(self):
+        self.archive()
+        url = reverse('user_expenses', args=[self.a.id])
+        first = self.client.get(url, {'include_archived': '1', 'limit': 2})
+        second = self.client.get(url, {'include_archived': '1', 'limit': 2, 'cursor': first['X-Next-Cursor']})
+        self.assertEqual([row['Event'] for row in first.json() + second.json()], ['Old trip', 'Old cab', 'Lunch'])
+
+        overall = self.client.get(reverse('all_expenses'), {'include_archived': 'true'}).json()
+        self.assertEqual([[row['Event'] for row in rows] for rows in overall], [['Old trip', 'Old cab', 'Lunch'], ['Old trip', 'Lunch']])
+        self.assertEqual(sum(map(len, self.client.get(reverse('all_expenses')).json())), 2)
+
+        event = Event.objects.get(name='Old trip')
+        self.assertEqual(len(self.client.get(reverse('event_details', args=[event.id])).json()['splits']), 2)
+        balances = self.client.get(reverse('settle_up'), {'event_id': event.id}).json()['balances']
+        self.assertEqual(balances, {str(self.a.id): '20.00', str(self.b.id): '-20.00'})
+
+    async def test_async_overall_matches_sync(self):
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncClient
+
+        await sync_to_async(self.archive)()
+        client = AsyncClient()
+        for params in ({}, {'include_archived': 'true'}):
+            expected = (await sync_to_async(self.client.get)(reverse('all_expenses'), params)).json()
+            response = await client.get(reverse('async_all_expenses'), params)
+            self.assertEqual(response.json(), expected)
+            response = await client.get(reverse('async_all_expenses'), {**params, 'stream': '1'})
+            self.assertEqual(json.loads(b''.join([chunk async for chunk in response.streaming_content])), expected)
+
+    def test_balance_sheet_with_archived_rows(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+
+        self.archive()
+        url = reverse('download_balance_sheet', args=[self.a.id])
+        for params, rows in (({}, 2), ({'include_archived': '1'}, 4)):
+            workbook = load_workbook(BytesIO(b''.join(self.client.get(url, params).streaming_content)))
+            self.assertEqual(workbook['Individual Expenses'].max_row, rows)
+
+
+class ParallelExportData:
+    def setUp(self):
+        super().setUp()
+        self.users = create_users('sheet', 3)
+        client = Client()
+        for i in range(4):
+            post_json(client, 'add', {
+                'event': f'Event <{i}> & co', 'amount': 30 + i, 'split_method': 'EQUAL',
+                'splits': [user.id for user in self.users]
+            })
+
+    def sheets(self, content):
+        from io import BytesIO
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(BytesIO(content), read_only=True)
+        return {sheet.title: [list(row) for row in sheet.iter_rows(values_only=True)] for sheet in workbook.worksheets}
+
+    def streamed_sheets(self, user, sheet_rows):
+        from .exports import individual_rows, stream_workbook, total_rows
+
+        return self.sheets(b''.join(stream_workbook([
+            ('Individual Expenses', individual_rows(user)), ('Total Expenses', total_rows())
+        ], sheet_rows=sheet_rows)))
+
+
+class ParallelExportTests(ParallelExportData, ExpensesTestCase):
+    def test_crc32_combine(self):
+        import zlib
+        from .parallel_exports import crc32_combine
+
+        for first, second in ((b'', b'abc'), (b'abc', b''), (b'hello ', b'world' * 1000)):
+            self.assertEqual(crc32_combine(zlib.crc32(first), zlib.crc32(second), len(second)), zlib.crc32(first + second))
+
+    def test_sharded_workbook_matches_streamed_one(self):
+        import zipfile
+        from io import BytesIO
+        from unittest import mock
+        from .parallel_exports import write_balance_sheet
+
+        user = self.users[0]
+        output = BytesIO()
+        with mock.patch('expenses.parallel_exports.MIN_SHARD_ROWS', 2), self.assertNumQueries(8 + 7):
+            shards = write_balance_sheet(user, output, sheet_rows=5)
+        # Two shards for the user's 4 rows, five for the 12 rows over three sheets.
+        self.assertEqual(shards, 7)
+        self.assertIsNone(zipfile.ZipFile(output).testzip())
+
+        sheets = self.sheets(output.getvalue())
+        self.assertEqual(sheets, self.streamed_sheets(user, sheet_rows=5))
+        self.assertEqual(list(sheets), [
+            'Individual Expenses', 'Total Expenses', 'Total Expenses (2)', 'Total Expenses (3)'
+        ])
+        self.assertEqual([len(rows) for rows in sheets.values()], [5, 6, 6, 3])
+        self.assertEqual(sheets['Total Expenses (3)'][1][:2], ['Sheet 2', 'Event <2> & co'])
+
+    def test_shards_leave_out_rows_added_later(self):
+        from unittest import mock
+        from django.db.models import Max
+        from .parallel_exports import plan_shards
+
+        last_id = Expense.objects.aggregate(value=Max('id'))['value']
+        with mock.patch('expenses.parallel_exports.MIN_SHARD_ROWS', 2):
+            planned = plan_shards(None, last_id, 1, sheet_rows=5)
+            post_json(Client(), 'add', {
+                'event': 'Late', 'amount': 30, 'split_method': 'EQUAL', 'splits': [self.users[0].id]
+            })
+            self.assertEqual(plan_shards(None, last_id, 1, sheet_rows=5), planned)
+
+
+@override_settings(EXPENSES_READ_REPLICA=None)
+class ParallelExportWorkerTests(ParallelExportData, TransactionTestCase):
+    # Worker processes only see committed rows.
+    def test_workbook_from_worker_processes(self):
+        from io import BytesIO
+        from unittest import mock
+        from .parallel_exports import write_balance_sheet
+
+        user = self.users[0]
+        output = BytesIO()
+        with mock.patch('expenses.parallel_exports.MIN_SHARD_ROWS', 2):
+            # Shards of two rows: two for the user's rows, seven over the three Total sheets.
+            self.assertEqual(write_balance_sheet(user, output, workers=2, sheet_rows=5), 9)
+        self.assertEqual(self.sheets(output.getvalue()), self.streamed_sheets(user, sheet_rows=5))
+
+
+@override_settings(EXPENSES_IDEMPOTENCY_WAIT=0)
+class IdempotencyTests(ExpensesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.user = User.objects.create(email='retry@gmail.com', name='Retry', mobile_number='1234567890')
+        self.payload = {'event': 'Taxi', 'amount': 25, 'split_method': 'EQUAL', 'splits': [self.user.id]}
+
+    def add(self, key, payload=None, url='add'):
+        return self.client.post(reverse(url), data=json.dumps(payload or self.payload),
+                                content_type='application/json', headers={'Idempotency-Key': key})
+
+    def test_retry_replays_stored_response(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        first = self.add('retry-1')
+        with CaptureQueriesContext(connection) as captured:
+            second = self.add('retry-1')
+        self.assertEqual((second.status_code, second.content), (200, first.content))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(any('expenses_expense' in query['sql'] for query in captured))
+        self.assertEqual(Expense.objects.count(), 1)
+
+        self.assertEqual(self.add('retry-2').status_code, 200)
+        post_json(self.client, 'add', self.payload)
+        self.assertEqual(Expense.objects.count(), 3)
+
+    def test_key_mismatch_in_progress_and_invalid(self):
+        from .models import IdempotencyKey
+
+        self.add('mismatch')
+        response = self.add('mismatch', dict(self.payload, amount=30))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.add('mismatch', url='add_batch').status_code, 422)
+        self.assertEqual(self.add('x' * 256).json(), {'error': 'Invalid Idempotency-Key'})
+
+        self.assertEqual(self.add('busy').status_code, 200)
+        IdempotencyKey.objects.filter(key='busy').update(status_code=None, response=None)
+        response = self.add('busy')
+        self.assertEqual((response.status_code, response['Retry-After']), (409, '1'))
+        self.assertEqual(Expense.objects.count(), 2)
+
+    def test_expired_and_abandoned_keys_run_again(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .idempotency import purge_expired_keys
+        from .models import IdempotencyKey
+
+        self.add('old')
+        self.add('stuck')
+        day_ago = timezone.now() - timedelta(days=1, seconds=1)
+        IdempotencyKey.objects.filter(key='old').update(created_at=day_ago)
+        IdempotencyKey.objects.filter(key='stuck').update(status_code=None, locked_at=day_ago)
+        self.assertNotIn('Idempotent-Replayed', self.add('old'))
+        self.assertNotIn('Idempotent-Replayed', self.add('stuck'))
+        self.assertEqual(Expense.objects.count(), 4)
+
+        IdempotencyKey.objects.filter(key='old').update(created_at=day_ago)
+        self.assertEqual(purge_expired_keys(), 1)
+
+    def test_validation_errors_are_stored_and_crashes_released(self):
+        from unittest import mock
+        from .models import IdempotencyKey
+
+        invalid = dict(self.payload, splits=[999])
+        self.assertEqual(self.add('invalid', invalid).status_code, 400)
+        self.assertEqual(self.add('invalid', invalid)['Idempotent-Replayed'], 'true')
+
+        with mock.patch('expenses.views.add_expense_events', side_effect=RuntimeError('database down')):
+            with self.assertRaises(RuntimeError):
+                self.add('crash')
+        self.assertFalse(IdempotencyKey.objects.filter(key='crash').exists())
+        self.assertEqual(self.add('crash').status_code, 200)
+
+    def test_server_error_rolls_back_the_writes(self):
+        from django.test import RequestFactory
+        from .idempotency import idempotent
+        from .ingest import add_expense_events
+        from .models import IdempotencyKey
+
+        @idempotent
+        def flaky(request):
+            add_expense_events([self.payload])
+            return JsonResponse({'error': 'Service unavailable'}, status=503)
+
+        request = RequestFactory().post('/add/', data=json.dumps(self.payload), content_type='application/json',
+                                        headers={'Idempotency-Key': 'flaky'})
+        self.assertEqual(flaky(request).status_code, 503)
+        self.assertEqual(Expense.objects.count(), 0)
+        self.assertFalse(IdempotencyKey.objects.filter(key='flaky').exists())
+
+    async def test_async_server_error_is_stored(self):
+        from django.test import RequestFactory
+        from .idempotency import idempotent
+        from .ingest import aadd_expense_events
+
+        @idempotent
+        async def flaky(request):
+            await aadd_expense_events([self.payload])
+            return JsonResponse({'error': 'Service unavailable'}, status=503)
+
+        def request():
+            return RequestFactory().post('/add/', data=json.dumps(self.payload), content_type='application/json',
+                                         headers={'Idempotency-Key': 'async-flaky'})
+        self.assertEqual((await flaky(request())).status_code, 503)
+        replayed = await flaky(request())
+        self.assertEqual((replayed.status_code, replayed['Idempotent-Replayed']), (503, 'true'))
+        self.assertEqual(await Expense.objects.acount(), 1)
+
+    async def test_async_add(self):
+        from django.test import AsyncClient
+
+        client = AsyncClient()
+        responses = [
+            await client.post(reverse('async_add'), data=json.dumps(self.payload), content_type='application/json',
+                              headers={'Idempotency-Key': 'async'})
+            for _ in range(2)
+        ]
+        self.assertEqual(responses[1].content, responses[0].content)
+        self.assertEqual(await Expense.objects.acount(), 1)
+
+
+class EventSearchTests(ExpensesTestCase):
+    def setUp(self):
+        from .search import prefix_index
+
+        super().setUp()
+        # Rolled-back test data leaves ids behind in the per-process index.
+        prefix_index.clear()
+        self.client = Client()
+        self.users = create_users('search', 2)
+        self.ids = [user.id for user in self.users]
+
+    def add(self, name, user_ids, days_ago=0):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        response = post_json(self.client, 'add', {
+            'event': name, 'amount': 10, 'split_method': 'EQUAL', 'splits': user_ids
+        })
+        event_id = response.json()['event_id']
+        Expense.objects.filter(event_id=event_id).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return event_id
+
+    def search(self, user_id, **params):
+        return self.client.get(reverse('search_user_expenses', args=[user_id]), params)
+
+    def test_search_user_expenses_by_word_prefix(self):
+        mine, other = self.ids
+        self.add('Team Lunch', [mine], days_ago=200)
+        self.add('Lunch at Café', [mine], days_ago=30)
+        self.add('Lunchbox refill', [mine], days_ago=10)
+        self.add('Dinner', [mine])
+        self.add('Lunch', [other])
+
+        for backend in ('fts5', 'memory'):
+            with self.subTest(backend=backend), override_settings(EXPENSES_SEARCH_BACKEND=backend):
+                cache.clear()
+                names = [row['Event'] for row in self.search(mine, q='lunch').json()]
+                self.assertEqual(names, ['Team Lunch', 'Lunch at Café', 'Lunchbox refill'])
+                self.assertEqual([row['Event'] for row in self.search(mine, q='LUN cafe').json()], ['Lunch at Café'])
+                self.assertEqual(self.search(mine, q='unch').json(), [])
+
+                from datetime import timedelta
+                from django.utils import timezone
+                recent = self.search(mine, q='lunch', **{'from': (timezone.now() - timedelta(days=90)).date().isoformat()})
+                self.assertEqual([row['Event'] for row in recent.json()], ['Lunch at Café', 'Lunchbox refill'])
+                page = self.search(mine, q='lunch', limit=2)
+                self.assertEqual(len(page.json()), 2)
+                rest = self.search(mine, q='lunch', limit=2, cursor=page['X-Next-Cursor']).json()
+                self.assertEqual([row['Event'] for row in rest], ['Lunchbox refill'])
+
+        self.assertEqual(self.search(mine).status_code, 400)
+        self.assertEqual(self.search(mine, q='!!').status_code, 400)
+        self.assertEqual(self.search(9999, q='lunch').status_code, 404)
+
+    def test_event_typeahead_sees_new_events(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        self.add('Groceries', self.ids)
+        for backend in ('fts5', 'memory'):
+            with self.subTest(backend=backend), override_settings(EXPENSES_SEARCH_BACKEND=backend):
+                self.assertEqual([event['name'] for event in self.client.get(reverse('event_list'), {'q': 'gro'}).json()],
+                                 ['Groceries'])
+        # Both indexes pick up events written after they were first used.
+        newest = self.add('Gross receipts', self.ids)
+        for backend in ('fts5', 'memory'):
+            with self.subTest(backend=backend), override_settings(EXPENSES_SEARCH_BACKEND=backend):
+                listed = self.client.get(reverse('event_list'), {'q': 'gro', 'limit': 1}).json()
+                self.assertEqual([event['id'] for event in listed], [newest])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+        listed = self.client.get(reverse('event_list'), {'q': 'gro rec'}).json()
+        self.assertEqual([event['name'] for event in listed], ['Gross receipts'])
+        self.assertEqual(self.client.get(reverse('event_list'), {'q': '-'}).status_code, 400)
+
+    def typeahead(self, q):
+        return sorted(event['id'] for event in self.client.get(reverse('event_list'), {'q': q}).json())
+
+    @override_settings(EXPENSES_SEARCH_BACKEND='fts5')
+    def test_fts5_index_follows_renames_and_deletes(self):
+        event_id = self.add('Brunch', self.ids)
+        Event.objects.filter(id=event_id).update(name='Supper club')
+        self.assertEqual(self.typeahead('brun'), [])
+        self.assertEqual(self.typeahead('sup clu'), [event_id])
+
+        Event.objects.filter(id=event_id).delete()
+        self.assertEqual(self.typeahead('sup'), [])
+
+    @override_settings(EXPENSES_SEARCH_BACKEND='memory')
+    def test_memory_index_reads_late_commits_once(self):
+        from .search import prefix_index
+
+        first = self.add('Museum', self.ids)
+        self.assertEqual(self.typeahead('mus'), [first])
+        # Commits in a different order than their ids were handed out.
+        Event.objects.create(id=first + 3, name='Museum cafe', split_method='EXACT')
+        self.assertEqual(self.typeahead('mus'), [first, first + 3])
+        self.assertEqual(prefix_index.missing, {first + 1, first + 2})
+        Event.objects.create(id=first + 1, name='Music hall', split_method='EXACT')
+        self.assertEqual(self.typeahead('mus'), [first, first + 1, first + 3])
+        self.assertEqual(prefix_index.missing, {first + 2})
+        self.assertEqual(len(prefix_index.postings['museum']), 2)
+
+    def test_mysql_boolean_query(self):
+        from unittest import mock
+        from .search import boolean_query, fulltext_search, search_backend, search_terms
+
+        self.assertIs(search_backend(mock.Mock(vendor='mysql')), fulltext_search)
+        terms = search_terms('-lunch +"team" (cafe*) ~big @3 <a> q\'s')
+        self.assertEqual(boolean_query(terms), '+lunch* +team* +cafe* +big* +3* +a* +q* +s*')
+        self.assertEqual(boolean_query(['te+am', '*', 'caf"e']), '+team* +cafe*')
+        matching = fulltext_search.matching(search_terms('Lunch-box'))
+        self.assertIn('MATCH(name) AGAINST (%s IN BOOLEAN MODE)', matching.sql)
+        self.assertEqual(matching.params, ['+lunch* +box*'])
+
+        # Words below innodb_ft_min_token_size are not in the index.
+        matching = fulltext_search.matching(search_terms('lu team'))
+        self.assertIn('MATCH(name) AGAINST (%s IN BOOLEAN MODE) AND (name LIKE %s OR name LIKE %s)', matching.sql)
+        self.assertEqual(matching.params, ['+team*', 'lu%', '% lu%'])
+        self.assertNotIn('MATCH', fulltext_search.matching(['l']).sql)
+
+    async def test_async_search(self):
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncClient
+        from .search import fts5_tables
+
+        mine, _ = self.ids
+        await sync_to_async(self.add)('Team Lunch', [mine])
+        await sync_to_async(self.add)('Dinner', [mine])
+        url = reverse('async_user_expenses', args=[mine])
+        for backend in (None, 'memory'):
+            with self.subTest(backend=backend), override_settings(EXPENSES_SEARCH_BACKEND=backend):
+                # A fresh worker has not looked for the FTS5 table yet.
+                fts5_tables.clear()
+                await sync_to_async(cache.clear)()
+                response = await AsyncClient().get(url, {'q': 'lun'})
+                self.assertEqual([row['Event'] for row in response.json()], ['Team Lunch'])
+
+
+@skipUnless(connection.vendor == 'mysql', 'needs MySQL for the FULLTEXT index')
+@override_settings(EXPENSES_READ_REPLICA=None, EXPENSES_SEARCH_BACKEND=None)
+class FullTextSearchTests(TransactionTestCase):
+    # InnoDB adds rows to a FULLTEXT index when their transaction commits.
+    def test_event_typeahead(self):
+        user = User.objects.create(email='fulltext@gmail.com', name='Full Text', mobile_number='1234567890')
+        for name in ('Lunch with team', 'Lunchbox (refill)', 'Dinner', 'Go karting'):
+            post_json(Client(), 'add', {
+                'event': name, 'amount': 10, 'split_method': 'EQUAL', 'splits': [user.id]
+            })
+
+        listed = Client().get(reverse('event_list'), {'q': 'lun'}).json()
+        self.assertEqual(sorted(event['name'] for event in listed), ['Lunch with team', 'Lunchbox (refill)'])
+        listed = Client().get(reverse('event_list'), {'q': '+lun -team'}).json()
+        self.assertEqual([event['name'] for event in listed], ['Lunch with team'])
+        listed = Client().get(reverse('event_list'), {'q': 'lu wi'}).json()
+        self.assertEqual([event['name'] for event in listed], ['Lunch with team'])
+        listed = Client().get(reverse('event_list'), {'q': 'ka'}).json()
+        self.assertEqual([event['name'] for event in listed], ['Go karting'])
@@ -1,11 +1,34 @@
 from django.urls import path
 from .views import *
+from . import async_views
 
 urlpatterns = [
     path('create_user',create_user,name='home'),
+    path('users/batch/', create_users_batch,name="create_users_batch"),
     path('user_details/<int:user_id>',user_details,name="user_details"),
+    path('login/<int:user_id>', login, name="login"),
+    path('whoami/', whoami, name="whoami"),
     path('add/', add_expenses,name="add"),
+    path('add/batch/', add_expenses_batch,name="add_batch"),
+    path('import/', import_expenses,name="import_expenses"),
+    path('events/', event_list,name="event_list"),
+    path('events/<int:event_id>/', event_details,name="event_details"),
+    path('balance/<int:user_id>/', user_balance,name="user_balance"),
+    path('analytics/<int:user_id>/', user_analytics,name="user_analytics"),
+    path('analytics/<int:user_id>/events/', user_event_analytics,name="user_event_analytics"),
+    path('settle/', settle_up,name="settle_up"),
     path('user/<int:user_id>/', user_expenses,name="user_expenses"),
+    path('user/<int:user_id>/search/', search_user_expenses,name="search_user_expenses"),
     path('overall/',overall_expenses,name="all_expenses"),
     path('download/<int:user_id>/', download_balance_sheet, name='download_balance_sheet'),
+    path('export/<int:user_id>/', request_balance_sheet, name='request_balance_sheet'),
+    path('export/job/<int:job_id>/', export_status, name='export_status'),
+    path('export/job/<int:job_id>/download/', download_export, name='download_export'),
+    path('metrics/', metrics, name='metrics'),
+
+    # Native async versions of the same endpoints for ASGI deployments.
+    path('async/user_details/<int:user_id>', async_views.user_details,name="async_user_details"),
+    path('async/add/', async_views.add_expenses,name="async_add"),
+    path('async/user/<int:user_id>/', async_views.user_expenses,name="async_user_expenses"),
+    path('async/overall/', async_views.overall_expenses,name="async_all_expenses"),
 ]
@@ -1,10 +1,26 @@
-from django.http import JsonResponse, HttpResponse
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
 import json
-from .models import User, Expense
+from .models import User, Event, UserBalance, ExportJob
+from .queries import parse_page_size, stream_expenses_grouped_by_user, user_expense_page
+from .serializers import JSON_CONTENT_TYPE, dumps, format_timestamps, json_response, stream_json_array
+from .exports import XLSX_CONTENT_TYPE, balance_sheet_stream
+from .archive import expense_models, include_archived
+from .jobs import expense_data_version, request_export
+from .ingest import ExpenseValidationError, add_expense_events
+from .imports import ImportFormatError, file_format_for, import_all, import_rows, read_rows
+from .balances import AMOUNT_FIELDS
+from .analytics import user_event_spend, user_spend
+from .settlement import cached_net_balances, event_net_balances, simplify_debts
+from .routers import replica_reads
+from .cache import cached_response, invalidate_users
+from .idempotency import idempotent
+from .profiling import metrics_store, timed
+from .directory import UserValidationError, directory, register_user, register_users
+from .auth import client_ip, issue_token, login_retry_after, login_succeeded, token_user_id, verify_password
+from .search import matching_events
+from django.conf import settings
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
-from openpyxl import Workbook
-from io import BytesIO
-from django.utils.timezone import make_naive
 
 @csrf_exempt
 def create_user(request):
@@ -14,17 +30,11 @@ def create_user(request):
         except json.JSONDecodeError:
             return JsonResponse({'error': 'Invalid JSON input'}, status=400)
         
-        if '@gmail.com' not in data.get("email", ""):
-            return JsonResponse({'error': 'Invalid email address'}, status=400)
-        if len(data.get('mobile_number', '')) != 10:
-            return JsonResponse({'error': 'Invalid mobile number'}, status=400)
-        
-        user = User.objects.create(
-            email=data['email'],
-            name=data['name'],
-            mobile_number=data['mobile_number'],
-            password=data['password']
-        )
+        try:
+            user = register_user(data)
+        except UserValidationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        invalidate_users([user.id])
         return JsonResponse({
             'id': user.id,
             'email': user.email,
@@ -34,174 +44,410 @@ def create_user(request):
     
     return JsonResponse({'error': 'Invalid method'}, status=400)
 
+@csrf_exempt
+def create_users_batch(request):
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON input'}, status=400)
+        
+        items = data.get('users') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return JsonResponse({'error': 'A non-empty list of users is required'}, status=400)
+        
+        try:
+            users = register_users(items)
+        except UserValidationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        invalidate_users([user.id for user in users])
+        return JsonResponse({
+            'message': 'Users created successfully',
+            'users': [{
+                'id': user.id,
+                'email': user.email,
+                'name': user.name,
+                'mobile_number': user.mobile_number
+            } for user in users]
+        })
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@csrf_exempt
 def login(request, user_id):
     if request.method == "POST":
+        retry_after = login_retry_after(user_id, client_ip(request))
+        if retry_after:
+            response = JsonResponse({'error': 'Too many login attempts'}, status=429)
+            response['Retry-After'] = str(max(1, round(retry_after)))
+            return response
         try:
             data = json.loads(request.body)
         except json.JSONDecodeError:
             return JsonResponse({'error': 'Invalid JSON input'}, status=400)
-        user = User.objects.filter(id=user_id).first()
-        if user and data['password'] == user.password:
-            return JsonResponse({'message': 'Login successful'})
+        if not isinstance(data, dict) or not isinstance(data.get('password', ''), str):
+            return JsonResponse({'error': 'Invalid JSON input'}, status=400)
+        user = User.objects.only('id', 'password').filter(id=user_id).first()
+        if user and verify_password(user, data.get('password', '')):
+            login_succeeded(user.id)
+            return JsonResponse({'message': 'Login successful', 'token': issue_token(user.id)})
         else:
             return JsonResponse({'error': 'Incorrect password'}, status=400)
     return JsonResponse({'error': 'Invalid method'}, status=400)
 
+def whoami(request):
+    if request.method == "GET":
+        user_id = token_user_id(request)
+        if user_id is None:
+            return JsonResponse({'error': 'Invalid or expired token'}, status=401)
+        return JsonResponse({'id': user_id})
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@replica_reads()
+@cached_response()
 def user_details(request, user_id):
     if request.method == "GET":
-        try:
-            user = User.objects.get(id=user_id)
-            return JsonResponse({
-                'id': user.id,
-                'email': user.email,
-                'name': user.name,
-                'mobile_number': user.mobile_number
-            })
-        except User.DoesNotExist:
+        user = directory.get(user_id)
+        if user is None:
             return JsonResponse({'error': 'User not found'}, status=404)
+        return JsonResponse(user)
     
     return JsonResponse({'error': 'Invalid method'}, status=400)
 
 @csrf_exempt
+@idempotent
 def add_expenses(request):
     if request.method == "POST":
-        data = json.loads(request.body)
-        
-        if data['split_method'] == 'PERCENTAGE':
-            total_percentage = sum(split['percentage'] for split in data['splits'])
-            if total_percentage != 100:
-                return JsonResponse({'error': 'Percentages must add up to 100'}, status=400)
-        
-        if data['split_method'] == 'EQUAL':
-            split_amount = data['amount'] / len(data['splits'])
-            for user_id in data['splits']:
-                user=User.objects.get(id=user_id)
-                if not user:
-                    return JsonResponse({'error':'user mentioned in the split is not found'},staus=400)
-                Expense.objects.create(
-                    Event=data['event'],
-                    user_id=user_id,
-                    amount=split_amount,
-                    split_method=data['split_method']
-                )
-        
-        elif data['split_method'] == 'EXACT':
-            for split in data['splits']:
-                user=User.objects.get(id=split['user_id'])
-                if not user:
-                    return JsonResponse({'error':'user mentioned in the split is not found'},staus=400)
-                Expense.objects.create(
-                    Event=data['event'],
-                    user_id=split['user_id'],
-                    amount=split['amount'],
-                    split_method=data['split_method']
-                )
-        
-        elif data['split_method'] == 'PERCENTAGE':
-            for split in data['splits']:
-                user=User.objects.get(id=split['user_id'])
-                if not user:
-                    return JsonResponse({'error':'user mentioned in the split is not found'},staus=400)
-                amount = data['amount'] * (split['percentage'] / 100)
-                Expense.objects.create(
-                    Event=data['event'],
-                    user_id=split['user_id'],
-                    amount=amount,
-                    split_method=data['split_method']
-                )
-        
-        return JsonResponse({'message': 'Expenses added successfully'})
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON input'}, status=400)
+        
+        try:
+            expenses = add_expense_events([data])
+        except ExpenseValidationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        return JsonResponse({'message': 'Expenses added successfully', 'event_id': expenses[0].event_id})
     
     return JsonResponse({'error': 'Invalid method'}, status=400)
 
 @csrf_exempt
+@idempotent
+def add_expenses_batch(request):
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON input'}, status=400)
+        
+        events = data.get('events') if isinstance(data, dict) else data
+        if not isinstance(events, list) or not events:
+            return JsonResponse({'error': 'A non-empty list of events is required'}, status=400)
+        
+        try:
+            created = add_expense_events(events)
+        except ExpenseValidationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        return JsonResponse({
+            'message': 'Expenses added successfully',
+            'events': len(events),
+            'expenses': len(created),
+            'event_ids': list(dict.fromkeys(expense.event_id for expense in created))
+        })
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+def event_summary(event):
+    return {
+        'id': event.id,
+        'name': event.name,
+        'payer_id': event.payer_id,
+        'split_method': event.split_method,
+        'amount': str(event.amount),
+        'created_at': format_timestamps([event.created_at])[0]
+    }
+
+@replica_reads(per_user=False)
+def event_list(request):
+    if request.method == "GET":
+        events = Event.objects.order_by('-created_at', '-id')
+        try:
+            limit = parse_page_size(request.GET.get('limit'))
+            if request.GET.get('q'):
+                events = events.filter(id__in=matching_events(request.GET['q']))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        if request.GET.get('name'):
+            events = events.filter(name=request.GET['name'])
+        return json_response([event_summary(event) for event in events[:limit]])
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@replica_reads(per_user=False)
+def event_details(request, event_id):
+    if request.method == "GET":
+        try:
+            event = Event.objects.select_related('payer').get(id=event_id)
+        except Event.DoesNotExist:
+            return JsonResponse({'error': 'Event not found'}, status=404)
+        
+        data = event_summary(event)
+        data['payer'] = event.payer.name if event.payer else None
+        # Old events may have had their splits archived, so both tables are
+        # read in one UNION query.
+        live, archived = [
+            model.objects.filter(event_id=event.id).values_list('id', 'user_id', 'user__name', 'amount')
+            for model in expense_models(True)
+        ]
+        data['splits'] = [
+            {'user_id': user_id, 'name': name, 'amount': str(amount)}
+            for _, user_id, name, amount in live.union(archived, all=True).order_by('id')
+        ]
+        return json_response(data)
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@csrf_exempt
+def import_expenses(request):
+    if request.method == "POST":
+        upload = request.FILES.get('file')
+        if upload is None:
+            return JsonResponse({'error': 'Upload a csv or xlsx file in the "file" field'}, status=400)
+        
+        try:
+            rows = read_rows(upload.file, request.GET.get('format') or file_format_for(upload.name))
+        except ImportFormatError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        if request.GET.get('stream'):
+            # One JSON line per committed chunk, then the final report.
+            return StreamingHttpResponse((dumps(report) + b'\n' for report in import_rows(rows)),
+                                         content_type='application/x-ndjson')
+        return json_response(import_all(rows))
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@replica_reads()
+def user_balance(request, user_id):
+    if request.method == "GET":
+        balance = UserBalance.objects.filter(user_id=user_id).first()
+        if balance is None:
+            if not User.objects.filter(id=user_id).exists():
+                return JsonResponse({'error': 'User not found'}, status=404)
+            balance = UserBalance(user_id=user_id)
+        
+        return JsonResponse({
+            'id': balance.user_id,
+            'total_amount': balance.total_amount,
+            'expense_count': balance.expense_count,
+            'split_methods': {
+                split_method: {
+                    'amount': getattr(balance, amount_field),
+                    'count': getattr(balance, count_field)
+                } for split_method, (amount_field, count_field) in AMOUNT_FIELDS.items()
+            }
+        })
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@replica_reads()
+@cached_response()
+def user_analytics(request, user_id):
+    if request.method == "GET":
+        try:
+            buckets = user_spend(user_id, request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        if not buckets and not User.objects.filter(id=user_id).exists():
+            return JsonResponse({'error': 'User not found'}, status=404)
+        return json_response(buckets)
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@replica_reads()
+@cached_response()
+def user_event_analytics(request, user_id):
+    if request.method == "GET":
+        try:
+            buckets = user_event_spend(user_id, request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        if not buckets and not User.objects.filter(id=user_id).exists():
+            return JsonResponse({'error': 'User not found'}, status=404)
+        return json_response(buckets)
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@replica_reads(per_user=False)
+def settle_up(request):
+    if request.method == "GET":
+        event_id = request.GET.get('event_id')
+        if event_id is None:
+            net_balances = cached_net_balances()
+        else:
+            try:
+                event_id = int(event_id)
+            except ValueError:
+                return JsonResponse({'error': 'Invalid event_id'}, status=400)
+            if not Event.objects.filter(id=event_id).exists():
+                return JsonResponse({'error': 'Event not found'}, status=404)
+            net_balances = event_net_balances(event_id)
+        payments = simplify_debts(net_balances)
+        
+        return JsonResponse({
+            'balances': {user_id: balance for user_id, balance in net_balances.items() if balance},
+            'transactions': [{
+                'from': debtor,
+                'to': creditor,
+                'amount': amount
+            } for debtor, creditor, amount in payments]
+        })
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@replica_reads()
+@csrf_exempt
+@cached_response()
 def user_expenses(request, user_id):
     try:
         user = User.objects.get(id=user_id)
-        splits = Expense.objects.filter(user_id=user_id).all()
+        split_data, next_cursor = user_expense_page(user, request.GET)
         
-        if not splits:
+        if not split_data and not request.GET:
             return JsonResponse({'error': 'No expenses found for this user'}, status=404)
         
-        split_data = [{
-            'Name': user.name,
-            'Event': split.Event,
-            'amount': split.amount,
-            'split_method': split.split_method,
-            'paid_time': make_naive(split.created_at).strftime('%Y-%m-%d %H:%M:%S')
-        } for split in splits]
-        
-        return JsonResponse(split_data, safe=False)
+        with timed('serialize'):
+            response = json_response(split_data)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
     
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)
 
+@replica_reads()
+@cached_response()
+def search_user_expenses(request, user_id):
+    if request.method == "GET":
+        if not request.GET.get('q'):
+            return JsonResponse({'error': 'A search query is required'}, status=400)
+        
+        try:
+            user = User.objects.get(id=user_id)
+            split_data, next_cursor = user_expense_page(user, request.GET)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except User.DoesNotExist:
+            return JsonResponse({'error': 'User not found'}, status=404)
+        
+        with timed('serialize'):
+            response = json_response(split_data)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+@replica_reads(per_user=False)
 @csrf_exempt
+@cached_response(per_user=False)
 def overall_expenses(request):
-    users = User.objects.all()
-    total_expenses = []
-    
-    for user in users:
-        splits = Expense.objects.filter(user_id=user.id).all()
-        each_expenses = [{
-            'Name': user.name,
-            'Event': split.Event,
-            'amount': split.amount,
-            'split_method': split.split_method,
-            'paid_time': make_naive(split.created_at).strftime('%Y-%m-%d %H:%M:%S')
-        } for split in splits]
-        total_expenses.append(each_expenses)
-    
-    return JsonResponse(total_expenses, safe=False)
+    total_expenses = stream_expenses_grouped_by_user(include_archived(request.GET))
+    
+    if request.GET.get('stream'):
+        return StreamingHttpResponse(stream_json_array(total_expenses), content_type=JSON_CONTENT_TYPE)
+    with timed('serialize'):
+        return HttpResponse(b''.join(stream_json_array(total_expenses)), content_type=JSON_CONTENT_TYPE)
 
+@replica_reads(per_user=False)
 @csrf_exempt
 def download_balance_sheet(request, user_id):
     if request.method == "GET":
-        workbook = Workbook()
+        try:
+            user = User.objects.get(id=user_id)
+        except User.DoesNotExist:
+            return JsonResponse({'error': 'User not found'}, status=404)
         
-        ws1 = workbook.active
-        ws1.title = 'Individual Expenses'
-        ws1.append(['Name', 'Event', 'Amount', 'Split Method', 'Paid Time'])
+        sheet = balance_sheet_stream(user, include_archived(request.GET))
+        response = StreamingHttpResponse(sheet, content_type=XLSX_CONTENT_TYPE)
+        response['Content-Disposition'] = f'attachment; filename="balance_sheet.xlsx"'
         
+        return response
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+def export_job_status(job):
+    data = {
+        'job_id': job.id,
+        'user_id': job.user_id,
+        'status': job.status,
+    }
+    if job.status == ExportJob.DONE:
+        data['download_url'] = reverse('download_export', args=[job.id])
+    if job.status == ExportJob.FAILED:
+        data['error'] = job.error
+    return data
+
+@csrf_exempt
+def request_balance_sheet(request, user_id):
+    if request.method == "POST":
         try:
             user = User.objects.get(id=user_id)
-            splits = Expense.objects.filter(user_id=user_id).all()
-            
-            for split in splits:
-                paid_time = make_naive(split.created_at).strftime('%Y-%m-%d %H:%M:%S')
-                ws1.append([
-                    user.name,
-                    split.Event,
-                    split.amount,
-                    split.split_method,
-                    paid_time
-                ])
         except User.DoesNotExist:
             return JsonResponse({'error': 'User not found'}, status=404)
         
-        ws2 = workbook.create_sheet(title='Total Expenses')
-        ws2.append(['Name', 'Event', 'Amount', 'Split Method', 'Paid Time'])
-        
-        users = User.objects.all()
-        for user in users:
-            splits = Expense.objects.filter(user_id=user.id).all()
-            for split in splits:
-                paid_time = make_naive(split.created_at).strftime('%Y-%m-%d %H:%M:%S')
-                ws2.append([
-                    user.name,
-                    split.Event,
-                    split.amount,
-                    split.split_method,
-                    paid_time
-                ])
-        
-        output = BytesIO()
-        workbook.save(output)
-        output.seek(0)
-        
-        response = HttpResponse(output, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="balance_sheet.xlsx"'
+        job, _ = request_export(user)
+        status = 200 if job.status == ExportJob.DONE else 202
+        response = JsonResponse(export_job_status(job), status=status)
+        response['Location'] = reverse('export_status', args=[job.id])
         
         return response
     
     return JsonResponse({'error': 'Invalid method'}, status=400)
+
+def export_status(request, job_id):
+    if request.method == "GET":
+        try:
+            job = ExportJob.objects.get(id=job_id)
+        except ExportJob.DoesNotExist:
+            return JsonResponse({'error': 'Export job not found'}, status=404)
+        
+        data = export_job_status(job)
+        data['stale'] = job.data_version != expense_data_version()
+        return JsonResponse(data)
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+def download_export(request, job_id):
+    if request.method == "GET":
+        try:
+            job = ExportJob.objects.get(id=job_id)
+        except ExportJob.DoesNotExist:
+            return JsonResponse({'error': 'Export job not found'}, status=404)
+        
+        if job.status != ExportJob.DONE:
+            return JsonResponse({'error': 'Export is not ready', 'status': job.status}, status=409)
+        try:
+            output = open(job.file_path, 'rb')
+        except FileNotFoundError:
+            return JsonResponse({'error': 'Export file is missing, request it again'}, status=410)
+        
+        return FileResponse(output, as_attachment=True, filename='balance_sheet.xlsx', content_type=XLSX_CONTENT_TYPE)
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)
+
+def metrics(request):
+    if not getattr(settings, 'EXPENSES_PROFILING', False):
+        return JsonResponse({'error': 'Profiling is disabled'}, status=404)
+    if request.method == "GET":
+        return JsonResponse(metrics_store.snapshot())
+    
+    return JsonResponse({'error': 'Invalid method'}, status=400)